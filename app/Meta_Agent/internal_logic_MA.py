@@ -2,14 +2,12 @@
 import logging
 from datetime import datetime, timezone
 import threading
-from pydantic_ai.messages import (
-    ModelRequest,
-    ModelResponse,
-    UserPromptPart,
-    TextPart,
-)
+from pydantic_ai.messages import ModelMessage
 from pydantic_graph import GraphRunContext
-from ..classes import MultiAgentDeps, MultiAgentState, ChatMessage  # Import Fritsdeps from classes
+from ..classes import MultiAgentDeps, MultiAgentState, ChatMessage, MessageLog  # Import Fritsdeps from classes
+from ..history import get_history_view
+from ..response_cache import cached_stage_output
+from ..framework_selector import select_framework_context
 from ..promptconfig import general_topic_info_full, general_framework_info_company, framework_themes_company, general_framework_info_user, framework_themes_user 
 
 logging.debug("Current thread: %s", threading.current_thread().name)
@@ -23,7 +21,11 @@ logging.debug("Current thread: %s", threading.current_thread().name)
 ##################### STATIC & DYNAMIC SYSTEM PROMPTS #####################
 ###########################################################################
 
-def system_prompt() -> str:
+def system_prompt(
+    topic_info: str = general_topic_info_full,
+    framework_info_company: str = general_framework_info_company,
+    themes_company: str = framework_themes_company,
+) -> str:
     return (f"""
 
 **GOAL**
@@ -215,13 +217,13 @@ OMPREHENSIVE INTERVIEW CONTEXT GUIDELINES:
 ------------------------------------------------------------------------------------------------
 *TOPIC INFORMATION*
 Now that you understand what to do, here is information about the topic that is being interviewed about:
-{general_topic_info_full}
+{topic_info}
 
 
 *Frameworks and themes used through which the topic is analyzed (company maturity assesment)*
-{general_framework_info_company}
+{framework_info_company}
 
-{framework_themes_company}
+{themes_company}
 
 
 
@@ -233,13 +235,11 @@ Now that you understand what to do, here is information about the topic that is
 """
     )
     
-def get_latest_message_content(messages_dict: dict[str, ChatMessage]) -> str:
-      """Get the content of the most recent ChatMessage from a dictionary."""
-      if not messages_dict:
+def get_latest_message_content(messages_log: MessageLog[ChatMessage]) -> str:
+      """Get the content of the most recent ChatMessage from an append-only message log."""
+      latest_message = messages_log.latest()
+      if latest_message is None:
           return ""
-
-      # Find the message with the latest created_at timestamp
-      latest_message = max(messages_dict.values(), key=lambda msg: msg.created_at)
       return latest_message.content
 
 
@@ -442,34 +442,15 @@ def add_the_date() -> str:
 
 
 
-async def fetch_message_history(graph_ctx: GraphRunContext) -> str:
+async def fetch_message_history(graph_ctx: GraphRunContext) -> list[ModelMessage]:
     """
-    Constructs and returns the meta-agent prompt string using the internal conversation stored in 
-    graph_ctx.state.internalconversation. The messages are sorted by their creation time and 
-    formatted as "<role>: <content>".
+    Returns the user - Frits conversation history stored in graph_ctx.deps.conversation_history
+    as pydantic-ai ModelRequest/ModelResponse messages, oldest first.
     """
 
-    message_history = []
-    # Transform ChatMessage list to ModelRequest and ModelResponse format
-    if graph_ctx.deps.conversation_history:
-        # Optionally, sort by creation time if order matters
-        sorted_history = sorted(
-            graph_ctx.deps.conversation_history.values(),
-            key=lambda chat: chat.created_at
-        )
-        for chat in sorted_history:
-            if chat.role.lower() == "user":
-                message_history.append(
-                    ModelRequest(parts=[UserPromptPart(content=chat.content, timestamp=chat.created_at)])
-                )
-            elif chat.role.lower() in {"writer"}:
-                message_history.append(
-                    ModelResponse(parts=[TextPart(content=chat.content)])
-                )
-            else:
-                logging.error("Unknown chat role: %s", chat.role)
-
-    return message_history
+    # The ModelRequest/ModelResponse conversion is shared by all agents in the run and
+    # only extended with messages appended since the last call.
+    return get_history_view(graph_ctx.deps).model_messages()
 
 
 
@@ -486,8 +467,23 @@ async def MetaAgent_workflow(graph_ctx: GraphRunContext) -> GraphRunContext:
     ##### FETCH AGENT
     Meta_agent = graph_ctx.deps.meta_agent
 
+    ##### select only the framework sections relevant to the current phase and covered themes
+    selection = select_framework_context(
+        get_latest_message_content(graph_ctx.state.latest_phase_prompt),
+        graph_ctx.deps.covered_themes,
+    )
+    logging.info(
+        "Meta-agent framework selection: phase=%s themes=%s full=%s chars=%d",
+        selection.phase, selection.themes, selection.full, selection.chars,
+    )
+    framework_system_prompt = system_prompt(
+        selection.topic_info,
+        selection.framework_info_company,
+        selection.framework_themes_company,
+    )
+
     ##### prepare system prompt with user info 
-    dynamic_system_message = f"{system_prompt()}\n\n{await add_session_dynamic_info(graph_ctx)}\n\n{add_the_date()}"
+    dynamic_system_message = f"{framework_system_prompt}\n\n{await add_session_dynamic_info(graph_ctx)}\n\n{add_the_date()}"
 
     # append the user - Frits conversation history to the message history list
     message_history= await fetch_message_history(graph_ctx)
@@ -495,22 +491,25 @@ async def MetaAgent_workflow(graph_ctx: GraphRunContext) -> GraphRunContext:
 
     
     # RUN THE META-AGENT USING THE GENERATED INPUT
-    llm_response = await Meta_agent.run(user_prompt=dynamic_system_message, message_history=message_history)
+    llm_response = await cached_stage_output(
+        graph_ctx, "meta",
+        lambda: Meta_agent.run(user_prompt=dynamic_system_message, message_history=message_history),
+    )
 
 
 
     ##### SAVE ALL THE INFO OF THE RUN INSTANCE
     save_format = ChatMessage(
         role="Meta-agent",
-        content=str(llm_response.data),
+        content=llm_response,
         created_at=datetime.now(timezone.utc)
     )
 
-    # Save the message to the MA_response dictionary using its unique message_id as the key.
-    graph_ctx.state.MA_response[save_format.message_id] = save_format
+    # Append the message to the MA_response log (keyed by its unique message_id).
+    graph_ctx.state.MA_response.append(save_format)
 
-    # Also save the message to the internalconversation dictionary.
-    graph_ctx.state.internalconversation[save_format.message_id] = save_format
+    # Also append the message to the internalconversation log.
+    graph_ctx.state.internalconversation.append(save_format)
 
     return graph_ctx
 
@@ -1,9 +1,14 @@
 from __future__ import annotations
 import logging
+import os
 from typing import TYPE_CHECKING
 from pydantic_graph import GraphRunContext
 from datetime import datetime, timezone
-from ..classes import ChatMessage  
+from ..classes import ChatMessage, review_agent_deps
+from ..history import get_internal_transcript
+from ..rag import format_retrieved_context
+from ..model_routing import get_router
+from ..response_cache import cached_stage_output
 from pydantic_ai.messages import SystemPromptPart, ModelRequest
 from ..promptconfig import interview_goal_definition
 
@@ -165,18 +170,42 @@ The Meta-Agent must do a Sentiment Analysis, a Conversation Analysis, and a Prof
 async def update_reviewer_agent_user_prompt(graph_ctx: GraphRunContext) -> str:
     """
     Constructs and returns the meta-agent prompt string using the internal conversation stored in 
-    graph_ctx.state.internalconversation. The messages are sorted by their creation time and 
-    formatted as "<role>: <content>".
+    graph_ctx.state.internalconversation. The log is already in chronological order and 
+    each message is formatted as "<role>: <content>".
     """
-    # Sort the conversation messages chronologically.
-    sorted_messages = sorted(
-        graph_ctx.state.internalconversation.values(), 
-        key=lambda m: m.created_at
+    # Lines rendered on an earlier reviewer loop are reused, only new messages get formatted.
+    return get_internal_transcript(graph_ctx)
+
+
+async def retrieve_reviewer_context(graph_ctx: GraphRunContext) -> review_agent_deps:
+    """
+    Pull the framework and company context relevant to the latest interview context from the
+    local RAG engine. The latest Meta-agent output and user message are embedded as one batch.
+    """
+    latest_MA = graph_ctx.state.MA_response.latest()
+    queries = [
+        latest_MA.content if latest_MA else "",
+        getattr(graph_ctx.deps.user_message, "content", ""),
+    ]
+    rag_input = "\n\n".join(query for query in queries if query)
+    rag_deps = review_agent_deps(
+        RAG_tool_URL=os.getenv("RAG_TOOL_URL", "local"),
+        RAG_tool_KEY=os.getenv("RAG_TOOL_KEY", ""),
+        RAG_input=rag_input,
     )
-    # Build the prompt by formatting each message.
-    prompt_lines = [f"{msg.role}: {msg.content}" for msg in sorted_messages]
-    
-    return "\n".join(prompt_lines)
+
+    rag_engine = graph_ctx.deps.rag_engine
+    if rag_engine is None or not rag_input:
+        return rag_deps
+
+    try:
+        company_id = (graph_ctx.deps.user_profile or {}).get("company_id")
+        results = await rag_engine.retrieve(queries, company_id=company_id)
+        rag_deps.RAG_response = format_retrieved_context(results)
+    except Exception as e:
+        logging.error("Reviewer retrieval failed, reviewing without RAG context: %s", e)
+
+    return rag_deps
 
 
 ###############################################################################
@@ -190,6 +219,15 @@ async def ReviewerAgent_workflow(graph_ctx: GraphRunContext[MultiAgentState, Mul
     ### because message history in o1 models is fackt:
     internal_conv_as_string = await update_reviewer_agent_user_prompt(graph_ctx)
 
+    ### only the retrieved framework/company chunks are added, not the full framework text
+    rag_deps = await retrieve_reviewer_context(graph_ctx)
+    if rag_deps.RAG_response:
+        internal_conv_as_string += (
+            "\n\n-----------------------------------------------------------------------------------------------\n"
+            "RETRIEVED CONTEXT (RAG) - cite these references when you use them:\n"
+            f"{rag_deps.RAG_response}"
+        )
+
 
     ##### CREATE THE USER_PROMPT AND MESSAGE_HISTORY FOR THE RUN METHODS
 
@@ -197,21 +235,28 @@ async def ReviewerAgent_workflow(graph_ctx: GraphRunContext[MultiAgentState, Mul
    
     
     #### GENERATE THE FEEDBACK
-    reviewer_info_feedback = await reviewer_agent.run(user_prompt=internal_conv_as_string, message_history=system_prompt_part) 
+    reviewer_info_feedback = await cached_stage_output(
+        graph_ctx, "reviewer",
+        lambda: get_router(graph_ctx.deps).run(
+            reviewer_agent, "reviewer_review",
+            user_prompt=internal_conv_as_string, message_history=system_prompt_part, deps=rag_deps,
+            accept=lambda result: bool(str(result.data).strip()),
+        ),
+    )
     
 
     #### SAVE THE FEEDBACK IN THE RIGHT CLASS OBJECTS AND APPROVE OR REJECT
     save_format = ChatMessage(
         role="reviewer",
-        content=str(reviewer_info_feedback.data),
+        content=reviewer_info_feedback,
         created_at=datetime.now(timezone.utc)
     )
 
-    # Save the message to the RA_response dictionary using its unique message_id as the key.
-    graph_ctx.state.reviewer_response[save_format.message_id] = save_format
+    # Append the message to the RA_response log (keyed by its unique message_id).
+    graph_ctx.state.reviewer_response.append(save_format)
 
-    # Also save the message to the internalconversation dictionary.
-    graph_ctx.state.internalconversation[save_format.message_id] = save_format
+    # Also append the message to the internalconversation log.
+    graph_ctx.state.internalconversation.append(save_format)
 
    
    
@@ -1,14 +1,19 @@
 from ..classes import CompanyInfoMessage, UserInfoMessage 
+from ..fact_parsing import FACT_MODELS, UPDATE_PARSE_MAX_RETRIES, fact_parse_results, parse_facts
+from ..model_routing import get_router
 from ..promptconfig import framework_themes_user, framework_themes_company, general_topic_info_summary, general_framework_info_user, general_framework_info_company
 from pydantic_graph import GraphRunContext
-import json
 import logging
-import re
 from pydantic_ai.messages import (
     ModelRequest,
     SystemPromptPart
 )
-logging.basicConfig(level=logging.DEBUG)
+
+
+# Labels of the extraction answer's segments that are parsed into facts. extraction_system_prompt
+# asks for the "topic" labels; the "AIR" ones are what an earlier version of it produced.
+COMPANY_INFO_LABELS = ("[Company topic Info]", "[Company AIR Info]")
+USER_INFO_LABELS = ("[User topic Info]", "[User AIR Info]")
 
 
 ####### TODO: Make it clearer what represents a good and bad score for some AI readiness dimension
@@ -101,6 +106,9 @@ Below are the **theme labels** and their definitions. You must use these to dete
 4. Return only valid JSON with these four keys—no additional keys or text, and no surrounding explanations or markdown."""
 
 
+# Define repair prompt for the LLM (used when a parse result isn't valid JSON).
+json_repair_system_prompt = """You repair malformed JSON. The user message contains the output of another parser that should have been a single JSON object.
+Return only that JSON object, made valid: fix quoting, trailing commas and brackets, drop any text or markdown around it, and keep the keys and values that were intended. Do not add keys."""
 
 
 
@@ -131,39 +139,63 @@ async def update_agent_message_history(graph_ctx: GraphRunContext) -> str:
 
     # If either message is missing, fall back to returning the full conversation history.
     if not last_user_message or not last_frits_message:
-        sorted_messages = sorted(messages, key=lambda m: m.created_at)
-        return "\n".join(f"{msg.role}: {msg.content}" for msg in sorted_messages)
+        return "\n".join(f"{msg.role}: {msg.content}" for msg in messages)
 
     # Sort the two messages by their creation time.
     sorted_two = sorted([last_user_message, last_frits_message], key=lambda m: m.created_at)
     return "\n\n".join(f"{msg.role}: {msg.content}" for msg in sorted_two)
 
 
-def parse_json_result(text: str) -> dict:
-    # Remove leading/trailing whitespace
-    text = text.strip()
+def accepts_facts(kind: str):
+    """accept() check for routed parse tasks: the result must validate as facts of this kind."""
+    return lambda result: parse_facts(result.data, kind)[0] is not None
 
-    # Remove markdown code fences if they exist
-    if text.startswith("```"):
-        text = re.sub(r"^```(?:json)?\s*", "", text)
-        if text.endswith("```"):
-            text = text[:-3].strip()
 
-    # First try parsing the entire text
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        # Fallback: extract substring between the first '{' and the last '}'
-        start = text.find('{')
-        end = text.rfind('}')
-        if start != -1 and end != -1:
-            json_text = text[start:end+1]
-            try:
-                return json.loads(json_text)
-            except json.JSONDecodeError as e:
-                raise ValueError("Failed to extract valid JSON from the result.") from e
-        else:
-            raise ValueError("No JSON object found in the provided text.")
+async def parse_segment(graph_ctx: GraphRunContext, segment: str, kind: str, system_prompt: list) -> dict:
+    """
+    Parse one extracted segment into validated facts of the given kind ("user" or "company").
+    Answers that don't parse or don't match the schema get up to UPDATE_PARSE_MAX_RETRIES
+    json_repair calls that include the validation error. If none succeeds the fact is kept
+    with an empty content_dict, as before.
+    """
+    router = get_router(graph_ctx.deps)
+    update_agent = graph_ctx.deps.update_agent
+
+    result = await router.run(
+        update_agent, "update_parse",
+        user_prompt=segment, message_history=system_prompt,
+        accept=accepts_facts(kind),
+    )
+    logging.debug("Parsing result for %s info: %s", kind, result)
+    raw_result = result.data
+    facts, outcome, error = parse_facts(raw_result, kind)
+
+    system_prompt_repair = [ModelRequest(parts=[SystemPromptPart(content=json_repair_system_prompt)])]
+    expected_keys = ", ".join(f'"{key}"' for key in FACT_MODELS[kind].model_fields)
+    for _ in range(UPDATE_PARSE_MAX_RETRIES if facts is None else 0):
+        logging.debug("Retrying %s info parse: %s", kind, error)
+        try:
+            repaired = await router.run(
+                update_agent, "json_repair",
+                user_prompt=f"Expected keys: {expected_keys}.\nProblem: {error}\n\n{raw_result}",
+                message_history=system_prompt_repair,
+                accept=accepts_facts(kind),
+            )
+        except Exception as e:
+            error = str(e)
+            break
+        raw_result = repaired.data
+        facts, _, error = parse_facts(raw_result, kind)
+        if facts is not None:
+            outcome = "retried"
+            break
+
+    if facts is None:
+        fact_parse_results.inc(kind=kind, result="failed")
+        logging.warning("Could not parse %s info segment %r: %s", kind, segment[:200], error)
+        return {}
+    fact_parse_results.inc(kind=kind, result=outcome)
+    return facts
 
 
 
@@ -189,6 +221,7 @@ async def UpdateAgent_workflow(graph_ctx: GraphRunContext) -> GraphRunContext:
     """
     
     update_agent = graph_ctx.deps.update_agent
+    router = get_router(graph_ctx.deps)
 
     ####################################################################
     ####################################################################
@@ -201,7 +234,10 @@ async def UpdateAgent_workflow(graph_ctx: GraphRunContext) -> GraphRunContext:
     message_history = await update_agent_message_history(graph_ctx) #### this doesnt give latest two but all messages of the user
       
     # Call the update_agent to extract raw segments.
-    extraction_response = await update_agent.run(user_prompt=message_history, message_history=system_prompt_1)
+    extraction_response = await router.run(
+        update_agent, "update_extraction",
+        user_prompt=message_history, message_history=system_prompt_1,
+    )
     
     
     ####################################################################
@@ -224,44 +260,31 @@ async def UpdateAgent_workflow(graph_ctx: GraphRunContext) -> GraphRunContext:
 
             
       ##### COMPANY INFO DISTILLATION PART
-            if line.startswith("[Company AIR Info]"):
-                segment = line[len("[Company AIR Info]"):].strip()
-                result = await update_agent.run(user_prompt=segment, message_history=system_prompt_2)
-                logging.debug(f"Parsing result for Company AIR Info: {result}")
-            
-                try:
-                    parsed_data = parse_json_result(result.data)
-                except ValueError as e:
-                    logging.debug(f"Error parsing Company AIR Info: {e}")
-                    parsed_data = {}
+            label = line[:line.find("]") + 1]
+            if label in COMPANY_INFO_LABELS:
+                segment = line[len(label):].strip()
+                parsed_data = await parse_segment(graph_ctx, segment, "company", system_prompt_2)
                 
                 company_msg = CompanyInfoMessage(
                     content_str=segment,
                     content_dict=parsed_data
                 )
-                graph_ctx.state.new_company_info[company_msg.info_id] = company_msg
-                logging.debug(f"Appended CompanyInfoMessage: {company_msg}")
+                graph_ctx.state.new_company_info.append(company_msg)
+                logging.debug("Appended CompanyInfoMessage: %s", company_msg)
 
 
 
       ##### USER INFO DISTILLATION PART
-            elif line.startswith("[User AIR Info]"):
-                segment = line[len("[User AIR Info]"):].strip()
-                result = await update_agent.run(user_prompt=segment, message_history=system_prompt_3)
-                logging.debug(f"Parsing result for User AIR Info: {result}")
-
-                try:
-                    parsed_data = parse_json_result(result.data)
-                except ValueError as e:
-                    logging.debug(f"Error parsing User AIR Info: {e}")
-                    parsed_data = {}
+            elif label in USER_INFO_LABELS:
+                segment = line[len(label):].strip()
+                parsed_data = await parse_segment(graph_ctx, segment, "user", system_prompt_3)
 
                 user_msg = UserInfoMessage(
                     content_str=segment,
                     content_dict=parsed_data
                 )
-                graph_ctx.state.new_user_AIR_info[user_msg.info_id] = user_msg
-                logging.debug(f"Appended CompanyInfoMessage: {user_msg}")
+                graph_ctx.state.new_user_AIR_info.append(user_msg)
+                logging.debug("Appended UserInfoMessage: %s", user_msg)
 
 
     return graph_ctx
\ No newline at end of file
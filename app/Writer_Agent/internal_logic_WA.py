@@ -3,16 +3,16 @@ import logging
 from typing import TYPE_CHECKING
 from pydantic_graph import GraphRunContext
 from pydantic_ai.messages import (
+    ModelMessage,
     ModelRequest,
-    ModelResponse,
-    UserPromptPart,
-    TextPart,
     SystemPromptPart,
 )
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from ..classes import ChatMessage  # Ensure ChatMessage is defined in classes.py
+from ..classes import ChatMessage, MessageLog  # Ensure ChatMessage is defined in classes.py
+from ..history import get_history_view
+from ..response_cache import cached_stage_output
 from ..promptconfig import interview_goal_definition, general_framework_info_company, framework_themes_company
-logging.basicConfig(level=logging.DEBUG)
 
 if TYPE_CHECKING:
     from orchestration import MultiAgentState, MultiAgentDeps, GraphRunContext
@@ -166,13 +166,11 @@ Clarity: Missing ownership, next steps, or prioritization in Recommendation →
 
 
 
-def get_latest_message_content(messages_dict: dict[str, ChatMessage]) -> str:
-      """Get the content of the most recent ChatMessage from a dictionary."""
-      if not messages_dict:
+def get_latest_message_content(messages_log: MessageLog[ChatMessage]) -> str:
+      """Get the content of the most recent ChatMessage from an append-only message log."""
+      latest_message = messages_log.latest()
+      if latest_message is None:
           return ""
-
-      # Find the message with the latest created_at timestamp
-      latest_message = max(messages_dict.values(), key=lambda msg: msg.created_at)
       return latest_message.content
 
 
@@ -199,46 +197,52 @@ async def update_writer_agent_user_prompt(graph_ctx: GraphRunContext) -> str:
 # Append the last writer-agent response if available.
     latest_MA_RA_responses = ""
 
-    if graph_ctx.state.MA_response and isinstance(graph_ctx.state.MA_response, dict):
-        last_ma_response = list(graph_ctx.state.MA_response.values())[-1]
+    last_ma_response = graph_ctx.state.MA_response.latest()
+    if last_ma_response is not None:
         latest_MA_RA_responses += f"{last_ma_response.content}\n"
 
     # Append the last Reviewer response if available.
-    if graph_ctx.state.reviewer_response and isinstance(graph_ctx.state.reviewer_response, dict):
-        last_reviewer_response = list(graph_ctx.state.reviewer_response.values())[-1]
+    last_reviewer_response = graph_ctx.state.reviewer_response.latest()
+    if last_reviewer_response is not None:
         latest_MA_RA_responses += f"\n LAST FEEDBACK ON INTERVIEW CONTEXT: {last_reviewer_response.content}\n"
 
     return latest_MA_RA_responses
 
 
-async def fetch_message_history(graph_ctx: GraphRunContext) -> str:
+async def fetch_message_history(graph_ctx: GraphRunContext) -> list[ModelMessage]:
     """
-    Constructs and returns the meta-agent prompt string using the internal conversation stored in 
-    graph_ctx.state.internalconversation. The messages are sorted by their creation time and 
-    formatted as "<role>: <content>".
+    Returns the user - Frits conversation history stored in graph_ctx.deps.conversation_history
+    as pydantic-ai ModelRequest/ModelResponse messages, oldest first.
     """
 
-    message_history = []
-    # Transform ChatMessage list to ModelRequest and ModelResponse format
-    if graph_ctx.deps.conversation_history:
-        # Optionally, sort by creation time if order matters
-        sorted_history = sorted(
-            graph_ctx.deps.conversation_history.values(),
-            key=lambda chat: chat.created_at
-        )
-        for chat in sorted_history:
-            if chat.role.lower() == "user":
-                message_history.append(
-                    ModelRequest(parts=[UserPromptPart(content=chat.content, timestamp=chat.created_at)])
-                )
-            elif chat.role.lower() in {"writer"}:
-                message_history.append(
-                    ModelResponse(parts=[TextPart(content=chat.content)])
-                )
-            else:
-                logging.error("Unknown chat role: %s", chat.role)
-
-    return message_history
+    # The ModelRequest/ModelResponse conversion is shared by all agents in the run and
+    # only extended with messages appended since the last call.
+    return get_history_view(graph_ctx.deps).model_messages()
+
+
+@dataclass
+class StreamedWriterResult:
+    data: str
+
+
+async def run_writer(graph_ctx: GraphRunContext, writer_agent, user_prompt: str, message_history: list[ModelMessage]):
+    """
+    Run the writer. When deps.writer_stream or deps.speech is set (WebSocket turns) the answer
+    is streamed and every text delta is passed on as it arrives; the full text is returned
+    either way.
+    """
+    writer_stream = getattr(graph_ctx.deps, "writer_stream", None)
+    speech = getattr(graph_ctx.deps, "speech", None)
+    if writer_stream is None and speech is None:
+        return await writer_agent.run(user_prompt=user_prompt, message_history=message_history)
+
+    async with writer_agent.run_stream(user_prompt=user_prompt, message_history=message_history) as result:
+        async for delta in result.stream_text(delta=True):
+            if writer_stream is not None:
+                await writer_stream(delta)
+            if speech is not None:
+                speech.feed(delta)
+        return StreamedWriterResult(data=await result.get_data())
 
 
 async def WriterAgent_workflow(graph_ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]) -> GraphRunContext[MultiAgentState, MultiAgentDeps]:
@@ -269,21 +273,24 @@ async def WriterAgent_workflow(graph_ctx: GraphRunContext[MultiAgentState, Multi
 
 
     # RUN THE WRITER-AGENT USING THE GENERATED INPUT
-    writer_response = await writer_agent.run(user_prompt=user_prompt, message_history=complete_message_history)
+    writer_response = await cached_stage_output(
+        graph_ctx, "writer",
+        lambda: run_writer(graph_ctx, writer_agent, user_prompt, complete_message_history),
+    )
 
     
     #### SAVE THE FEEDBACK IN THE RIGHT CLASS OBJECTS AND APPROVE OR REJECT
     save_format = ChatMessage(
         role="writer",
-        content=str(writer_response.data),
+        content=writer_response,
         created_at=datetime.now(timezone.utc)
     )
 
     # Save the message to the writer response dictionary using its unique message_id as the key.
     graph_ctx.state.writer_response = save_format
 
-    # Also save the message to the internalconversation dictionary.
-    graph_ctx.state.internalconversation[save_format.message_id] = save_format
+    # Also append the message to the internalconversation log.
+    graph_ctx.state.internalconversation.append(save_format)
 
 
     return graph_ctx
\ No newline at end of file
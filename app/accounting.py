@@ -0,0 +1,398 @@
+# accounting.py
+# Token accounting per user, session and company, and budgets on top of it.
+#
+# Every agent's model is wrapped in an AccountedModel, so each model request an Agent.run makes
+# (retries, escalations and streamed writer answers included) reports its token usage. The
+# request is attributed to the turn's UsageScope, which run_graph() sets for the whole graph run
+# in a contextvar. The TokenLedger aggregates usage in memory and, with TOKEN_ACCOUNTING_PERSIST=1,
+# flushes it in batches (every TOKEN_ACCOUNTING_FLUSH_SECONDS or TOKEN_ACCOUNTING_BATCH_SIZE pending
+# rows) to Supabase. Persistence is off by default because it needs this table created first:
+#
+#   create table token_usage (
+#       id              bigint generated always as identity primary key,
+#       day             date not null,
+#       user_id         uuid not null,
+#       session_id      uuid not null,
+#       company_id      uuid,
+#       agent           text not null,
+#       model           text not null,
+#       requests        integer not null,
+#       request_tokens  integer not null,
+#       response_tokens integer not null,
+#       total_tokens    integer not null,
+#       created_at      timestamptz not null default now()
+#   );
+#
+# A failed flush keeps its rows for the next one; after TOKEN_ACCOUNTING_MAX_FAILURES failures in
+# a row, or beyond TOKEN_ACCOUNTING_MAX_PENDING rows, the pending rows are dropped (and logged).
+#
+# Budgets (total tokens, 0 = none): TOKEN_BUDGET_USER_DAILY, TOKEN_BUDGET_COMPANY_DAILY and
+# TOKEN_BUDGET_SESSION. From TOKEN_BUDGET_DOWNGRADE_AT of any budget the turn's requests go to
+# the small deployment (AZURE_MODEL_NAME_SMALL); past the budget the stages in
+# TOKEN_BUDGET_SKIP_STAGES are skipped as well (update: no fact extraction this turn;
+# reviewer: the Meta Agent's answer goes to the Writer unreviewed). Turns are never refused.
+# Totals are loaded from the table once per user/company/session and day, then kept current
+# in memory, so with several workers a budget can overshoot by what the others spent since.
+# Totals of earlier days are dropped at the day change; without persistence that also resets
+# the session budget of sessions running over midnight.
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import weakref
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from pydantic_ai.models import Model, StreamedResponse
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.usage import Usage
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TOKEN_ACCOUNTING_ENABLED = os.getenv("TOKEN_ACCOUNTING_ENABLED", "1") == "1"
+TOKEN_ACCOUNTING_PERSIST = os.getenv("TOKEN_ACCOUNTING_PERSIST", "0") == "1"
+TOKEN_USAGE_TABLE = os.getenv("TOKEN_USAGE_TABLE", "token_usage")
+TOKEN_ACCOUNTING_FLUSH_SECONDS = float(os.getenv("TOKEN_ACCOUNTING_FLUSH_SECONDS", "10"))
+TOKEN_ACCOUNTING_BATCH_SIZE = int(os.getenv("TOKEN_ACCOUNTING_BATCH_SIZE", "200"))
+TOKEN_ACCOUNTING_MAX_FAILURES = int(os.getenv("TOKEN_ACCOUNTING_MAX_FAILURES", "5"))
+TOKEN_ACCOUNTING_MAX_PENDING = int(os.getenv("TOKEN_ACCOUNTING_MAX_PENDING", "10000"))
+TOKEN_BUDGET_USER_DAILY = int(os.getenv("TOKEN_BUDGET_USER_DAILY", "0"))
+TOKEN_BUDGET_COMPANY_DAILY = int(os.getenv("TOKEN_BUDGET_COMPANY_DAILY", "0"))
+TOKEN_BUDGET_SESSION = int(os.getenv("TOKEN_BUDGET_SESSION", "0"))
+TOKEN_BUDGET_DOWNGRADE_AT = float(os.getenv("TOKEN_BUDGET_DOWNGRADE_AT", "0.8"))
+TOKEN_BUDGET_SKIP_STAGES = frozenset(
+    stage.strip() for stage in os.getenv("TOKEN_BUDGET_SKIP_STAGES", "update,reviewer").split(",") if stage.strip()
+)
+
+llm_tokens = registry.counter(
+    "llm_tokens_total", "Tokens used by agent model requests", ["agent", "model", "kind"],
+)
+budget_actions = registry.counter(
+    "token_budget_actions_total", "Model downgrades and skipped stages because of token budgets", ["action", "budget"],
+)
+usage_flushes = registry.counter(
+    "token_usage_flushes_total", "Batched token usage writes to Supabase", ["result"],
+)
+usage_rows_dropped = registry.counter(
+    "token_usage_rows_dropped_total", "Token usage aggregates dropped after repeated flush failures",
+)
+
+
+########################################################################
+# Turn scope
+########################################################################
+
+@dataclass(frozen=True)
+class UsageScope:
+    user_id: str
+    session_id: str
+    company_id: Optional[str] = None
+
+
+_scope: ContextVar[Optional[UsageScope]] = ContextVar("usage_scope", default=None)
+
+
+@contextmanager
+def usage_scope(scope: UsageScope):
+    """Attribute the model requests made inside the block (and its tasks) to this scope."""
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+def current_scope() -> Optional[UsageScope]:
+    return _scope.get()
+
+
+########################################################################
+# Ledger
+########################################################################
+
+# Ledgers alive in this process, read by the pending-rows gauge
+_ledgers: "weakref.WeakSet[TokenLedger]" = weakref.WeakSet()
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+class TokenLedger:
+    """Usage aggregates with batched persistence and budget checks; see the module comment."""
+
+    def __init__(
+        self,
+        supabase_client=None,
+        table: str = TOKEN_USAGE_TABLE,
+        flush_interval: float = TOKEN_ACCOUNTING_FLUSH_SECONDS,
+        batch_size: int = TOKEN_ACCOUNTING_BATCH_SIZE,
+        max_failures: int = TOKEN_ACCOUNTING_MAX_FAILURES,
+        max_pending: int = TOKEN_ACCOUNTING_MAX_PENDING,
+        user_daily: int = TOKEN_BUDGET_USER_DAILY,
+        company_daily: int = TOKEN_BUDGET_COMPANY_DAILY,
+        session_total: int = TOKEN_BUDGET_SESSION,
+        downgrade_at: float = TOKEN_BUDGET_DOWNGRADE_AT,
+        skip_stages: frozenset[str] = TOKEN_BUDGET_SKIP_STAGES,
+    ):
+        self.supabase_client = supabase_client
+        self.table = table
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_failures = max_failures
+        self.max_pending = max_pending
+        self.budgets = {"user": user_daily, "company": company_daily, "session": session_total}
+        self.downgrade_at = downgrade_at
+        self.skip_stages = skip_stages
+        # (day, user_id, session_id, company_id, agent, model) -> [requests, request_tokens, response_tokens]
+        self._pending: dict[tuple, list[int]] = defaultdict(lambda: [0, 0, 0])
+        # (budget, id) -> (day, total tokens); the session budget ignores the day
+        self._totals: dict[tuple[str, str], tuple[str, int]] = {}
+        # (budget, id, day) whose stored total has been loaded
+        self._loaded: set[tuple[str, str, str]] = set()
+        self._day = _today()
+        self._failures = 0
+        self._flusher: Optional[asyncio.Task] = None
+        self._batch_flush: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        _ledgers.add(self)
+
+    @property
+    def budgeted(self) -> bool:
+        return any(self.budgets.values())
+
+    def record(self, scope: Optional[UsageScope], agent: str, model: str, usage: Usage) -> None:
+        request_tokens = usage.request_tokens or 0
+        response_tokens = usage.response_tokens or 0
+        llm_tokens.inc(request_tokens, agent=agent, model=model, kind="request")
+        llm_tokens.inc(response_tokens, agent=agent, model=model, kind="response")
+        if scope is None:
+            return
+        day = self._roll_day()
+        row = self._pending[(day, scope.user_id, scope.session_id, scope.company_id, agent, model)]
+        row[0] += usage.requests or 1
+        row[1] += request_tokens
+        row[2] += response_tokens
+        total = usage.total_tokens or request_tokens + response_tokens
+        for key in self._budget_keys(scope):
+            known_day, tokens = self._totals.get(key, (day, 0))
+            self._totals[key] = (day, (tokens if known_day == day or key[0] == "session" else 0) + total)
+        self._schedule_flush()
+
+    def _roll_day(self) -> str:
+        """Today's date; on the first call of a new day the totals of earlier days are dropped."""
+        day = _today()
+        if day != self._day:
+            self._day = day
+            self._totals = {key: value for key, value in self._totals.items() if value[0] == day}
+            self._loaded = {key for key in self._loaded if key[2] == day}
+        return day
+
+    def _budget_keys(self, scope: UsageScope) -> list[tuple[str, str]]:
+        keys = [("user", scope.user_id), ("session", scope.session_id)]
+        if scope.company_id:
+            keys.append(("company", scope.company_id))
+        return keys
+
+    def _used(self, key: tuple[str, str]) -> int:
+        day, tokens = self._totals.get(key, (None, 0))
+        return tokens if key[0] == "session" or day == _today() else 0
+
+    def usage(self, scope: UsageScope) -> dict[str, int]:
+        return {budget: self._used((budget, id_)) for budget, id_ in self._budget_keys(scope)}
+
+    def state(self, scope: Optional[UsageScope] = None) -> tuple[str, Optional[str]]:
+        """("ok" | "downgrade" | "exceeded", the budget that decided it) for the scope."""
+        scope = scope or current_scope()
+        if scope is None or not self.budgeted:
+            return "ok", None
+        worst, reason = 0.0, None
+        for key in self._budget_keys(scope):
+            budget = self.budgets[key[0]]
+            if budget and self._used(key) / budget > worst:
+                worst, reason = self._used(key) / budget, key[0]
+        if worst >= 1:
+            return "exceeded", reason
+        if worst >= self.downgrade_at:
+            return "downgrade", reason
+        return "ok", None
+
+    def skip_stage(self, stage: str) -> bool:
+        """True when an optional stage should be skipped for the current turn's budget."""
+        if stage not in self.skip_stages:
+            return False
+        state, budget = self.state()
+        if state != "exceeded":
+            return False
+        budget_actions.inc(action=f"skip_{stage}", budget=budget)
+        logger.info("Token budget (%s) exceeded, skipping the %s stage", budget, stage)
+        return True
+
+    async def prepare(self, scope: UsageScope) -> None:
+        """Load the scope's stored totals (once per user/company/session and day) before its turn."""
+        if self.supabase_client is None or not self.budgeted:
+            return
+        day = self._roll_day()
+        for budget, id_ in self._budget_keys(scope):
+            if not self.budgets[budget] or (budget, id_, day) in self._loaded:
+                continue
+            try:
+                stored = await self._stored_total(budget, id_, day)
+            except Exception as e:
+                logger.warning("Could not load %s token usage for %s: %s", budget, id_, e)
+                continue
+            # Requests recorded since the last flush aren't in the table yet
+            self._totals[(budget, id_)] = (day, stored + self._pending_total(budget, id_, day))
+            self._loaded.add((budget, id_, day))
+
+    async def _stored_total(self, budget: str, id_: str, day: str, page_size: int = 1000) -> int:
+        total, offset = 0, 0
+        while True:
+            query = self.supabase_client.table(self.table).select("total_tokens").eq(f"{budget}_id", id_)
+            if budget != "session":
+                query = query.eq("day", day)
+            response = await query.order("id").range(offset, offset + page_size - 1).execute()
+            rows = response.data or []
+            total += sum(row["total_tokens"] or 0 for row in rows)
+            if len(rows) < page_size:
+                return total
+            offset += page_size
+
+    def _pending_total(self, budget: str, id_: str, day: str) -> int:
+        index = {"user": 1, "session": 2, "company": 3}[budget]
+        return sum(
+            requests_tokens[1] + requests_tokens[2]
+            for key, requests_tokens in self._pending.items()
+            if key[index] == id_ and (budget == "session" or key[0] == day)
+        )
+
+    def _schedule_flush(self) -> None:
+        if self.supabase_client is None:
+            self._pending.clear()
+            return
+        if self._flusher is None or self._flusher.done():
+            try:
+                self._flusher = asyncio.get_running_loop().create_task(self._flush_loop(), name="token-usage-flush")
+            except RuntimeError:
+                return
+        if len(self._pending) >= self.batch_size and (self._batch_flush is None or self._batch_flush.done()):
+            self._batch_flush = asyncio.get_running_loop().create_task(self.flush(), name="token-usage-batch")
+
+    async def _flush_loop(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Write the pending aggregates as one insert; on failure they are kept for the next flush,
+        up to max_failures failures in a row and max_pending rows.
+        """
+        async with self._flush_lock:
+            if not self._pending or self.supabase_client is None:
+                return
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0])
+            rows = [
+                {
+                    "day": day, "user_id": user_id, "session_id": session_id, "company_id": company_id,
+                    "agent": agent, "model": model, "requests": requests,
+                    "request_tokens": request_tokens, "response_tokens": response_tokens,
+                    "total_tokens": request_tokens + response_tokens,
+                }
+                for (day, user_id, session_id, company_id, agent, model), (requests, request_tokens, response_tokens)
+                in pending.items()
+            ]
+            try:
+                await self.supabase_client.table(self.table).insert(rows).execute()
+                usage_flushes.inc(result="ok")
+                self._failures = 0
+            except Exception as e:
+                usage_flushes.inc(result="error")
+                self._failures += 1
+                if self._failures >= self.max_failures:
+                    usage_rows_dropped.inc(len(rows))
+                    logger.error(
+                        "Could not write %d token usage rows (%d failures in a row), dropping them: %s",
+                        len(rows), self._failures, e,
+                    )
+                    self._failures = 0
+                    return
+                logger.warning("Could not write %d token usage rows, keeping them for the next flush: %s", len(rows), e)
+                for key, values in pending.items():
+                    row = self._pending[key]
+                    for i, value in enumerate(values):
+                        row[i] += value
+                if len(self._pending) > self.max_pending:
+                    # Oldest aggregates first: dicts keep insertion order
+                    excess = len(self._pending) - self.max_pending
+                    for key in list(self._pending)[:excess]:
+                        del self._pending[key]
+                    usage_rows_dropped.inc(excess)
+                    logger.error("Dropped %d token usage rows beyond TOKEN_ACCOUNTING_MAX_PENDING", excess)
+
+    async def aclose(self) -> None:
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+        await self.flush()
+
+
+########################################################################
+# Model wrapper
+########################################################################
+
+class AccountedModel(WrapperModel):
+    """
+    Reports the usage of every request to the ledger under the current UsageScope, and sends
+    requests to `downgrade_model` while the scope is over its downgrade threshold.
+    """
+
+    def __init__(self, wrapped: Model, agent: str, ledger: TokenLedger, downgrade_model: Optional[Model] = None):
+        super().__init__(wrapped)
+        self.agent = agent
+        self.ledger = ledger
+        self.downgrade_model = downgrade_model
+
+    def _model(self, scope: Optional[UsageScope]) -> Model:
+        if self.downgrade_model is None or scope is None:
+            return self.wrapped
+        state, budget = self.ledger.state(scope)
+        if state == "ok":
+            return self.wrapped
+        budget_actions.inc(action="downgrade", budget=budget)
+        return self.downgrade_model
+
+    async def request(self, messages, model_settings, model_request_parameters):
+        scope = current_scope()
+        model = self._model(scope)
+        response, usage = await model.request(messages, model_settings, model_request_parameters)
+        self.ledger.record(scope, self.agent, model.model_name, usage)
+        return response, usage
+
+    @asynccontextmanager
+    async def request_stream(self, messages, model_settings, model_request_parameters) -> AsyncIterator[StreamedResponse]:
+        scope = current_scope()
+        model = self._model(scope)
+        async with model.request_stream(messages, model_settings, model_request_parameters) as response_stream:
+            try:
+                yield response_stream
+            finally:
+                # Usage is complete once the stream has been consumed
+                self.ledger.record(scope, self.agent, model.model_name, response_stream.usage())
+
+
+def build_ledger(supabase_client) -> Optional[TokenLedger]:
+    if not TOKEN_ACCOUNTING_ENABLED:
+        return None
+    return TokenLedger(supabase_client=supabase_client if TOKEN_ACCOUNTING_PERSIST else None)
+
+
+registry.gauge("token_usage_pending_rows", "Token usage aggregates waiting for the next flush").set_function(
+    lambda: [({}, sum(len(ledger._pending) for ledger in list(_ledgers)))]
+)
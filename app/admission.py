@@ -0,0 +1,152 @@
+# admission.py
+# Admission control for the chat endpoint. Every admitted turn fans out to 4+ LLM calls, so
+# the number of turns running at once is bounded; excess turns wait in a FIFO queue for at
+# most ADMISSION_MAX_WAIT_SECONDS. When the queue is full or the wait runs out the request is
+# shed right away with 503 + Retry-After instead of piling up inside the OpenAI client until
+# everything times out. A user can hold at most ADMISSION_MAX_PER_USER running or queued
+# turns (429 + Retry-After beyond that), so one user's burst can't fill the queue.
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+ADMISSION_MAX_PER_USER = int(os.getenv("ADMISSION_MAX_PER_USER", "2"))
+
+admission_shed = registry.counter(
+    "admission_shed_total", "Requests rejected by admission control", ["reason"],
+)
+admission_admitted = registry.counter(
+    "admission_admitted_total", "Requests admitted by admission control",
+)
+admission_queue_wait = registry.histogram(
+    "admission_queue_wait_seconds", "Time admitted requests spent queued",
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised instead of admitting a request; status_code is 503 (overload) or 429 (per-user limit)."""
+
+    def __init__(self, reason: str, retry_after: int, status_code: int = 503):
+        super().__init__(f"Request shed: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_inflight: int = ADMISSION_MAX_INFLIGHT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        max_wait: float = ADMISSION_MAX_WAIT_SECONDS,
+        max_per_user: int = ADMISSION_MAX_PER_USER,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_per_user = max_per_user
+        self.inflight = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self._per_user: dict[str, int] = {}
+        # Smoothed duration of an admitted turn, used for Retry-After
+        self._service_time = 10.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        # Time until the current backlog has drained through the in-flight slots
+        backlog = self.queued + self.inflight
+        estimate = self._service_time * backlog / max(self.max_inflight, 1)
+        return int(min(max(estimate, 1), 60))
+
+    def _reject(self, reason: str, status_code: int = 503) -> AdmissionRejected:
+        admission_shed.inc(reason=reason)
+        logger.warning("Shedding chat request (%s): inflight=%d queued=%d", reason, self.inflight, self.queued)
+        return AdmissionRejected(reason, self.retry_after(), status_code)
+
+    async def _acquire(self) -> None:
+        if self.inflight < self.max_inflight and not self._waiters:
+            self.inflight += 1
+            return
+        if self.queued >= self.max_queue:
+            raise self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # The slot is handed over by _release_slot(), which already counts it as in flight
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return  # handed a slot just as the wait ran out
+            waiter.cancel()
+            raise self._reject("queue_timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _release_slot(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # slot passes straight to the next waiter
+                return
+        self.inflight -= 1
+
+    @asynccontextmanager
+    async def admit(self, user_id: str):
+        """Hold an in-flight slot for the duration of the block, or raise AdmissionRejected."""
+        if not self.enabled:
+            yield
+            return
+        held = self._per_user.get(user_id, 0)
+        if held >= self.max_per_user:
+            raise self._reject("per_user_limit", status_code=429)
+        self._per_user[user_id] = held + 1
+        try:
+            queued_at = time.perf_counter()
+            await self._acquire()
+            admission_queue_wait.observe(time.perf_counter() - queued_at)
+            admission_admitted.inc()
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._service_time = 0.8 * self._service_time + 0.2 * (time.perf_counter() - started)
+                self._release_slot()
+        finally:
+            remaining = self._per_user[user_id] - 1
+            if remaining:
+                self._per_user[user_id] = remaining
+            else:
+                del self._per_user[user_id]
+
+
+chat_admission = AdmissionController(enabled=ADMISSION_ENABLED)
+
+registry.gauge("admission_inflight", "Chat turns holding an admission slot").set_function(
+    lambda: [({}, chat_admission.inflight)]
+)
+registry.gauge("admission_queue_depth", "Chat turns waiting for an admission slot").set_function(
+    lambda: [({}, chat_admission.queued)]
+)
@@ -0,0 +1,337 @@
+# air_scoring.py
+# AIR readiness scores from the facts the Update Agent extracts (info_messages.content_dict:
+# score, relevance, themes).
+#
+# Facts are loaded into columns (FactColumns: one NumPy array per field, themes as a boolean
+# matrix over the canonical framework themes) and aggregated into AirScores, which keeps per
+# group (user) and per category ("user" / "company" facts) the running sums
+#
+#   num = sum(relevance * decay * score)    den = sum(relevance * decay)    facts = count
+#
+# per theme plus an "Overall" column. A theme score is num / den: the relevance-weighted mean
+# score, where a fact's weight halves every AIR_SCORE_HALF_LIFE_DAYS. The decay is stored
+# relative to a reference time, so a new fact is one vector add and reading the scores is a
+# single multiplication, no matter how many facts came before.
+#
+# AirScoreStore keeps these aggregates per user and per company (a subsidiary is a company in
+# the users table) in memory, seeds them from Supabase on first use and applies new facts as
+# the chat turns store them. format_summary() renders compact numbers for the agent prompts.
+import logging
+import math
+import os
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, Optional
+
+import numpy as np
+
+from .framework_selector import THEMES, match_theme
+from .info_messages import fetch_company_user_ids, iter_info_message_facts
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+AIR_SCORE_HALF_LIFE_DAYS = float(os.getenv("AIR_SCORE_HALF_LIFE_DAYS", "90"))
+AIR_SCORE_CACHE_SIZE = int(os.getenv("AIR_SCORE_CACHE_SIZE", "4096"))
+AIR_SCORE_COMPANY_TTL = float(os.getenv("AIR_SCORE_COMPANY_TTL", "900"))
+AIR_SCORE_PROMPT_SUMMARY = os.getenv("AIR_SCORE_PROMPT_SUMMARY", "0") == "1"
+
+THEME_NAMES: tuple[str, ...] = tuple(THEMES)
+COLUMNS: tuple[str, ...] = THEME_NAMES + ("Overall",)
+CATEGORIES: tuple[str, ...] = ("user", "company")
+# info_messages.category values
+_CATEGORY_CODES = {"user_air": 0, "user": 0, "company": 1}
+
+# Exponents above this are folded into the stored sums (2**60 is far from float64 limits)
+_REBASE_EXPONENT = 60.0
+
+# Live stores, for the cached aggregates gauge
+_stores: "weakref.WeakSet[AirScoreStore]" = weakref.WeakSet()
+
+air_score_loads = registry.counter(
+    "air_score_loads_total", "AIR score aggregates seeded from Supabase", ["scope", "result"],
+)
+air_score_facts = registry.counter(
+    "air_score_facts_total", "Facts applied incrementally to cached AIR score aggregates", ["scope"],
+)
+
+
+@lru_cache(maxsize=4096)
+def _theme_column(label: str) -> int:
+    theme = match_theme(label)
+    return THEME_NAMES.index(theme) if theme else -1
+
+
+def _timestamp(value) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str) and value:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    return time.time()
+
+
+@dataclass(slots=True)
+class FactColumns:
+    """Columnar view of a batch of facts; rows without a usable score are left out."""
+    created_at: np.ndarray   # float64 epoch seconds
+    score: np.ndarray        # float64 0..1
+    relevance: np.ndarray    # float64 0..1
+    themes: np.ndarray       # bool (n, len(THEME_NAMES))
+    category: np.ndarray     # int8 index into CATEGORIES
+    group: np.ndarray        # int32 index into `groups`
+    groups: list[str]
+
+    def __len__(self) -> int:
+        return len(self.score)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict], groups: Optional[list[str]] = None) -> "FactColumns":
+        """
+        Build columns from info_messages rows (content_dict, category, created_at and the
+        chat_messages.user_id join). Rows are grouped by user; unknown users are appended to
+        `groups`, or all rows go to a single group when a row carries no user.
+        """
+        groups = list(groups or [])
+        index = {group: i for i, group in enumerate(groups)}
+        created_at, score, relevance, category, group = [], [], [], [], []
+        theme_rows, theme_cols = [], []
+        for row in rows:
+            content = row.get("content_dict") or {}
+            code = _CATEGORY_CODES.get(row.get("category"))
+            try:
+                fact_score = float(content["score"])
+                fact_relevance = float(content.get("relevance", 1.0))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if code is None or not (0.0 <= fact_score <= 1.0) or not (0.0 <= fact_relevance <= 1.0):
+                continue
+
+            owner = (row.get("chat_messages") or {}).get("user_id") or row.get("user_id") or ""
+            if owner not in index:
+                index[owner] = len(groups)
+                groups.append(owner)
+
+            labels = content.get("themes") or []
+            for label in [labels] if isinstance(labels, str) else labels:
+                column = _theme_column(str(label))
+                if column >= 0:
+                    theme_rows.append(len(score))
+                    theme_cols.append(column)
+            created_at.append(_timestamp(row.get("created_at")))
+            score.append(fact_score)
+            relevance.append(fact_relevance)
+            category.append(code)
+            group.append(index[owner])
+
+        themes = np.zeros((len(score), len(THEME_NAMES)), dtype=bool)
+        themes[theme_rows, theme_cols] = True
+        return cls(
+            created_at=np.asarray(created_at, dtype=np.float64),
+            score=np.asarray(score, dtype=np.float64),
+            relevance=np.asarray(relevance, dtype=np.float64),
+            themes=themes,
+            category=np.asarray(category, dtype=np.int8),
+            group=np.asarray(group, dtype=np.int32),
+            groups=groups,
+        )
+
+
+@dataclass(slots=True)
+class ThemeScores:
+    """Scores of one group and category; `score` is NaN for columns without evidence."""
+    score: np.ndarray    # (len(COLUMNS),)
+    weight: np.ndarray   # decayed relevance mass behind each score
+    facts: np.ndarray    # number of facts behind each score
+
+    def as_dict(self) -> dict:
+        return {
+            column: {
+                "score": None if math.isnan(self.score[i]) else round(float(self.score[i]), 3),
+                "weight": round(float(self.weight[i]), 3),
+                "facts": int(self.facts[i]),
+            }
+            for i, column in enumerate(COLUMNS)
+        }
+
+
+class AirScores:
+    """Incremental, time-decayed AIR score sums for a set of groups; see the module comment."""
+
+    def __init__(self, groups: Optional[list[str]] = None, half_life_days: float = AIR_SCORE_HALF_LIFE_DAYS, reference: Optional[float] = None):
+        self.half_life = half_life_days * 86400.0
+        self.reference = time.time() if reference is None else reference
+        self.groups: list[str] = []
+        self.index: dict[str, int] = {}
+        shape = (len(CATEGORIES), 0, len(COLUMNS))
+        self.num = np.zeros(shape)
+        self.den = np.zeros(shape)
+        self.facts = np.zeros(shape, dtype=np.int64)
+        self._positions(groups or [])
+
+    def __contains__(self, group: str) -> bool:
+        return group in self.index
+
+    def _positions(self, groups: list[str]) -> np.ndarray:
+        """Row of each group in the sum matrices; new groups are added in one resize."""
+        added = 0
+        for group in groups:
+            if group not in self.index:
+                self.index[group] = len(self.groups)
+                self.groups.append(group)
+                added += 1
+        if added:
+            pad = ((0, 0), (0, added), (0, 0))
+            self.num = np.pad(self.num, pad)
+            self.den = np.pad(self.den, pad)
+            self.facts = np.pad(self.facts, pad)
+        return np.asarray([self.index[group] for group in groups], dtype=np.intp)
+
+    def _exponent(self, created_at: np.ndarray) -> np.ndarray:
+        return (created_at - self.reference) / self.half_life
+
+    def _rebase(self, newest: float) -> None:
+        # Keep 2**exponent finite by moving the reference forward and decaying the stored sums
+        shift = (newest - self.reference) / self.half_life
+        if shift > _REBASE_EXPONENT:
+            factor = 2.0 ** -shift
+            self.num *= factor
+            self.den *= factor
+            self.reference = newest
+
+    def add_columns(self, columns: FactColumns) -> None:
+        if not len(columns):
+            return
+        self._rebase(float(columns.created_at.max()))
+        positions = self._positions(columns.groups)[columns.group]
+        weight = columns.relevance * np.exp2(self._exponent(columns.created_at))
+        hits = np.concatenate([columns.themes, np.ones((len(columns), 1), dtype=bool)], axis=1)
+        weighted = hits * weight[:, None]
+        np.add.at(self.den, (columns.category, positions), weighted)
+        np.add.at(self.num, (columns.category, positions), weighted * columns.score[:, None])
+        np.add.at(self.facts, (columns.category, positions), hits)
+
+    def add(self, group: str, category: str, content_dict: dict, created_at=None) -> bool:
+        """Apply one newly extracted fact; returns False when it has no usable score."""
+        columns = FactColumns.from_rows(
+            [{"category": category, "content_dict": content_dict, "created_at": created_at, "user_id": group}],
+        )
+        self.add_columns(columns)
+        return len(columns) > 0
+
+    def _decay_now(self, now: Optional[float]) -> float:
+        return 2.0 ** -self._exponent(np.float64(time.time() if now is None else now))
+
+    def scores(self, category: str, now: Optional[float] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(score, weight, facts) matrices of shape (groups, len(COLUMNS)) for one category."""
+        code = CATEGORIES.index(category)
+        num, den = self.num[code], self.den[code]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            score = np.where(den > 0, num / den, np.nan)
+        return score, den * self._decay_now(now), self.facts[code]
+
+    def group_scores(self, group: str, category: str, now: Optional[float] = None) -> ThemeScores:
+        score, weight, facts = self.scores(category, now)
+        position = self.index.get(group)
+        if position is None:
+            empty = np.zeros(len(COLUMNS))
+            return ThemeScores(np.full(len(COLUMNS), np.nan), empty, empty.astype(np.int64))
+        return ThemeScores(score[position], weight[position], facts[position])
+
+    def total(self, category: str, now: Optional[float] = None) -> ThemeScores:
+        """Rollup over all groups: every fact counts once, weighted as in the group scores."""
+        code = CATEGORIES.index(category)
+        num, den = self.num[code].sum(axis=0), self.den[code].sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            score = np.where(den > 0, num / den, np.nan)
+        return ThemeScores(score, den * self._decay_now(now), self.facts[code].sum(axis=0))
+
+
+def format_summary(scores: ThemeScores) -> Optional[str]:
+    """Compact text for prompts, e.g. "Overall 0.62 (n=7); Governance & organization 0.40 (n=2)"; None without facts."""
+    parts = []
+    overall = len(COLUMNS) - 1
+    for i in [overall] + sorted(range(overall), key=lambda i: -scores.weight[i]):
+        if scores.facts[i] and not math.isnan(scores.score[i]):
+            parts.append(f"{COLUMNS[i]} {scores.score[i]:.2f} (n={int(scores.facts[i])})")
+    return "; ".join(parts) if parts else None
+
+
+@dataclass(slots=True)
+class _CompanyEntry:
+    scores: AirScores
+    expires_at: float
+
+
+class AirScoreStore:
+    """
+    In-memory AirScores per user and per company. Users are seeded once from Supabase and
+    then kept current by record(); companies are reloaded after AIR_SCORE_COMPANY_TTL in case
+    facts were written by another process.
+    """
+
+    def __init__(self, supabase_client=None, max_entries: int = AIR_SCORE_CACHE_SIZE, company_ttl: float = AIR_SCORE_COMPANY_TTL):
+        self.supabase_client = supabase_client
+        self.max_entries = max_entries
+        self.company_ttl = company_ttl
+        self._users: "OrderedDict[str, AirScores]" = OrderedDict()
+        self._companies: "OrderedDict[str, _CompanyEntry]" = OrderedDict()
+        _stores.add(self)
+
+    async def _load(self, scope: str, user_ids: list[str]) -> AirScores:
+        scores = AirScores(groups=user_ids)
+        try:
+            async for rows in iter_info_message_facts(self.supabase_client, user_ids):
+                scores.add_columns(FactColumns.from_rows(rows, groups=user_ids))
+            air_score_loads.inc(scope=scope, result="ok")
+        except Exception as e:
+            air_score_loads.inc(scope=scope, result="error")
+            logger.error("Error loading AIR facts for %s scores: %s", scope, e)
+        return scores
+
+    async def user_scores(self, user_id: str) -> AirScores:
+        scores = self._users.get(user_id)
+        if scores is None:
+            scores = await self._load("user", [user_id])
+            self._users[user_id] = scores
+            while len(self._users) > self.max_entries:
+                self._users.popitem(last=False)
+        self._users.move_to_end(user_id)
+        return scores
+
+    async def company_scores(self, company_id: str) -> AirScores:
+        """Per-user scores of every user in the company; use .total() for the company rollup."""
+        entry = self._companies.get(company_id)
+        if entry is None or entry.expires_at < time.monotonic():
+            user_ids = await fetch_company_user_ids(self.supabase_client, company_id)
+            entry = _CompanyEntry(await self._load("company", user_ids), time.monotonic() + self.company_ttl)
+            self._companies[company_id] = entry
+            while len(self._companies) > self.max_entries:
+                self._companies.popitem(last=False)
+        self._companies.move_to_end(company_id)
+        return entry.scores
+
+    def record(self, user_id: str, category: str, content_dict: dict, created_at=None) -> None:
+        """Apply a newly stored fact to every cached aggregate that covers this user."""
+        user = self._users.get(user_id)
+        if user is not None and user.add(user_id, category, content_dict, created_at):
+            air_score_facts.inc(scope="user")
+        for entry in self._companies.values():
+            if user_id in entry.scores and entry.scores.add(user_id, category, content_dict, created_at):
+                air_score_facts.inc(scope="company")
+
+    async def prompt_summaries(self, user_id: str) -> dict[str, Optional[str]]:
+        """Summaries of the user's own facts and of what they said about their company."""
+        scores = await self.user_scores(user_id)
+        return {category: format_summary(scores.group_scores(user_id, category)) for category in CATEGORIES}
+
+
+registry.gauge("air_score_cached_aggregates", "Cached AIR score aggregates", ["scope"]).set_function(
+    lambda: [
+        ({"scope": "user"}, sum(len(store._users) for store in list(_stores))),
+        ({"scope": "company"}, sum(len(store._companies) for store in list(_stores))),
+    ]
+)
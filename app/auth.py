@@ -5,10 +5,7 @@ from datetime import datetime, timedelta, timezone
 from fastapi import Header, HTTPException, status
 from jose import jwt as jose_jwt  # Using python-jose to handle JWTs
 
-# Configure logging to capture debug messages.
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
 # Load environment variables (adjust override as needed).
 load_dotenv(override=False)
@@ -84,7 +81,7 @@ def validate_supabase_token(token: str) -> dict:
             detail="Supabase token has expired",
         )
     except jose_jwt.JWTError as e:
-        logger.warning(f"Invalid Supabase token: {e}")
+        logger.warning("Invalid Supabase token: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid Supabase token",
@@ -99,7 +96,7 @@ def create_fastapi_token(user_id: str, role: str) -> str:
         "iss": FASTAPI_JWT_ISSUER,
         "aud": FASTAPI_JWT_AUDIENCE,
     }
-    logger.debug(f"Creating FastAPI token with payload: {{'sub': {user_id}, 'exp': {expiration}, 'role': {role}}}")
+    logger.debug("Creating FastAPI token for sub=%s, exp=%s, role=%s", user_id, expiration, role)
     encoded_jwt = jose_jwt.encode(
         to_encode,
         FASTAPI_JWT_SECRET,
@@ -138,7 +135,7 @@ def decode_fastapi_token(token: str) -> dict:
             detail="FastAPI token has expired",
         )
     except jose_jwt.JWTError as e:
-        logger.warning(f"Invalid FastAPI token: {e}")
+        logger.warning("Invalid FastAPI token: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid FastAPI token",
@@ -159,5 +156,5 @@ def get_current_user(authorization: str = Header(None)) -> dict:
 
     token = authorization.removeprefix("Bearer ").strip()
     user_info = decode_fastapi_token(token)
-    logger.debug(f"User info extracted: {user_info}")
+    logger.debug("User info extracted: %s", user_info)
     return user_info
@@ -0,0 +1,371 @@
+# checkpoints.py
+# Checkpoints of multi_agent_graph runs, so a turn that fails halfway (typically a
+# ModelHTTPError from the Writer after the Update, Meta and Reviewer calls succeeded) can be
+# retried from the last completed node instead of redoing every LLM call.
+#
+# GraphCheckpoint is a pydantic-graph state persistence: the graph snapshots MultiAgentState
+# and the next node after every node, and marks each node running / success / error. The
+# snapshots are written to a CheckpointStore under the run's (user_id, session_id, message_id):
+#
+#   GRAPH_CHECKPOINT_STORE=memory   in-process dict (default; covers retries reaching this worker)
+#   GRAPH_CHECKPOINT_STORE=sqlite   SQLite file at GRAPH_CHECKPOINT_PATH, shared by the workers
+#                                   of one host and handy in tests (":memory:" works too)
+#   GRAPH_CHECKPOINT_STORE=none     no checkpoints
+#
+# A run's checkpoints are cleared once it ends; abandoned ones expire after GRAPH_CHECKPOINT_TTL.
+# Nodes carry no data, so a snapshot is the node's class name plus the state as orjson.
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from dataclasses import fields
+from datetime import datetime
+from time import perf_counter
+from typing import Any, AsyncIterator, Optional
+
+import orjson
+from pydantic_graph import BaseNode, End
+from pydantic_graph.exceptions import GraphNodeStatusError
+from pydantic_graph.persistence import BaseStatePersistence, EndSnapshot, NodeSnapshot, Snapshot
+
+from .classes import ChatMessage, CompanyInfoMessage, MessageLog, MultiAgentState, UserInfoMessage
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+GRAPH_CHECKPOINT_STORE = os.getenv("GRAPH_CHECKPOINT_STORE", "memory").lower()
+GRAPH_CHECKPOINT_PATH = os.getenv("GRAPH_CHECKPOINT_PATH", "graph_checkpoints.sqlite3")
+GRAPH_CHECKPOINT_TTL = float(os.getenv("GRAPH_CHECKPOINT_TTL", "3600"))
+GRAPH_CHECKPOINT_MAX_RUNS = int(os.getenv("GRAPH_CHECKPOINT_MAX_RUNS", "1024"))
+
+graph_checkpoint_resumes = registry.counter(
+    "graph_checkpoint_resumes_total", "Graph runs resumed from a checkpoint, by node", ["node"],
+)
+graph_checkpoint_errors = registry.counter(
+    "graph_checkpoint_errors_total", "Checkpoint store reads/writes that failed", ["op"],
+)
+
+RunKey = tuple[str, str, str]
+
+
+########################################################################
+# State (de)serialisation
+########################################################################
+
+# MultiAgentState fields holding a MessageLog, and the message type they hold
+_LOG_TYPES = {
+    "internalconversation": ChatMessage,
+    "latest_phase_prompt": ChatMessage,
+    "MA_response": ChatMessage,
+    "reviewer_response": ChatMessage,
+    "new_company_info": CompanyInfoMessage,
+    "new_user_AIR_info": UserInfoMessage,
+}
+
+
+def dump_state(state: MultiAgentState) -> bytes:
+    # orjson serialises the (slotted) message dataclasses, MessageLog (a dict) and datetimes natively
+    return orjson.dumps(state)
+
+
+def _message(cls, data: dict):
+    data = dict(data)
+    data["created_at"] = datetime.fromisoformat(data["created_at"])
+    return cls(**data)
+
+
+def load_state(raw: bytes) -> MultiAgentState:
+    data = orjson.loads(raw)
+    values = {}
+    for f in fields(MultiAgentState):
+        if f.name not in data:
+            continue
+        value = data[f.name]
+        if f.name in _LOG_TYPES:
+            log = MessageLog()
+            for message in value.values():
+                log.append(_message(_LOG_TYPES[f.name], message))
+            value = log
+        elif f.name == "writer_response" and value is not None:
+            value = _message(ChatMessage, value)
+        values[f.name] = value
+    return MultiAgentState(**values)
+
+
+########################################################################
+# Stores
+########################################################################
+
+class CheckpointStore(ABC):
+    """
+    Snapshot rows of graph runs: `put` inserts or replaces one snapshot of a run, `load`
+    returns a run's snapshots in the order they were first written, `clear` drops the run.
+    A row is a dict with id, kind ("node"/"end"), node, status and the state bytes.
+    """
+
+    @abstractmethod
+    async def put(self, run_key: RunKey, row: dict) -> None:
+        ...
+
+    @abstractmethod
+    async def load(self, run_key: RunKey) -> list[dict]:
+        ...
+
+    @abstractmethod
+    async def clear(self, run_key: RunKey) -> None:
+        ...
+
+
+class MemoryCheckpointStore(CheckpointStore):
+    def __init__(self, ttl: float = GRAPH_CHECKPOINT_TTL, max_runs: int = GRAPH_CHECKPOINT_MAX_RUNS):
+        self.ttl = ttl
+        self.max_runs = max_runs
+        # run_key -> (updated_at, {snapshot_id: row}); dicts keep insertion order
+        self._runs: dict[RunKey, tuple[float, dict[str, dict]]] = {}
+
+    async def put(self, run_key: RunKey, row: dict) -> None:
+        _, rows = self._runs.pop(run_key, (0.0, {}))
+        rows[row["id"]] = row
+        self._runs[run_key] = (time.monotonic(), rows)
+        self._evict()
+
+    async def load(self, run_key: RunKey) -> list[dict]:
+        entry = self._runs.get(run_key)
+        if entry is None:
+            return []
+        if entry[0] + self.ttl < time.monotonic():
+            del self._runs[run_key]
+            return []
+        return list(entry[1].values())
+
+    async def clear(self, run_key: RunKey) -> None:
+        self._runs.pop(run_key, None)
+
+    def _evict(self) -> None:
+        # Oldest runs first: re-inserted on every put, so the dict is ordered by last update
+        deadline = time.monotonic() - self.ttl
+        for key in list(self._runs):
+            if len(self._runs) <= self.max_runs and self._runs[key][0] >= deadline:
+                break
+            del self._runs[key]
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """Checkpoints in a SQLite file; the blocking calls run in a worker thread."""
+
+    def __init__(self, path: str = GRAPH_CHECKPOINT_PATH, ttl: float = GRAPH_CHECKPOINT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            create table if not exists graph_checkpoints (
+                user_id     text not null,
+                session_id  text not null,
+                message_id  text not null,
+                seq         integer not null,
+                snapshot_id text not null,
+                kind        text not null,
+                node        text,
+                status      text,
+                state       blob not null,
+                updated_at  real not null,
+                primary key (message_id, user_id, session_id, snapshot_id)
+            )
+            """
+        )
+        self._purge()
+
+    def _execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def put(self, run_key: RunKey, row: dict) -> None:
+        user_id, session_id, message_id = run_key
+        await asyncio.to_thread(
+            self._execute,
+            """
+            insert into graph_checkpoints
+                (user_id, session_id, message_id, seq, snapshot_id, kind, node, status, state, updated_at)
+            values (?, ?, ?,
+                    (select coalesce(max(seq), 0) + 1 from graph_checkpoints
+                     where message_id = ? and user_id = ? and session_id = ?),
+                    ?, ?, ?, ?, ?, ?)
+            on conflict (message_id, user_id, session_id, snapshot_id) do update set
+                status = excluded.status, updated_at = excluded.updated_at
+            """,
+            (user_id, session_id, message_id, message_id, user_id, session_id,
+             row["id"], row["kind"], row["node"], row["status"], row["state"], time.time()),
+        )
+
+    async def load(self, run_key: RunKey) -> list[dict]:
+        user_id, session_id, message_id = run_key
+        rows = await asyncio.to_thread(
+            self._execute,
+            """
+            select snapshot_id, kind, node, status, state from graph_checkpoints
+            where message_id = ? and user_id = ? and session_id = ? and updated_at >= ?
+            order by seq
+            """,
+            (message_id, user_id, session_id, time.time() - self.ttl),
+        )
+        return [
+            {"id": snapshot_id, "kind": kind, "node": node, "status": status, "state": state}
+            for snapshot_id, kind, node, status, state in rows
+        ]
+
+    async def clear(self, run_key: RunKey) -> None:
+        user_id, session_id, message_id = run_key
+        await asyncio.to_thread(
+            self._execute,
+            "delete from graph_checkpoints where message_id = ? and user_id = ? and session_id = ?",
+            (message_id, user_id, session_id),
+        )
+
+    def _purge(self) -> None:
+        self._execute("delete from graph_checkpoints where updated_at < ?", (time.time() - self.ttl,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def build_checkpoint_store(kind: str = GRAPH_CHECKPOINT_STORE) -> Optional[CheckpointStore]:
+    if kind == "none":
+        return None
+    if kind == "sqlite":
+        return SQLiteCheckpointStore()
+    if kind != "memory":
+        logger.warning("Unknown GRAPH_CHECKPOINT_STORE=%r, using the in-memory store", kind)
+    return MemoryCheckpointStore()
+
+
+########################################################################
+# pydantic-graph persistence
+########################################################################
+
+class GraphCheckpoint(BaseStatePersistence[MultiAgentState, Any]):
+    """
+    State persistence of one graph run, written through to a CheckpointStore. Keeps the
+    run's snapshots in memory as well; `restore()` loads them back for a retry.
+    """
+
+    def __init__(self, store: CheckpointStore, run_key: RunKey):
+        self.store = store
+        self.run_key = run_key
+        self.history: list[Snapshot[MultiAgentState, Any]] = []
+        self._nodes: dict[str, type[BaseNode]] = {}
+        # snapshot id -> the state serialised when the snapshot was taken. The snapshots hold the
+        # live state, which the next node mutates; a status change must not save its partial work.
+        self._states: dict[str, bytes] = {}
+
+    def set_graph_types(self, graph) -> None:
+        self._nodes = {node_id: node_def.node for node_id, node_def in graph.node_defs.items()}
+
+    async def _write(self, snapshot: Snapshot[MultiAgentState, Any]) -> None:
+        if isinstance(snapshot, NodeSnapshot):
+            row = {"id": snapshot.id, "kind": "node", "node": snapshot.node.get_node_id(), "status": snapshot.status}
+        else:
+            row = {"id": snapshot.id, "kind": "end", "node": None, "status": None}
+        row["state"] = self._states[snapshot.id]
+        try:
+            await self.store.put(self.run_key, row)
+        except Exception as e:
+            # Losing a checkpoint only costs the resume, never the turn itself
+            graph_checkpoint_errors.inc(op="put")
+            logger.warning("Could not write graph checkpoint for message_id=%s: %s", self.run_key[2], e)
+
+    async def snapshot_node(self, state: MultiAgentState, next_node: BaseNode) -> None:
+        snapshot = NodeSnapshot(state=state, node=next_node)
+        self.history.append(snapshot)
+        self._states[snapshot.id] = dump_state(state)
+        await self._write(snapshot)
+
+    async def snapshot_node_if_new(self, snapshot_id: str, state: MultiAgentState, next_node: BaseNode) -> None:
+        if not any(s.id == snapshot_id for s in self.history):
+            await self.snapshot_node(state, next_node)
+
+    async def snapshot_end(self, state: MultiAgentState, end: End) -> None:
+        snapshot = EndSnapshot(state=state, result=end)
+        self.history.append(snapshot)
+        self._states[snapshot.id] = dump_state(state)
+        await self._write(snapshot)
+
+    @asynccontextmanager
+    async def record_run(self, snapshot_id: str) -> AsyncIterator[None]:
+        snapshot = next((s for s in self.history if s.id == snapshot_id), None)
+        if not isinstance(snapshot, NodeSnapshot):
+            raise LookupError(f"No node snapshot found with id={snapshot_id!r}")
+        GraphNodeStatusError.check(snapshot.status)
+        snapshot.status = "running"
+        await self._write(snapshot)
+        start = perf_counter()
+        try:
+            yield
+        except Exception:
+            snapshot.duration = perf_counter() - start
+            snapshot.status = "error"
+            await self._write(snapshot)
+            raise
+        else:
+            snapshot.duration = perf_counter() - start
+            snapshot.status = "success"
+            await self._write(snapshot)
+
+    async def restore(self) -> bool:
+        """Load a previous attempt of this run; True when it left a node to resume from."""
+        try:
+            rows = await self.store.load(self.run_key)
+        except Exception as e:
+            graph_checkpoint_errors.inc(op="load")
+            logger.warning("Could not read graph checkpoints for message_id=%s: %s", self.run_key[2], e)
+            return False
+        history: list[Snapshot[MultiAgentState, Any]] = []
+        states: dict[str, bytes] = {}
+        for row in rows:
+            if row["kind"] == "end":
+                # The run already finished (its checkpoints weren't cleared); nothing to resume
+                return False
+            node_cls = self._nodes.get(row["node"])
+            if node_cls is None:
+                return False
+            node = node_cls()
+            node.set_snapshot_id(row["id"])
+            history.append(NodeSnapshot(state=load_state(row["state"]), node=node, status=row["status"], id=row["id"]))
+            states[row["id"]] = row["state"]
+        self.history = history
+        self._states = states
+        return self._resumable() is not None
+
+    def _resumable(self) -> Optional[NodeSnapshot[MultiAgentState, Any]]:
+        # The node after the last completed one: it failed, was cancelled or the process died while it ran
+        for snapshot in reversed(self.history):
+            if isinstance(snapshot, NodeSnapshot) and snapshot.status != "success":
+                return snapshot
+        return None
+
+    async def load_next(self) -> Optional[NodeSnapshot[MultiAgentState, Any]]:
+        snapshot = self._resumable()
+        if snapshot is not None:
+            snapshot.status = "pending"
+            graph_checkpoint_resumes.inc(node=snapshot.node.get_node_id())
+        return snapshot
+
+    async def load_all(self) -> list[Snapshot[MultiAgentState, Any]]:
+        return self.history
+
+    async def clear(self) -> None:
+        try:
+            await self.store.clear(self.run_key)
+        except Exception as e:
+            graph_checkpoint_errors.inc(op="clear")
+            logger.warning("Could not clear graph checkpoints for message_id=%s: %s", self.run_key[2], e)
+
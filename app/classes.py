@@ -1,13 +1,24 @@
 ##### for ChatMessage class
 import uuid
+from itertools import islice
 from datetime import datetime, timezone
 from dataclasses import dataclass, field
-from typing import Optional
-from pydantic_ai import Agent
-from pydantic import BaseModel
+from typing import TYPE_CHECKING, Awaitable, Callable, Generic, Iterator, Optional, TypeVar
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+    from .history import ConversationHistoryView, TranscriptView
+    from .rag import RAGEngine
+    from .model_routing import ModelRouter
+    from .response_cache import ResponseCache
+    from .accounting import TokenLedger
+    from .tts import SpeechStream
 
 ################# Chatmessage class
-@dataclass
+# Messages are slotted: a long session holds thousands of them across the state logs,
+# so they don't carry a per-instance __dict__ (see benchmarks/bench_message_log.py).
+@dataclass(slots=True)
 class ChatMessage:
     # Automatically generate a unique message ID on creation
     message_id: str = field(default_factory=lambda: str(uuid.uuid4()))
@@ -15,14 +26,14 @@ class ChatMessage:
     content: str = ""
     created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
 
-@dataclass
+@dataclass(slots=True)
 class CompanyInfoMessage:
     info_id:str = field(default_factory=lambda: str(uuid.uuid4()))
     content_dict: dict = field(default_factory=dict)
     content_str: str = ""
     created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
 
-@dataclass
+@dataclass(slots=True)
 class UserInfoMessage:
     info_id:str = field(default_factory=lambda: str(uuid.uuid4()))
     content_dict: dict = field(default_factory=dict)
@@ -30,17 +41,79 @@ class UserInfoMessage:
     created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
 
 
+################# Append-only message log
+M = TypeVar("M")
+
+class MessageLog(dict[str, M], Generic[M]):
+    """
+    Append-only, insertion-ordered log of messages keyed by message_id (or info_id).
+
+    Messages are appended in the order they are produced, which is also their created_at
+    order, so the latest entry is available in O(1) and ordered iteration needs no sort.
+    It is still a dict, so `log[msg_id]`, `.values()` and `len()` keep working, but entries
+    can only be added through append(), and only once: the history views read the log by
+    position, so replacing or reordering an entry would leave them stale.
+    """
+    __slots__ = ()
+
+    def append(self, message: M) -> M:
+        key = getattr(message, "message_id", None) or message.info_id
+        if key in self:
+            raise ValueError(f"Message {key} is already in the log")
+        dict.__setitem__(self, key, message)
+        return message
+
+    @classmethod
+    def _from_messages(cls, messages: list[M]) -> "MessageLog[M]":
+        log = cls()
+        for message in messages:
+            log.append(message)
+        return log
+
+    def __reduce__(self):
+        # copy, deepcopy and pickle would otherwise rebuild the log through __setitem__
+        return type(self)._from_messages, (list(self.values()),)
+
+    def latest(self) -> Optional[M]:
+        """Return the most recently appended message, or None when the log is empty."""
+        if not self:
+            return None
+        return next(reversed(self.values()))
+
+    def since(self, index: int) -> list[M]:
+        """Return the messages appended after the first `index` entries."""
+        if index <= 0:
+            return list(self.values())
+        return list(islice(self.values(), index, None))
+
+    def ordered(self) -> Iterator[M]:
+        """Iterate messages oldest to newest."""
+        return iter(self.values())
+
+    def _append_only(self, *args, **kwargs):
+        raise TypeError("MessageLog is append-only")
+
+    __setitem__ = _append_only
+    __ior__ = _append_only
+    __delitem__ = _append_only
+    update = _append_only
+    setdefault = _append_only
+    pop = _append_only
+    popitem = _append_only
+    clear = _append_only
+
+
 @dataclass
 class MultiAgentState:
     # CONVERSATION BETWEEN AGENTS
-    internalconversation: dict[str, ChatMessage] = field(default_factory=dict)
-    latest_phase_prompt: dict[str, ChatMessage] = field(default_factory=dict)
+    internalconversation: MessageLog[ChatMessage] = field(default_factory=MessageLog)
+    latest_phase_prompt: MessageLog[ChatMessage] = field(default_factory=MessageLog)
     
     # META-AGENT
-    MA_response: dict[str, ChatMessage] = field(default_factory=dict)
+    MA_response: MessageLog[ChatMessage] = field(default_factory=MessageLog)
 
     # REVIEWER
-    reviewer_response: dict[str, ChatMessage] = field(default_factory=dict)
+    reviewer_response: MessageLog[ChatMessage] = field(default_factory=MessageLog)
     # When this flag switches to True during run, it stops the loop Frits <--> Reviewer
     reviewer_approval: bool = False
     session_finished: bool = False
@@ -49,17 +122,17 @@ class MultiAgentState:
     writer_response: Optional[ChatMessage] = None
 
     # GRADING AGENT
-    new_company_info: dict[str, CompanyInfoMessage] = field(default_factory=dict)
-    new_user_AIR_info: dict[str, UserInfoMessage] = field(default_factory=dict)
+    new_company_info: MessageLog[CompanyInfoMessage] = field(default_factory=MessageLog)
+    new_user_AIR_info: MessageLog[UserInfoMessage] = field(default_factory=MessageLog)
 
 
 @dataclass
 class MultiAgentDeps:
     # Agents used in the multi-agent system
-    meta_agent: Agent
-    reviewer_agent: Agent
-    writer_agent: Agent
-    update_agent: Agent
+    meta_agent: "Agent"
+    reviewer_agent: "Agent"
+    writer_agent: "Agent"
+    update_agent: "Agent"
 
     # Filled by front-end and supabase
     user_id: str
@@ -68,7 +141,32 @@ class MultiAgentDeps:
     # Session information
     session_id: str = ""
     user_message: ChatMessage = field(default_factory=dict)
-    conversation_history: dict[str, ChatMessage] = field(default_factory=dict)
+    conversation_history: MessageLog[ChatMessage] = field(default_factory=MessageLog)
+
+    # Shared views over the histories, built once per run and reused by every agent
+    history_view: Optional["ConversationHistoryView"] = None
+    internal_transcript: Optional["TranscriptView"] = None
+
+    # In-process retrieval over the framework texts and company info_messages
+    rag_engine: Optional["RAGEngine"] = None
+
+    # Framework themes already covered in this session's info_messages (most frequent first)
+    covered_themes: list[str] = field(default_factory=list)
+
+    # Sends cheap sub-tasks to the small deployment (None: every task uses its agent's model)
+    model_router: Optional["ModelRouter"] = None
+
+    # Opt-in cache of Meta/Reviewer/Writer outputs for repeated early-phase turns
+    response_cache: Optional["ResponseCache"] = None
+
+    # Receives the writer's text deltas as they are generated (WebSocket turns); None: no streaming
+    writer_stream: Optional[Callable[[str], Awaitable[None]]] = None
+
+    # Token usage per user/session/company and the budgets that can skip optional stages
+    token_ledger: Optional["TokenLedger"] = None
+
+    # Speaks the writer's answer sentence by sentence for TTS_flag users (WebSocket turns)
+    speech: Optional["SpeechStream"] = None
 
 
 
@@ -89,4 +187,31 @@ class InputMessage(BaseModel):
 
 class OutputMessage(BaseModel):
     response: str
-    session_id: str
\ No newline at end of file
+    session_id: str
+
+
+####### Update Agent parse outputs (validated before they are stored in content_dict)
+class _InfoFacts(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    score: float = Field(ge=0, le=1)
+    relevance: float = Field(ge=0, le=1)
+    themes: list[str] = Field(default_factory=list)
+
+    @field_validator("themes", mode="before")
+    @classmethod
+    def _themes_as_list(cls, value):
+        # Models sometimes return a single theme as a string, or null for "no theme"
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return [value]
+        return value
+
+
+class UserInfoFacts(_InfoFacts):
+    topic: str
+
+
+class CompanyInfoFacts(_InfoFacts):
+    description: str
@@ -0,0 +1,111 @@
+# coalescing.py
+# In-process request coalescing and per-session ordering for chat turns.
+#
+# SingleFlight: concurrent calls with the same key share one execution. A double-clicked
+# send or a frontend retry of the same message_id awaits the pipeline that's already running
+# instead of starting a second one (and writing a second writer message). When the last
+# caller of a run disconnects, the run can be cancelled with it (see send_message).
+# KeyedLocks: one asyncio.Lock per key, so turns of the same session run one after the
+# other and turn N+1 reads the history only after turn N has been stored.
+#
+# Both are per process: with several uvicorn workers, duplicates that land on different
+# workers are not coalesced.
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Hashable
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+coalesced_requests = registry.counter(
+    "chat_coalesced_requests_total", "Requests that joined an in-flight run of the same turn",
+)
+cancelled_runs = registry.counter(
+    "chat_cancelled_runs_total", "Runs cancelled because every caller waiting on them went away",
+)
+session_lock_wait = registry.histogram(
+    "chat_session_lock_wait_seconds", "Time a turn waited for the previous turn of its session",
+)
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers get the same result or exception."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self._waiters: dict[Hashable, int] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], cancel_when_abandoned: bool = False) -> Any:
+        """
+        With cancel_when_abandoned, a caller that is cancelled while it is the last one
+        waiting cancels the run too (its client went away, nobody will read the result).
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fn(), name=f"{self.name}:{key}")
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            coalesced_requests.inc()
+            logger.info("Coalesced duplicate %s request for %s", self.name, key)
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # Shielded: a caller that goes away must not cancel the run the others are waiting on
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if cancel_when_abandoned and self._waiters[key] == 1 and not task.done():
+                cancelled_runs.inc()
+                logger.info("Cancelling %s run for %s: every caller went away", self.name, key)
+                task.cancel()
+            raise
+        finally:
+            remaining = self._waiters[key] - 1
+            if remaining:
+                self._waiters[key] = remaining
+            else:
+                del self._waiters[key]
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Retrieve any exception even if every waiter went away, so asyncio doesn't log it as lost
+            task.exception()
+
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+
+class KeyedLocks:
+    """asyncio.Lock per key, created on demand and dropped when nobody holds or waits for it."""
+
+    def __init__(self):
+        self._locks: dict[Hashable, tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        lock, users = self._locks.get(key) or (asyncio.Lock(), 0)
+        self._locks[key] = (lock, users + 1)
+        start = time.perf_counter()
+        try:
+            async with lock:
+                session_lock_wait.observe(time.perf_counter() - start)
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users <= 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+
+turn_flight = SingleFlight("turn")
+session_locks = KeyedLocks()
+
+registry.gauge("chat_inflight_turns", "Chat turns currently running in this process").set_function(
+    lambda: [({}, turn_flight.inflight())]
+)
@@ -1,13 +1,25 @@
 # dependencies.py
 import os
+import logging
+from typing import Optional
 from dotenv import load_dotenv
 
 from supabase._async.client import AsyncClient
 
 from openai import AsyncAzureOpenAI
-from pydantic_ai.models.openai import OpenAIModel
+from pydantic_ai.models import Model
 from pydantic_ai import Agent
 from .classes import review_agent_deps
+from .rag import RAG_ENABLED, RAGEngine
+from .http_pools import build_azure_http_client, tune_postgrest_session, close_pools
+from .result_cache import TURN_RESULT_CACHE_ENABLED, TurnResultCache
+from .model_routing import AZURE_MODEL_NAME_SMALL, ModelRouter
+from .response_cache import RESPONSE_CACHE_ENABLED, ResponseCache
+from .air_scoring import AirScoreStore
+from .checkpoints import CheckpointStore, build_checkpoint_store
+from .failover import build_endpoints, build_model
+from .accounting import AccountedModel, TokenLedger, build_ledger
+from .tts import TTSBackend, build_tts_backend
 
 load_dotenv()  # Ensure env variables are loaded
 
@@ -19,14 +31,22 @@ class Clients:
         azure_client: AsyncAzureOpenAI,
 
 
-        model_update: OpenAIModel,
+        model_update: Model,
         update_agent: Agent,
-        model_meta: OpenAIModel,
+        model_meta: Model,
         meta_agent: Agent,
-        model_reviewer: OpenAIModel,
+        model_reviewer: Model,
         reviewer_agent: Agent,
-        model_writer: OpenAIModel,
+        model_writer: Model,
         writer_agent: Agent,
+        rag_engine: Optional[RAGEngine] = None,
+        turn_results: Optional[TurnResultCache] = None,
+        model_router: Optional[ModelRouter] = None,
+        response_cache: Optional[ResponseCache] = None,
+        air_scores: Optional[AirScoreStore] = None,
+        graph_checkpoints: Optional[CheckpointStore] = None,
+        token_ledger: Optional[TokenLedger] = None,
+        tts_backend: Optional[TTSBackend] = None,
     ):
         self.supabase_client = supabase_client
         self.azure_client = azure_client
@@ -43,6 +63,21 @@ class Clients:
         self.model_writer = model_writer
         self.writer_agent = writer_agent
 
+        self.rag_engine = rag_engine
+        self.turn_results = turn_results
+        self.model_router = model_router or ModelRouter()
+        self.response_cache = response_cache
+        self.air_scores = air_scores
+        self.graph_checkpoints = graph_checkpoints
+        self.token_ledger = token_ledger
+        self.tts_backend = tts_backend
+
+    async def aclose(self) -> None:
+        """Write the pending token usage, then close the pooled HTTP connections of the Azure and Supabase clients."""
+        if self.token_ledger is not None:
+            await self.token_ledger.aclose()
+        await close_pools()
+
 
 async def init_clients() -> Clients:
     # --- Supabase client ---
@@ -50,13 +85,32 @@ async def init_clients() -> Clients:
         supabase_url=os.getenv("SUPABASE_URL"),
         supabase_key=os.getenv("SUPABASE_SERVICE_KEY"),
     )
+    await tune_postgrest_session(supabase)
 
     # --- Azure OpenAI client ---
+    # One pooled httpx client, shared by all four OpenAIModels through this client.
+    azure_http = build_azure_http_client()
     azure = AsyncAzureOpenAI(
         azure_endpoint=os.getenv("AZURE_ENDPOINT"),
         api_version=os.getenv("AZURE_RESOURCE_API_VERSION"),
         api_key=os.getenv("AZURE_RESOURCE_API_KEY"),
+        http_client=azure_http,
     )
+    # Extra regions from AZURE_FAILOVER_ENDPOINTS (see failover.py); just `azure` without them
+    endpoints = build_endpoints(azure, azure_http)
+
+    # --- Small deployment for cheap sub-tasks (see model_routing.py), sharing the Azure pool ---
+    small_model = None
+    if AZURE_MODEL_NAME_SMALL:
+        small_model = build_model(endpoints, "AZURE_MODEL_NAME_SMALL", AZURE_MODEL_NAME_SMALL)
+
+    # --- Token accounting: every model reports its usage, over-budget turns use the small model ---
+    token_ledger = build_ledger(supabase)
+
+    def accounted(model, name: str, downgrade_model=None):
+        if token_ledger is None:
+            return model
+        return AccountedModel(model, agent=name, ledger=token_ledger, downgrade_model=downgrade_model)
 
     # Agent configuration list: (env_var, agent_name, deps_type)
     configs = [
@@ -71,11 +125,8 @@ async def init_clients() -> Clients:
     agents = {}
 
     for env_var, name, deps in configs:
-        # Initialize model
-        model = OpenAIModel(
-            model_name=os.getenv(env_var),
-            openai_client=azure,
-        )
+        # Initialize model (a FailoverModel over the endpoints when there are several)
+        model = accounted(build_model(endpoints, env_var), name, small_model)
         
         # Instantiate agent
         agents[name] = Agent(
@@ -87,6 +138,14 @@ async def init_clients() -> Clients:
 
         models[name] = model
 
+    # --- Reviewer retrieval engine (framework index is memory-mapped and shared per host) ---
+    rag_engine = None
+    if RAG_ENABLED:
+        try:
+            rag_engine = RAGEngine.create(supabase_client=supabase)
+        except Exception as e:
+            logging.error("Could not initialise the RAG engine, reviewer runs without retrieval: %s", e)
+
     return Clients(
         supabase_client=supabase,
         azure_client=azure,
@@ -99,6 +158,14 @@ async def init_clients() -> Clients:
         reviewer_agent=agents["Reviewer"],
         model_writer=models["Writer"],
         writer_agent=agents["Writer"],
+        rag_engine=rag_engine,
+        turn_results=TurnResultCache(supabase_client=supabase) if TURN_RESULT_CACHE_ENABLED else None,
+        model_router=ModelRouter(small_model=accounted(small_model, "small") if small_model is not None else None),
+        response_cache=ResponseCache() if RESPONSE_CACHE_ENABLED else None,
+        air_scores=AirScoreStore(supabase_client=supabase),
+        graph_checkpoints=build_checkpoint_store(),
+        token_ledger=token_ledger,
+        tts_backend=build_tts_backend(),
     )
 
 
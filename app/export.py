@@ -0,0 +1,339 @@
+# export.py
+# Bulk export of chat sessions, messages and the parsed Update Agent facts into columnar files
+# for the research reporting.
+#
+#   python -m app.export --out exports/2025-q1 [--company ID] [--since 2025-01-01] [--until 2025-04-01]
+#                        [--tables sessions,messages,facts] [--format auto|parquet|arrow|npz]
+#
+# Every table is read with keyset pagination on (created_at, id), so each page is one indexed
+# range query regardless of how deep the export is, and pages are buffered only until
+# EXPORT_ROWS_PER_FILE rows are written to a part file (part-00001.parquet, ...). Memory use
+# therefore stays constant. After each part file the position is saved to checkpoint.json in
+# the output directory; running the same command again resumes from there (a different set
+# of filters is refused rather than mixed into the same directory).
+#
+# Parquet and Arrow IPC need pyarrow; without it "auto" writes NumPy .npz part files.
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import orjson
+
+from .info_messages import fetch_company_user_ids
+from .logging_config import configure_logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+EXPORT_ROWS_PER_FILE = int(os.getenv("EXPORT_ROWS_PER_FILE", "50000"))
+# Users per `in` filter when exporting one company
+EXPORT_USERS_PER_QUERY = int(os.getenv("EXPORT_USERS_PER_QUERY", "200"))
+
+CHECKPOINT_FILE = "checkpoint.json"
+FORMATS = ("parquet", "arrow", "npz")
+
+
+@dataclass(frozen=True)
+class ExportTable:
+    name: str
+    source: str
+    key: str                             # unique id column, the keyset tie-breaker
+    select: str
+    user_column: str                     # column the company filter applies to
+    columns: tuple[tuple[str, str], ...]  # (name, kind) with kind in str/float/bool/timestamp
+
+
+TABLES = {
+    "sessions": ExportTable(
+        name="sessions",
+        source="chat_sessions",
+        key="id",
+        select="id, user_id, finished, created_at",
+        user_column="user_id",
+        columns=(("session_id", "str"), ("user_id", "str"), ("finished", "bool"), ("created_at", "timestamp")),
+    ),
+    "messages": ExportTable(
+        name="messages",
+        source="chat_messages",
+        key="message_id",
+        select="message_id, user_id, session_id, role, content, created_at",
+        user_column="user_id",
+        columns=(
+            ("message_id", "str"), ("user_id", "str"), ("session_id", "str"),
+            ("role", "str"), ("content", "str"), ("created_at", "timestamp"),
+        ),
+    ),
+    "facts": ExportTable(
+        name="facts",
+        source="info_messages",
+        key="info_id",
+        select="info_id, message_id, category, content_dict, content_str, created_at, chat_messages!inner(user_id, session_id)",
+        user_column="chat_messages.user_id",
+        columns=(
+            ("info_id", "str"), ("message_id", "str"), ("user_id", "str"), ("session_id", "str"),
+            ("category", "str"), ("content_str", "str"), ("topic", "str"), ("score", "float"),
+            ("relevance", "float"), ("themes", "str"), ("created_at", "timestamp"),
+        ),
+    ),
+}
+
+
+def _flatten(table: ExportTable, row: dict) -> dict:
+    if table.name == "sessions":
+        return {**row, "session_id": row.get("id")}
+    if table.name != "facts":
+        return row
+    content = row.get("content_dict") or {}
+    joined = row.get("chat_messages") or {}
+    themes = content.get("themes") or []
+    return {
+        **row,
+        "user_id": joined.get("user_id"),
+        "session_id": joined.get("session_id"),
+        # User facts carry a topic, company facts a description
+        "topic": content.get("topic") or content.get("description"),
+        "score": content.get("score"),
+        "relevance": content.get("relevance"),
+        "themes": "|".join(map(str, [themes] if isinstance(themes, str) else themes)),
+    }
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _timestamp(value) -> np.datetime64:
+    if not value:
+        return np.datetime64("NaT", "us")
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    # Stored as naive UTC; Parquet/Arrow mark the column as UTC
+    return np.datetime64(int(parsed.timestamp() * 1_000_000), "us")
+
+
+def to_columns(table: ExportTable, rows: list[dict]) -> dict[str, np.ndarray]:
+    """Column arrays for a batch of rows; strings stay object arrays (None for null)."""
+    flat = [_flatten(table, row) for row in rows]
+    columns = {}
+    for name, kind in table.columns:
+        values = [row.get(name) for row in flat]
+        if kind == "float":
+            columns[name] = np.fromiter((_float(v) for v in values), dtype=np.float64, count=len(values))
+        elif kind == "bool":
+            columns[name] = np.fromiter((bool(v) for v in values), dtype=bool, count=len(values))
+        elif kind == "timestamp":
+            columns[name] = np.array([_timestamp(v) for v in values], dtype="datetime64[us]")
+        else:
+            columns[name] = np.array([None if v is None else str(v) for v in values], dtype=object)
+    return columns
+
+
+def write_part(path_stem: str, fmt: str, table: ExportTable, columns: dict[str, np.ndarray]) -> str:
+    """Write one part file and return its path. The file appears only once it is complete."""
+    path = f"{path_stem}.{'arrow' if fmt == 'arrow' else fmt}"
+    tmp = f"{path}.tmp"
+    if fmt == "npz":
+        # .npz can't hold nulls in string columns without pickling, so they become ""
+        arrays = {
+            name: np.array(["" if v is None else v for v in columns[name]], dtype=str) if kind == "str" else columns[name]
+            for name, kind in table.columns
+        }
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **arrays)
+    else:
+        types = {"str": pa.string(), "float": pa.float64(), "bool": pa.bool_(), "timestamp": pa.timestamp("us", tz="UTC")}
+        batch = pa.table({
+            name: pa.array(columns[name], type=types[kind], from_pandas=kind == "float")
+            for name, kind in table.columns
+        })
+        if fmt == "parquet":
+            pa.parquet.write_table(batch, tmp, compression="zstd")
+        else:
+            with pa.ipc.new_file(tmp, batch.schema) as writer:
+                writer.write_table(batch)
+    os.replace(tmp, path)
+    return path
+
+
+class ExportCheckpoint:
+    """Per-table export position, saved atomically next to the part files."""
+
+    def __init__(self, directory: str, filters: dict):
+        self.path = os.path.join(directory, CHECKPOINT_FILE)
+        self.fingerprint = hashlib.sha256(orjson.dumps(filters, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        self.tables: dict[str, dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                saved = orjson.loads(f.read())
+            if saved.get("fingerprint") != self.fingerprint:
+                raise ValueError(f"{directory} holds an export with other filters ({saved.get('filters')}); use another --out")
+            self.tables = saved.get("tables", {})
+        self.filters = filters
+
+    def position(self, table: str) -> dict:
+        return self.tables.setdefault(table, {"group": 0, "created_at": None, "id": None, "part": 0, "rows": 0, "done": False})
+
+    def save(self) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(
+                {"fingerprint": self.fingerprint, "filters": self.filters, "tables": self.tables},
+                option=orjson.OPT_INDENT_2,
+            ))
+        os.replace(tmp, self.path)
+
+
+async def _pages(supabase_client, table: ExportTable, position: dict, user_groups: Optional[list[list[str]]], since: Optional[str], until: Optional[str], page_size: int):
+    """Yield (rows, group, last_created_at, last_id) pages from the checkpointed position on."""
+    groups = user_groups if user_groups is not None else [None]
+    group_index = position["group"]
+    cursor_at, cursor_id = position["created_at"], position["id"]
+    while group_index < len(groups):
+        query = supabase_client.table(table.source).select(table.select)
+        if groups[group_index] is not None:
+            query = query.in_(table.user_column, groups[group_index])
+        if since:
+            query = query.gte("created_at", since)
+        if until:
+            query = query.lt("created_at", until)
+        if cursor_at is not None:
+            # Keyset: strictly after the last exported (created_at, id)
+            query = query.or_(f'created_at.gt."{cursor_at}",and(created_at.eq."{cursor_at}",{table.key}.gt.{cursor_id})')
+        response = await query.order("created_at").order(table.key).limit(page_size).execute()
+        rows = response.data or []
+        if rows:
+            cursor_at, cursor_id = rows[-1]["created_at"], rows[-1][table.key]
+            yield rows, group_index, cursor_at, cursor_id
+        if len(rows) < page_size:
+            group_index += 1
+            cursor_at = cursor_id = None
+            yield [], group_index, None, None
+
+
+async def export_table(
+    supabase_client,
+    table: ExportTable,
+    directory: str,
+    fmt: str,
+    checkpoint: ExportCheckpoint,
+    user_groups: Optional[list[list[str]]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    page_size: int = EXPORT_PAGE_SIZE,
+    rows_per_file: int = EXPORT_ROWS_PER_FILE,
+) -> dict:
+    """Export one table into `directory/<table>/part-NNNNN.<fmt>`; returns its checkpoint entry."""
+    position = checkpoint.position(table.name)
+    if position["done"]:
+        logger.info("Export of %s already complete (%d rows)", table.name, position["rows"])
+        return position
+    os.makedirs(os.path.join(directory, table.name), exist_ok=True)
+
+    buffered: list[dict] = []
+    pending = dict(position)
+
+    def flush() -> None:
+        nonlocal buffered
+        if buffered:
+            part = position["part"] + 1
+            path = write_part(os.path.join(directory, table.name, f"part-{part:05d}"), fmt, table, to_columns(table, buffered))
+            logger.info("Export %s: wrote %s (%d rows)", table.name, path, len(buffered))
+            pending.update(part=part, rows=position["rows"] + len(buffered))
+            buffered = []
+        position.update(pending)
+        checkpoint.save()
+
+    async for rows, group, cursor_at, cursor_id in _pages(supabase_client, table, position, user_groups, since, until, page_size):
+        buffered.extend(rows)
+        pending.update(group=group, created_at=cursor_at, id=cursor_id)
+        if len(buffered) >= rows_per_file:
+            flush()
+    pending["done"] = True
+    flush()
+    return position
+
+
+async def run_export(
+    supabase_client,
+    directory: str,
+    tables: list[str],
+    fmt: str = "auto",
+    company_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> dict:
+    if fmt == "auto":
+        fmt = "parquet" if pa is not None else "npz"
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    if fmt != "npz" and pa is None:
+        raise ValueError(f"The {fmt} format needs pyarrow; install it or use --format npz")
+    unknown = [name for name in tables if name not in TABLES]
+    if unknown:
+        raise ValueError(f"Unknown export tables {unknown}; expected some of {', '.join(TABLES)}")
+
+    os.makedirs(directory, exist_ok=True)
+    checkpoint = ExportCheckpoint(directory, {
+        "tables": sorted(tables), "format": fmt, "company_id": company_id, "since": since, "until": until,
+    })
+
+    user_groups = None
+    if company_id:
+        user_ids = sorted(await fetch_company_user_ids(supabase_client, company_id))
+        user_groups = [user_ids[i:i + EXPORT_USERS_PER_QUERY] for i in range(0, len(user_ids), EXPORT_USERS_PER_QUERY)]
+
+    summary = {}
+    for name in tables:
+        position = await export_table(
+            supabase_client, TABLES[name], directory, fmt, checkpoint,
+            user_groups=user_groups, since=since, until=until,
+        )
+        summary[name] = {"rows": position["rows"], "parts": position["part"]}
+    return summary
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from dotenv import load_dotenv
+    from supabase._async.client import AsyncClient
+
+    from .http_pools import close_pools, tune_postgrest_session
+
+    load_dotenv()
+    supabase = AsyncClient(supabase_url=os.getenv("SUPABASE_URL"), supabase_key=os.getenv("SUPABASE_SERVICE_KEY"))
+    await tune_postgrest_session(supabase)
+    try:
+        summary = await run_export(
+            supabase, args.out, [t.strip() for t in args.tables.split(",") if t.strip()],
+            fmt=args.format, company_id=args.company, since=args.since, until=args.until,
+        )
+    finally:
+        await close_pools()
+    for name, result in summary.items():
+        print(f"{name}: {result['rows']:,} rows in {result['parts']} part files")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export sessions, messages and facts to columnar files")
+    parser.add_argument("--out", required=True, help="output directory (also holds the resume checkpoint)")
+    parser.add_argument("--tables", default="sessions,messages,facts", help=f"comma-separated subset of {', '.join(TABLES)}")
+    parser.add_argument("--format", default="auto", choices=("auto",) + FORMATS)
+    parser.add_argument("--company", help="only users of this company_id")
+    parser.add_argument("--since", help="created_at >= this ISO date/time")
+    parser.add_argument("--until", help="created_at < this ISO date/time")
+    configure_logging(fmt="text")
+    asyncio.run(_main(parser.parse_args()))
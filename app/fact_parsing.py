@@ -0,0 +1,170 @@
+# fact_parsing.py
+# Parsing and validation of the Update Agent's JSON outputs.
+#
+# parse_json_result() is the fast path: fence stripping with plain string operations and
+# orjson. When that fails, repair_json() makes one pass over the text that drops surrounding
+# prose, trailing commas and closes whatever a truncated (streamed or cut-off) answer left
+# open. parse_facts() then validates the object against UserInfoFacts / CompanyInfoFacts.
+# Nothing here calls the LLM, so it can be used for bulk re-processing of stored extractions;
+# that work is CPU-bound, so run it in a process pool rather than on the event loop.
+import os
+from typing import Optional
+
+import orjson
+from pydantic import BaseModel, ValidationError
+
+from .classes import CompanyInfoFacts, UserInfoFacts
+from .metrics import registry
+
+# json_repair calls the Update Agent makes for a parse answer that doesn't validate
+UPDATE_PARSE_MAX_RETRIES = int(os.getenv("UPDATE_PARSE_MAX_RETRIES", "1"))
+
+FACT_MODELS: dict[str, type[BaseModel]] = {
+    "user": UserInfoFacts,
+    "company": CompanyInfoFacts,
+}
+
+fact_parse_results = registry.counter(
+    "update_agent_parse_total",
+    "Update Agent parse outcomes (ok, repaired, retried, failed)",
+    ["kind", "result"],
+)
+
+
+def _strip_fences(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        newline = text.find("\n")
+        text = text[newline + 1:] if newline != -1 else text.lstrip("`")
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+def repair_json(text: str) -> Optional[str]:
+    """
+    Return the first JSON object in `text` made loadable, or None when there is no object.
+    Handles prose around the object, trailing commas and truncation: open strings, arrays and
+    objects are closed, and a dangling key without a value gets null.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    out: list[str] = []
+    stack: list[str] = []
+    in_string = escaped = False
+    for char in text[start:]:
+        if in_string:
+            # Raw line breaks inside strings aren't valid JSON
+            out.append({"\n": "\\n", "\r": "\\r", "\t": "\\t"}.get(char, char))
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            _drop_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(char)
+            if not stack:
+                return "".join(out)
+            continue
+        elif char.isspace():
+            continue
+        out.append(char)
+
+    # Truncated: close what is still open
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+    _drop_trailing_comma(out)
+    tail = "".join(out)
+    if tail.endswith(":"):
+        tail += " null"
+    elif stack and stack[-1] == "}" and tail.endswith('"') and _dangling_key(tail):
+        tail += ": null"
+    return tail + "".join(reversed(stack))
+
+
+def _drop_trailing_comma(out: list[str]) -> None:
+    # Whitespace outside strings is dropped, so the comma, if any, is the last piece
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def _dangling_key(text: str) -> bool:
+    # `{"a": 1, "b"` - the last string follows "{" or "," so it is a key without a value
+    opening = text.rfind('"', 0, len(text) - 1)
+    while opening > 0 and text[opening - 1] == "\\":
+        opening = text.rfind('"', 0, opening - 1)
+    before = text[:opening].rstrip()
+    return before.endswith(("{", ","))
+
+
+def _load_repaired(text: str) -> dict:
+    # Prose around a complete object is the common case and needs no scan
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            value = orjson.loads(text[start:end + 1])
+        except orjson.JSONDecodeError:
+            pass
+        else:
+            if isinstance(value, dict):
+                return value
+    repaired = repair_json(text)
+    if repaired is None:
+        raise ValueError("No JSON object found in the provided text.")
+    try:
+        value = orjson.loads(repaired)
+    except orjson.JSONDecodeError as e:
+        raise ValueError(f"Failed to extract valid JSON from the result: {e}") from e
+    if not isinstance(value, dict):
+        raise ValueError(f"Expected a JSON object, got {type(value).__name__}.")
+    return value
+
+
+def parse_json_result(text: str) -> dict:
+    """Parse an LLM answer that should be a JSON object; raises ValueError when it isn't."""
+    text = _strip_fences(text or "")
+    try:
+        value = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return _load_repaired(text)
+    if not isinstance(value, dict):
+        raise ValueError(f"Expected a JSON object, got {type(value).__name__}.")
+    return value
+
+
+def parse_facts(text: str, kind: str) -> tuple[Optional[dict], str, Optional[str]]:
+    """
+    Parse and validate one parse-task answer of the given kind ("user" or "company").
+    Returns (facts, result, error): facts is the validated dict or None, result is
+    "ok" / "repaired" / "invalid", error describes what was wrong (for the retry prompt).
+    """
+    cleaned = _strip_fences(text or "")
+    repaired = False
+    try:
+        value = orjson.loads(cleaned)
+    except orjson.JSONDecodeError:
+        repaired = True
+        try:
+            value = _load_repaired(cleaned)
+        except ValueError as e:
+            return None, "invalid", str(e)
+    if not isinstance(value, dict):
+        return None, "invalid", f"Expected a JSON object, got {type(value).__name__}."
+    try:
+        facts = FACT_MODELS[kind].model_validate(value)
+    except ValidationError as e:
+        errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+        return None, "invalid", f"JSON did not match the schema: {errors}"
+    return facts.model_dump(), "repaired" if repaired else "ok", None
@@ -0,0 +1,347 @@
+# failover.py
+# Failover across several Azure OpenAI endpoints (regions / resources) that serve the same
+# deployments. Each agent gets a FailoverModel over one OpenAIModel per endpoint instead of a
+# single OpenAIModel, so a degraded region costs one failed attempt instead of a failed turn.
+#
+#   AZURE_FAILOVER_ENDPOINTS='[
+#       {"name": "swedencentral", "endpoint": "https://...", "api_key_env": "AZURE_KEY_SWC",
+#        "api_version": "2024-10-21", "deployments": {"AZURE_MODEL_NAME_WA": "gpt-4o-swc"}}
+#   ]'
+#
+# The primary AZURE_ENDPOINT always comes first; extra endpoints use the primary's API version
+# and deployment names unless they override them ("deployments" is keyed by the env var that
+# names the deployment, e.g. AZURE_MODEL_NAME_MA).
+#
+# Every endpoint/deployment pair keeps a health record: a latency EWMA of successful requests,
+# an error-rate EWMA and a circuit breaker. A request goes to the closed endpoint with the lowest
+# latency (weighted up by its error rate) and fails over to the next one on 5xx, 429, timeouts,
+# connection errors and auth/deployment errors. Request errors (400, e.g. content filter) are
+# raised right away: another region would reject them as well. After AZURE_BREAKER_FAILURES
+# consecutive failures an endpoint's breaker opens for AZURE_BREAKER_COOLDOWN seconds; then a
+# single probe request decides whether it closes again. When every breaker is open the endpoints
+# are still tried, longest-open first, rather than failing without a request.
+#
+# Streamed requests fail over only until the stream has started; a stream that breaks later still
+# counts as a failure of its endpoint.
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+from openai import APIConnectionError, AsyncAzureOpenAI
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.models import Model, StreamedResponse
+from pydantic_ai.models.openai import OpenAIModel
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+AZURE_FAILOVER_ENDPOINTS = os.getenv("AZURE_FAILOVER_ENDPOINTS", "")
+# SDK-level retries per endpoint when failover is on; the next endpoint is the retry
+AZURE_FAILOVER_SDK_RETRIES = int(os.getenv("AZURE_FAILOVER_SDK_RETRIES", "0"))
+AZURE_BREAKER_FAILURES = int(os.getenv("AZURE_BREAKER_FAILURES", "3"))
+AZURE_BREAKER_COOLDOWN = float(os.getenv("AZURE_BREAKER_COOLDOWN", "30"))
+AZURE_HEALTH_ALPHA = float(os.getenv("AZURE_HEALTH_ALPHA", "0.2"))
+# How much a 100% error rate inflates an endpoint's latency score
+AZURE_HEALTH_ERROR_PENALTY = float(os.getenv("AZURE_HEALTH_ERROR_PENALTY", "4"))
+
+failover_attempts = registry.counter(
+    "azure_endpoint_requests_total", "Model requests per Azure endpoint and outcome", ["endpoint", "deployment", "result"],
+)
+failovers = registry.counter(
+    "azure_failovers_total", "Requests moved to another Azure endpoint, by reason", ["deployment", "reason"],
+)
+breaker_transitions = registry.counter(
+    "azure_breaker_transitions_total", "Circuit breaker state changes", ["endpoint", "deployment", "state"],
+)
+
+# Statuses a different endpoint may well answer: overload, throttling, outages, and an endpoint
+# that is misconfigured or lacks the deployment
+_FAILOVER_STATUSES = {401, 403, 404, 408, 409, 429}
+
+
+########################################################################
+# Health and circuit breaking
+########################################################################
+
+@dataclass
+class EndpointHealth:
+    """Observed health of one endpoint/deployment pair, shared by every model that uses it."""
+    endpoint: str
+    deployment: str
+    latency: Optional[float] = None
+    error_rate: float = 0.0
+    consecutive_failures: int = 0
+    state: str = "closed"  # closed | open | half_open
+    opened_at: float = 0.0
+    probing: bool = False
+
+    def available(self, now: float) -> bool:
+        """Whether a request may go here now. Saying yes to a half-open endpoint claims its probe,
+        which the claiming request hands back when it is done with the endpoint."""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and now - self.opened_at >= AZURE_BREAKER_COOLDOWN:
+            self._transition("half_open")
+        # Half open: one probe at a time
+        if self.state != "half_open" or self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def score(self, default_latency: float) -> float:
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (1 + AZURE_HEALTH_ERROR_PENALTY * self.error_rate)
+
+    def record_success(self, latency: Optional[float]) -> None:
+        if latency is not None:
+            self.latency = latency if self.latency is None else self.latency + AZURE_HEALTH_ALPHA * (latency - self.latency)
+        self.error_rate -= AZURE_HEALTH_ALPHA * self.error_rate
+        self.consecutive_failures = 0
+        if self.state != "closed":
+            self._transition("closed")
+        failover_attempts.inc(endpoint=self.endpoint, deployment=self.deployment, result="success")
+
+    def record_failure(self) -> None:
+        self.error_rate += AZURE_HEALTH_ALPHA * (1 - self.error_rate)
+        self.consecutive_failures += 1
+        failover_attempts.inc(endpoint=self.endpoint, deployment=self.deployment, result="failure")
+        if self.state == "half_open" or self.consecutive_failures >= AZURE_BREAKER_FAILURES:
+            self.opened_at = time.monotonic()
+            if self.state != "open":
+                self._transition("open")
+
+    def _transition(self, state: str) -> None:
+        logger.warning("Azure endpoint %s (%s) circuit %s -> %s", self.endpoint, self.deployment, self.state, state)
+        self.state = state
+        breaker_transitions.inc(endpoint=self.endpoint, deployment=self.deployment, state=state)
+
+
+# (endpoint, deployment) -> health; agents on the same deployment share what they observe
+_health: dict[tuple[str, str], EndpointHealth] = {}
+
+
+def endpoint_health(endpoint: str, deployment: str) -> EndpointHealth:
+    key = (endpoint, deployment)
+    if key not in _health:
+        _health[key] = EndpointHealth(endpoint=endpoint, deployment=deployment)
+    return _health[key]
+
+
+def should_fail_over(error: Exception) -> bool:
+    """True for errors another endpoint may not have (see the module comment)."""
+    if isinstance(error, ModelHTTPError):
+        return error.status_code >= 500 or error.status_code in _FAILOVER_STATUSES
+    return isinstance(error, (APIConnectionError, TimeoutError, ConnectionError))
+
+
+def _reason(error: Exception) -> str:
+    status = getattr(error, "status_code", None)
+    return str(status) if status is not None else type(error).__name__
+
+
+########################################################################
+# pydantic-ai model
+########################################################################
+
+@dataclass
+class PoolMember:
+    name: str
+    model: Model
+    health: EndpointHealth
+
+
+class FailoverModel(Model):
+    """A pydantic-ai Model that routes each request over a pool of equivalent endpoint models."""
+
+    def __init__(self, members: list[PoolMember]):
+        if not members:
+            raise ValueError("FailoverModel needs at least one endpoint")
+        self.members = members
+
+    def candidates(self, now: Optional[float] = None) -> list[tuple[PoolMember, bool]]:
+        """Members in the order they should be tried, each with whether this request holds its
+        half-open probe. The caller must hand the probes back (_release_probes)."""
+        now = time.monotonic() if now is None else now
+        available = [member for member in self.members if member.health.available(now)]
+        known = [member.health.latency for member in available if member.health.latency is not None]
+        # Endpoints without samples rank like the fastest known one, so ties keep config order
+        default_latency = min(known) if known else 0.0
+        available.sort(key=lambda member: member.health.score(default_latency))
+        tripped = sorted(
+            (member for member in self.members if member not in available),
+            key=lambda member: member.health.opened_at,
+        )
+        # Tripped members are last resorts: the request didn't claim them, so it leaves `probing` alone
+        claimed = [(member, member.health.state == "half_open") for member in available]
+        return claimed + [(member, False) for member in tripped]
+
+    @staticmethod
+    def _release_probes(attempts: list[tuple[PoolMember, bool]]) -> None:
+        for member, probe in attempts:
+            if probe:
+                member.health.probing = False
+
+    def _failed(self, member: PoolMember, error: Exception, last: bool) -> None:
+        member.health.record_failure()
+        if not last:
+            failovers.inc(deployment=member.health.deployment, reason=_reason(error))
+            logger.warning("Azure endpoint %s failed (%s), failing over: %s", member.name, _reason(error), error)
+
+    async def request(self, messages, model_settings, model_request_parameters):
+        attempts = self.candidates()
+        try:
+            for index, (member, _) in enumerate(attempts):
+                last = index == len(attempts) - 1
+                start = time.perf_counter()
+                try:
+                    response = await member.model.request(messages, model_settings, model_request_parameters)
+                except Exception as e:
+                    # Errors the endpoint answered with are the request's problem, not the endpoint's
+                    if not should_fail_over(e) or last:
+                        if should_fail_over(e):
+                            self._failed(member, e, last=True)
+                        raise
+                    self._failed(member, e, last=False)
+                    continue
+                member.health.record_success(time.perf_counter() - start)
+                return response
+        finally:
+            self._release_probes(attempts)
+
+    @asynccontextmanager
+    async def request_stream(self, messages, model_settings, model_request_parameters) -> AsyncIterator[StreamedResponse]:
+        attempts = self.candidates()
+        try:
+            for index, (member, _) in enumerate(attempts):
+                last = index == len(attempts) - 1
+                async with AsyncExitStack() as stack:
+                    try:
+                        response = await stack.enter_async_context(
+                            member.model.request_stream(messages, model_settings, model_request_parameters)
+                        )
+                    except Exception as e:
+                        if not should_fail_over(e) or last:
+                            if should_fail_over(e):
+                                self._failed(member, e, last=True)
+                            raise
+                        self._failed(member, e, last=False)
+                        continue
+                    try:
+                        yield response
+                    except Exception as e:
+                        # Too late to fail over once the stream has started, but it still counts against the endpoint
+                        if should_fail_over(e):
+                            self._failed(member, e, last=True)
+                        raise
+                    # Stream latency depends on the answer's length, so only the outcome is recorded
+                    member.health.record_success(None)
+                    return
+        finally:
+            self._release_probes(attempts)
+
+    @property
+    def model_name(self) -> str:
+        return self.members[0].model.model_name
+
+    @property
+    def system(self) -> str:
+        return self.members[0].model.system
+
+    @property
+    def base_url(self) -> Optional[str]:
+        return self.members[0].model.base_url
+
+
+########################################################################
+# Configuration
+########################################################################
+
+@dataclass
+class AzureEndpoint:
+    name: str
+    client: AsyncAzureOpenAI
+    deployments: dict[str, str] = field(default_factory=dict)
+
+
+def parse_failover_endpoints(raw: str = AZURE_FAILOVER_ENDPOINTS) -> list[dict]:
+    if not raw.strip():
+        return []
+    try:
+        entries = json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.error("AZURE_FAILOVER_ENDPOINTS is not valid JSON, failover is off: %s", e)
+        return []
+    valid = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("endpoint"):
+            logger.error("Ignoring failover endpoint without an 'endpoint': %r", entry)
+            continue
+        valid.append(entry)
+    return valid
+
+
+def build_endpoints(primary_client, http_client) -> list[AzureEndpoint]:
+    """The primary client plus one AsyncAzureOpenAI per configured failover endpoint, sharing the HTTP pool."""
+    entries = parse_failover_endpoints()
+    endpoints = [AzureEndpoint(name=os.getenv("AZURE_ENDPOINT_NAME", "primary"), client=primary_client)]
+    for index, entry in enumerate(entries):
+        api_key = os.getenv(entry["api_key_env"]) if entry.get("api_key_env") else entry.get("api_key")
+        client = AsyncAzureOpenAI(
+            azure_endpoint=entry["endpoint"],
+            api_version=entry.get("api_version") or os.getenv("AZURE_RESOURCE_API_VERSION"),
+            api_key=api_key or os.getenv("AZURE_RESOURCE_API_KEY"),
+            http_client=http_client,
+            max_retries=AZURE_FAILOVER_SDK_RETRIES,
+        )
+        endpoints.append(AzureEndpoint(
+            name=entry.get("name") or f"failover{index + 1}",
+            client=client,
+            deployments=dict(entry.get("deployments") or {}),
+        ))
+    if len(endpoints) > 1:
+        # The pool retries on the next endpoint instead of waiting through the SDK's backoff
+        endpoints[0].client = primary_client.with_options(max_retries=AZURE_FAILOVER_SDK_RETRIES)
+        logger.info("Azure failover across %d endpoints: %s", len(endpoints), ", ".join(e.name for e in endpoints))
+    return endpoints
+
+
+def build_model(endpoints: list[AzureEndpoint], deployment_env: str, deployment: Optional[str] = None):
+    """OpenAIModel for a deployment, or a FailoverModel over every endpoint when there are several."""
+    deployment = deployment or os.getenv(deployment_env)
+    members = []
+    for endpoint in endpoints:
+        name = endpoint.deployments.get(deployment_env, deployment)
+        model = OpenAIModel(model_name=name, openai_client=endpoint.client)
+        members.append(PoolMember(name=endpoint.name, model=model, health=endpoint_health(endpoint.name, name)))
+    if len(members) == 1:
+        return members[0].model
+    return FailoverModel(members)
+
+
+def _health_samples(attribute: str):
+    def samples():
+        for health in list(_health.values()):
+            value = getattr(health, attribute)
+            if value is not None:
+                yield {"endpoint": health.endpoint, "deployment": health.deployment}, value
+    return samples
+
+
+registry.gauge(
+    "azure_endpoint_latency_seconds", "Latency EWMA of successful requests", ["endpoint", "deployment"],
+).set_function(_health_samples("latency"))
+registry.gauge(
+    "azure_endpoint_error_rate", "Error-rate EWMA per endpoint", ["endpoint", "deployment"],
+).set_function(_health_samples("error_rate"))
+registry.gauge(
+    "azure_endpoint_circuit_open", "1 while an endpoint's circuit breaker is open or half open", ["endpoint", "deployment"],
+).set_function(lambda: [
+    ({"endpoint": h.endpoint, "deployment": h.deployment}, 0 if h.state == "closed" else 1) for h in list(_health.values())
+])
@@ -0,0 +1,231 @@
+# framework_selector.py
+# Picks the parts of the promptconfig framework texts that matter for the current turn,
+# so the Meta Agent doesn't carry the full topic literature and every theme definition
+# on every call. Selection is driven by the interview phase (from latest_phase_prompt)
+# and the themes already covered in this session's info_messages.
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from .promptconfig import (
+    general_topic_info_full,
+    general_topic_info_summary,
+    general_framework_info_company,
+    framework_themes_company,
+)
+
+FRAMEWORK_SELECTION_ENABLED = os.getenv("FRAMEWORK_SELECTION_ENABLED", "1") == "1"
+
+# Canonical company themes (same order as framework_themes_company) with the keywords used
+# to match theme labels from info_messages and the headings of general_topic_info_full.
+THEMES: dict[str, tuple[str, ...]] = {
+    "Data initiatives & value": ("initiative", "value", "use case", "use-case", "kpi", "roi"),
+    "Governance & organization": ("governance", "organization", "organisation", "ownership", "steward"),
+    "Architecture & technology": ("architecture", "technology", "platform", "infrastructure", "backbone"),
+    "Data-driven employees & culture": ("culture", "employee", "people", "literacy", "skills"),
+    "(Data) Ecosystems": ("ecosystem", "partner", "supplier", "sharing"),
+    "Compliance & ethics": ("compliance", "ethic", "privacy", "gdpr", "legal"),
+}
+
+_PHASE_PATTERNS = {
+    "introduction": re.compile(r"\bintroduction\b", re.I),
+    "theme identification": re.compile(r"\btheme[\s-]+identification\b", re.I),
+    "deep dive": re.compile(r"\bdeep[\s-]*dive\b", re.I),
+    "summary": re.compile(r"\bsummary\b", re.I),
+    "recommendation": re.compile(r"\brecommendations?\b", re.I),
+}
+_CURRENT_PHASE = re.compile(
+    r"(?:current|active|now in|we are in)\s+(?:the\s+)?(?:phase|stage)?\W{0,3}\s*(?:is\s+)?(?:the\s+)?"
+    r"(introduction|theme[\s-]+identification|deep[\s-]*dive|summary|recommendations?)",
+    re.I,
+)
+_THEME_HEADER = re.compile(r"^\*\*\s*(\d+)\.\s*(.+?)\s*\*\*\s*$", re.M)
+# Lone source attributions in the topic literature ("valiotti.com", ".") carry no content
+_SOURCE_LINE = re.compile(r"^\s*(?:[\w.-]+\.(?:com|nl|org|io|net)|\.)\s*$", re.M)
+
+
+@dataclass
+class FrameworkSelection:
+    phase: Optional[str]
+    themes: list[str] = field(default_factory=list)
+    topic_info: str = general_topic_info_full
+    framework_info_company: str = general_framework_info_company
+    framework_themes_company: str = framework_themes_company
+    full: bool = True
+
+    @property
+    def chars(self) -> int:
+        return len(self.topic_info) + len(self.framework_info_company) + len(self.framework_themes_company)
+
+
+########################################################################
+# Parsing promptconfig into sections (once per process)
+########################################################################
+
+def match_theme(label: str) -> Optional[str]:
+    """Map a free-form theme label (from info_messages or a heading) onto a canonical theme."""
+    text = (label or "").lower()
+    for theme in THEMES:
+        if theme.lower() in text:
+            return theme
+    best, best_hits = None, 0
+    for theme, keywords in THEMES.items():
+        hits = sum(1 for keyword in keywords if keyword in text)
+        if hits > best_hits:
+            best, best_hits = theme, hits
+    return best
+
+
+def _themes_in(text: str) -> set[str]:
+    text = text.lower()
+    return {theme for theme, keywords in THEMES.items() if any(keyword in text for keyword in keywords)}
+
+
+@lru_cache(maxsize=1)
+def theme_definitions() -> dict[str, str]:
+    """framework_themes_company split into one definition per canonical theme."""
+    headers = list(_THEME_HEADER.finditer(framework_themes_company))
+    definitions = {}
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(framework_themes_company)
+        theme = match_theme(header.group(2))
+        if theme:
+            definitions[theme] = framework_themes_company[header.start():end].strip()
+    return definitions
+
+
+@lru_cache(maxsize=1)
+def topic_sections() -> list[tuple[set[str], str]]:
+    """
+    general_topic_info_full split at its headings (short title-cased lines that follow a
+    blank line). Each section is tagged with the themes its heading mentions;
+    the introduction and conclusion have no themes.
+    """
+    text = _SOURCE_LINE.sub("", general_topic_info_full)
+    lines = text.splitlines()
+    sections: list[tuple[str, list[str]]] = []
+    heading, body = "", []
+    previous_blank = True
+    for line in lines:
+        stripped = line.strip()
+        is_heading = previous_blank and _looks_like_heading(stripped)
+        if is_heading and body:
+            sections.append((heading, body))
+            heading, body = stripped, [line]
+        else:
+            if is_heading and not heading:
+                heading = stripped
+            body.append(line)
+        previous_blank = not stripped
+    if body:
+        sections.append((heading, body))
+
+    # Only the part before a colon names the section ("People and Culture: Empowering a
+    # Data-Driven Organization" is about culture, not governance).
+    return [
+        (_themes_in(heading.split(":", 1)[0]), re.sub(r"\n{3,}", "\n\n", "\n".join(body)).strip())
+        for heading, body in sections
+        if "".join(body).strip()
+    ]
+
+
+def _looks_like_heading(line: str) -> bool:
+    """Short, title-cased line without closing punctuation."""
+    if not 0 < len(line) < 90 or line.endswith((".", ",", ";")):
+        return False
+    words = [word for word in line.split() if len(word) > 3]
+    if not words:
+        return False
+    capitalised = sum(1 for word in words if word[0].isupper())
+    return capitalised / len(words) >= 0.6
+
+
+########################################################################
+# Selection
+########################################################################
+
+def detect_phase(phase_indicator: str) -> Optional[str]:
+    """
+    Return the interview phase named in the phase indicator, or None when it can't be told
+    apart (no phase mentioned, or a tracker listing several phases without a current one).
+    """
+    if not phase_indicator:
+        return None
+    current = _CURRENT_PHASE.search(phase_indicator)
+    if current:
+        return _normalise_phase(current.group(1))
+    found = [phase for phase, pattern in _PHASE_PATTERNS.items() if pattern.search(phase_indicator)]
+    return found[0] if len(found) == 1 else None
+
+
+def _normalise_phase(name: str) -> Optional[str]:
+    for phase, pattern in _PHASE_PATTERNS.items():
+        if pattern.search(name):
+            return phase
+    return None
+
+
+def covered_themes(info_rows: Iterable[dict]) -> list[str]:
+    """Canonical themes mentioned in the content_dict["themes"] of info_messages rows, most frequent first."""
+    counts: dict[str, int] = {}
+    for row in info_rows:
+        content = row.get("content_dict") if isinstance(row, dict) else getattr(row, "content_dict", None)
+        for label in (content or {}).get("themes") or []:
+            theme = match_theme(str(label))
+            if theme:
+                counts[theme] = counts.get(theme, 0) + 1
+    return sorted(counts, key=counts.get, reverse=True)
+
+
+def _theme_index() -> str:
+    return "\n".join(f"- {theme}" for theme in THEMES)
+
+
+def _definitions_for(themes: list[str]) -> str:
+    definitions = theme_definitions()
+    return "\n\n".join(definitions[theme] for theme in themes if theme in definitions)
+
+
+def _topic_for(themes: list[str]) -> str:
+    wanted = set(themes)
+    return "\n\n".join(body for section_themes, body in topic_sections() if section_themes & wanted)
+
+
+def select_framework_context(phase_indicator: str, themes: Optional[list[str]] = None) -> FrameworkSelection:
+    """
+    Choose which framework texts the Meta Agent gets for this turn.
+
+      introduction          topic summary + framework overview + theme names
+      theme identification  topic summary + framework overview + every theme definition
+      deep dive / summary / recommendation
+                            framework overview + definitions and topic sections of the
+                            covered themes (all definitions while none are covered yet)
+
+    Anything else, or FRAMEWORK_SELECTION_ENABLED=0, keeps the full texts.
+    """
+    themes = [theme for theme in (themes or []) if theme in THEMES]
+    phase = detect_phase(phase_indicator)
+    if not FRAMEWORK_SELECTION_ENABLED or phase is None:
+        return FrameworkSelection(phase=phase, themes=themes)
+
+    if phase == "introduction":
+        return FrameworkSelection(
+            phase=phase, themes=themes, full=False,
+            topic_info=general_topic_info_summary,
+            framework_themes_company=_theme_index(),
+        )
+
+    if phase == "theme identification" or not themes:
+        return FrameworkSelection(
+            phase=phase, themes=themes, full=False,
+            topic_info=general_topic_info_summary,
+            framework_themes_company=framework_themes_company,
+        )
+
+    return FrameworkSelection(
+        phase=phase, themes=themes, full=False,
+        topic_info=_topic_for(themes) or general_topic_info_summary,
+        framework_themes_company=_definitions_for(themes),
+    )
@@ -0,0 +1,130 @@
+# history.py
+# Shared views over the session's message logs, built once per request and extended
+# incrementally instead of every agent re-sorting and re-converting the history itself.
+import logging
+import os
+from collections import OrderedDict
+from typing import Optional
+
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    UserPromptPart,
+    TextPart,
+)
+from .classes import ChatMessage, MessageLog
+
+logger = logging.getLogger(__name__)
+
+# Keep views alive across requests of the same session (0 disables the per-session cache).
+HISTORY_VIEW_SESSION_CACHE = int(os.getenv("HISTORY_VIEW_SESSION_CACHE", "0"))
+
+
+def to_model_message(chat: ChatMessage) -> Optional[ModelMessage]:
+    """Convert a stored user/writer ChatMessage into the pydantic-ai message the agents expect."""
+    role = chat.role.lower()
+    if role == "user":
+        return ModelRequest(parts=[UserPromptPart(content=chat.content, timestamp=chat.created_at)])
+    if role == "writer":
+        return ModelResponse(parts=[TextPart(content=chat.content)])
+    logger.error("Unknown chat role: %s", chat.role)
+    return None
+
+
+class ConversationHistoryView:
+    """
+    pydantic-ai view of deps.conversation_history.
+
+    Messages are converted once and cached; later calls only convert what was appended to
+    the log since the previous call. Every agent in the run shares the same view.
+    """
+    __slots__ = ("_log", "_message_ids", "_model_messages")
+
+    def __init__(self, log: MessageLog[ChatMessage]):
+        self._log = log
+        self._message_ids: list[str] = []
+        self._model_messages: list[ModelMessage] = []
+
+    def model_messages(self) -> list[ModelMessage]:
+        """Return the conversation as ModelRequest/ModelResponse objects, oldest first."""
+        if len(self._message_ids) < len(self._log):
+            for chat in self._log.since(len(self._message_ids)):
+                self._message_ids.append(chat.message_id)
+                model_message = to_model_message(chat)
+                if model_message is not None:
+                    self._model_messages.append(model_message)
+        # Copy so callers can extend their own message_history without touching the cache.
+        return list(self._model_messages)
+
+    def rebind(self, log: MessageLog[ChatMessage]) -> bool:
+        """
+        Point the view at a freshly fetched log of the same session. Returns False when the
+        new log doesn't start with the messages already converted (e.g. the history window
+        moved), in which case the caller should build a new view.
+        """
+        if len(log) < len(self._message_ids):
+            return False
+        for cached_id, message_id in zip(self._message_ids, log.keys()):
+            if cached_id != message_id:
+                return False
+        self._log = log
+        return True
+
+
+class TranscriptView:
+    """Plain-text "<role>: <content>" rendering of a MessageLog, extended as messages are appended."""
+    __slots__ = ("_log", "_lines")
+
+    def __init__(self, log: MessageLog[ChatMessage]):
+        self._log = log
+        self._lines: list[str] = []
+
+    def is_view_of(self, log: MessageLog[ChatMessage]) -> bool:
+        return self._log is log
+
+    def render(self, separator: str = "\n") -> str:
+        if len(self._lines) < len(self._log):
+            self._lines.extend(f"{msg.role}: {msg.content}" for msg in self._log.since(len(self._lines)))
+        return separator.join(self._lines)
+
+
+# session_id -> view, least recently used first
+_session_views: "OrderedDict[str, ConversationHistoryView]" = OrderedDict()
+
+
+def history_view_for(session_id: str, log: MessageLog[ChatMessage]) -> ConversationHistoryView:
+    """
+    Return the history view for a request. With HISTORY_VIEW_SESSION_CACHE > 0 the view of
+    the previous turn in the same session is reused, so only the new messages get converted.
+    """
+    if HISTORY_VIEW_SESSION_CACHE <= 0 or not session_id:
+        return ConversationHistoryView(log)
+
+    view = _session_views.get(session_id)
+    if view is not None and view.rebind(log):
+        _session_views.move_to_end(session_id)
+        return view
+
+    view = ConversationHistoryView(log)
+    _session_views[session_id] = view
+    _session_views.move_to_end(session_id)
+    while len(_session_views) > HISTORY_VIEW_SESSION_CACHE:
+        _session_views.popitem(last=False)
+    return view
+
+
+def get_history_view(deps) -> ConversationHistoryView:
+    """Return the run's shared conversation view, creating it on first use."""
+    if deps.history_view is None:
+        deps.history_view = history_view_for(deps.session_id, deps.conversation_history)
+    return deps.history_view
+
+
+def get_internal_transcript(graph_ctx) -> str:
+    """Render graph_ctx.state.internalconversation, reusing the lines rendered by earlier nodes."""
+    deps = graph_ctx.deps
+    log = graph_ctx.state.internalconversation
+    if deps.internal_transcript is None or not deps.internal_transcript.is_view_of(log):
+        deps.internal_transcript = TranscriptView(log)
+    return deps.internal_transcript.render()
@@ -0,0 +1,180 @@
+# http_pools.py
+# Explicitly sized httpx connection pools for the Azure OpenAI and Supabase clients,
+# connection pre-warming at startup and pool utilisation gauges for /metrics.
+#
+# One Azure pool is shared by the AsyncAzureOpenAI client and therefore by all four
+# OpenAIModels; Supabase's PostgREST client gets its own pool. With HTTP/2 a single
+# connection multiplexes concurrent requests, so warming one connection per backend
+# already removes the TLS + ALPN handshake from the first user request.
+import asyncio
+import logging
+import os
+from typing import Iterable, Optional
+
+import httpx
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1"
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+AZURE_HTTP_TIMEOUT = float(os.getenv("AZURE_HTTP_TIMEOUT", "600"))
+SUPABASE_HTTP_TIMEOUT = float(os.getenv("SUPABASE_HTTP_TIMEOUT", "120"))
+HTTP_WARMUP_ENABLED = os.getenv("HTTP_WARMUP_ENABLED", "1") == "1"
+HTTP_WARMUP_TIMEOUT = float(os.getenv("HTTP_WARMUP_TIMEOUT", "5"))
+
+# pool name -> httpx client, read by the gauges at scrape time
+_pools: dict[str, httpx.AsyncClient] = {}
+
+
+def pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def build_azure_http_client() -> httpx.AsyncClient:
+    """httpx client for AsyncAzureOpenAI(http_client=...), keeping the openai SDK's defaults otherwise."""
+    from openai import DefaultAsyncHttpxClient
+
+    client = DefaultAsyncHttpxClient(
+        limits=pool_limits(),
+        http2=HTTP2_ENABLED,
+        timeout=httpx.Timeout(AZURE_HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+    register_pool("azure", client)
+    return client
+
+
+async def tune_postgrest_session(supabase_client) -> httpx.AsyncClient:
+    """
+    Replace the PostgREST session the Supabase client created with default limits by one using
+    the configured pool, and close the replaced one. Base URL, auth headers and redirects are
+    carried over unchanged.
+    """
+    postgrest = supabase_client.postgrest
+    default_session: httpx.AsyncClient = postgrest.session
+    postgrest.session = httpx.AsyncClient(
+        base_url=default_session.base_url,
+        headers=default_session.headers,
+        timeout=httpx.Timeout(SUPABASE_HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        follow_redirects=True,
+        http2=HTTP2_ENABLED,
+        limits=pool_limits(),
+    )
+    register_pool("supabase", postgrest.session)
+    try:
+        await default_session.aclose()
+    except Exception as e:
+        logger.warning("Error closing the default PostgREST session: %s", e)
+    return postgrest.session
+
+
+def register_pool(name: str, client: httpx.AsyncClient) -> None:
+    _pools[name] = client
+
+
+########################################################################
+# Pre-warming
+########################################################################
+
+async def _warm(name: str, client: httpx.AsyncClient, url: str) -> bool:
+    # Any HTTP response (404/401 included) means TCP, TLS and HTTP/2 are set up and the
+    # connection is back in the pool; only transport errors count as a failed warm-up.
+    try:
+        response = await client.head(url, timeout=HTTP_WARMUP_TIMEOUT)
+        logger.info("Warmed %s connection (%s %s)", name, response.http_version, response.status_code)
+        return True
+    except httpx.HTTPError as e:
+        logger.warning("Could not warm %s connection to %s: %s", name, url, e)
+        return False
+
+
+async def warm_connections(clients) -> dict[str, bool]:
+    """Open a connection to Azure OpenAI and Supabase before the first user request needs one."""
+    if not HTTP_WARMUP_ENABLED:
+        return {}
+    targets = []
+    azure_http = _pools.get("azure")
+    if azure_http is not None and os.getenv("AZURE_ENDPOINT"):
+        targets.append(("azure", azure_http, os.getenv("AZURE_ENDPOINT")))
+    supabase_http = _pools.get("supabase")
+    if supabase_http is not None:
+        targets.append(("supabase", supabase_http, str(supabase_http.base_url)))
+    results = await asyncio.gather(*(_warm(name, client, url) for name, client, url in targets))
+    return {name: ok for (name, _, _), ok in zip(targets, results)}
+
+
+async def close_pools() -> None:
+    for name, client in list(_pools.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning("Error closing %s pool: %s", name, e)
+    _pools.clear()
+
+
+########################################################################
+# Utilisation metrics
+########################################################################
+
+def _connection_pool(client: httpx.AsyncClient):
+    # httpx doesn't expose pool state; walk transport wrappers (e.g. tracing) to httpcore's pool.
+    transport = getattr(client, "_transport", None)
+    for _ in range(5):
+        if transport is None:
+            return None
+        pool = getattr(transport, "_pool", None)
+        if pool is not None:
+            return pool
+        transport = getattr(transport, "_transport", None) or getattr(transport, "transport", None)
+    return None
+
+
+def pool_stats(client: httpx.AsyncClient) -> Optional[dict[str, int]]:
+    pool = _connection_pool(client)
+    if pool is None:
+        return None
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    queued = sum(1 for request in getattr(pool, "_requests", []) if request.is_queued())
+    return {
+        "active": len(connections) - idle,
+        "idle": idle,
+        "queued": queued,
+        "max": getattr(pool, "_max_connections", None) or 0,
+    }
+
+
+def _connection_samples() -> Iterable[tuple[dict, float]]:
+    for name, client in list(_pools.items()):
+        stats = pool_stats(client)
+        if stats:
+            yield {"pool": name, "state": "active"}, stats["active"]
+            yield {"pool": name, "state": "idle"}, stats["idle"]
+
+
+def _stat_samples(key: str):
+    def samples() -> Iterable[tuple[dict, float]]:
+        for name, client in list(_pools.items()):
+            stats = pool_stats(client)
+            if stats:
+                yield {"pool": name}, stats[key]
+    return samples
+
+
+registry.gauge(
+    "http_pool_connections", "Open connections per HTTP pool", ["pool", "state"],
+).set_function(_connection_samples)
+registry.gauge(
+    "http_pool_queued_requests", "Requests waiting for a pooled connection", ["pool"],
+).set_function(_stat_samples("queued"))
+registry.gauge(
+    "http_pool_max_connections", "Configured connection limit per HTTP pool", ["pool"],
+).set_function(_stat_samples("max"))
@@ -0,0 +1,91 @@
+# info_messages.py
+# Read helpers for the info_messages table (facts extracted by the Update Agent).
+# info_messages rows only reference the triggering chat message, so user/session/company
+# filters go through the chat_messages foreign key.
+import logging
+from supabase._async.client import AsyncClient as AsyncSupabase
+
+logger = logging.getLogger(__name__)
+
+INFO_COLUMNS = "info_id, message_id, category, content_dict, content_str, created_at"
+
+
+async def fetch_company_user_ids(supabase_client: AsyncSupabase, company_id: str) -> list[str]:
+    response = await supabase_client.table("users") \
+        .select("user_id") \
+        .eq("company_id", company_id) \
+        .execute()
+    return [row["user_id"] for row in (response.data or []) if row.get("user_id")]
+
+
+async def fetch_info_messages_for_users(supabase_client: AsyncSupabase, user_ids: list[str], limit: int = 2000) -> list[dict]:
+    """Return the most recent info_messages of the given users, newest first."""
+    if not user_ids:
+        return []
+    response = await supabase_client.table("info_messages") \
+        .select(f"{INFO_COLUMNS}, chat_messages!inner(user_id, session_id)") \
+        .in_("chat_messages.user_id", user_ids) \
+        .order("created_at", desc=True) \
+        .limit(limit) \
+        .execute()
+    return response.data or []
+
+
+async def fetch_company_info_messages(supabase_client: AsyncSupabase, company_id: str, limit: int = 2000) -> list[dict]:
+    """Return the most recent info_messages of every user in a company, newest first."""
+    try:
+        user_ids = await fetch_company_user_ids(supabase_client, company_id)
+        return await fetch_info_messages_for_users(supabase_client, user_ids, limit=limit)
+    except Exception as e:
+        logger.error("Error fetching info_messages for company_id=%s: %s", company_id, e)
+        return []
+
+
+async def fetch_session_info_messages(supabase_client: AsyncSupabase, session_id: str, limit: int = 500) -> list[dict]:
+    """Return the info_messages extracted so far in a chat session, newest first."""
+    try:
+        response = await supabase_client.table("info_messages") \
+            .select(f"{INFO_COLUMNS}, chat_messages!inner(session_id)") \
+            .eq("chat_messages.session_id", session_id) \
+            .order("created_at", desc=True) \
+            .limit(limit) \
+            .execute()
+        return response.data or []
+    except Exception as e:
+        logger.error("Error fetching info_messages for session_id=%s: %s", session_id, e)
+        return []
+
+
+FACT_COLUMNS = "category, content_dict, created_at, chat_messages!inner(user_id)"
+
+
+async def iter_info_message_facts(
+    supabase_client: AsyncSupabase,
+    user_ids: list[str],
+    page_size: int = 1000,
+    users_per_query: int = 200,
+):
+    """
+    Yield pages (lists of rows) with only the columns the AIR scoring needs, for every
+    info_message of the given users. Users are queried in groups so the `in` filter stays
+    a reasonable URL length for companies with thousands of users. info_id breaks ties
+    between rows with the same created_at (a turn's facts share it), so no row is skipped
+    or repeated across page boundaries.
+    """
+    for start in range(0, len(user_ids), users_per_query):
+        group = user_ids[start:start + users_per_query]
+        offset = 0
+        while True:
+            response = await supabase_client.table("info_messages") \
+                .select(FACT_COLUMNS) \
+                .in_("chat_messages.user_id", group) \
+                .order("created_at") \
+                .order("info_id") \
+                .range(offset, offset + page_size - 1) \
+                .execute()
+            rows = response.data or []
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                break
+            offset += page_size
@@ -0,0 +1,127 @@
+# logging_config.py
+# Central logging setup, called once by main.py (and the export CLI). Every log call only puts
+# the record on a bounded queue (QueueHandler); a QueueListener thread formats and writes it,
+# so the event loop never waits on stderr or the JSON encoding.
+#
+#   LOG_LEVEL       root level (default INFO)
+#   LOG_LEVELS      per-logger levels, "app.Update_Agent=DEBUG,httpx=WARNING"
+#   LOG_FORMAT      json (default; one orjson object per line) or text
+#   LOG_QUEUE_SIZE  records waiting for the writer thread; when it is full new records are
+#                   dropped and counted in logs_dropped_total instead of blocking the caller
+#
+# Log with %-style arguments (logger.info("... %s", value)): a record below its logger's level
+# is then discarded before the message is ever formatted.
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from typing import Optional, TextIO
+
+import orjson
+
+from .metrics import registry
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# uvicorn installs its own stream handlers; its records go through the queue as well
+ROUTED_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+logs_dropped = registry.counter("logs_dropped_total", "Log records dropped because the log queue was full")
+log_queue_depth = registry.gauge("log_queue_depth", "Log records waiting for the writer thread")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue: Optional[queue.Queue] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, extras and the traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments now (they may change after the call returns); the formatting,
+        # the traceback text and the write happen on the listener thread.
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            logs_dropped.inc()
+
+
+def parse_levels(spec: str) -> dict[str, str]:
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, sep, level = item.partition("=")
+        if sep:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(stream: Optional[TextIO] = None, fmt: str = LOG_FORMAT, level: str = LOG_LEVEL, levels: str = LOG_LEVELS) -> None:
+    """Route all records through the queue to one writer thread; calling it again reconfigures."""
+    global _listener, _queue
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    _queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(_queue, output, respect_handler_level=False)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(NonBlockingQueueHandler(_queue))
+    root.setLevel(level)
+    for name in ROUTED_LOGGERS:
+        routed = logging.getLogger(name)
+        for handler in list(routed.handlers):
+            routed.removeHandler(handler)
+        routed.propagate = True
+    for name, logger_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Write the queued records and stop the writer thread (registered with atexit)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+log_queue_depth.set_function(lambda: [({}, _queue.qsize() if _queue is not None else 0)])
+atexit.register(stop_logging)
@@ -0,0 +1,163 @@
+# loop_monitor.py
+# Event-loop health: how late the loop runs its callbacks, and which code blocks it.
+#
+# A heartbeat callback is scheduled every LOOP_MONITOR_INTERVAL seconds; how late it runs is
+# the loop lag (event_loop_lag_seconds). A watchdog thread checks the heartbeat: once it is more
+# than LOOP_BLOCK_THRESHOLD seconds overdue, the loop is stuck in one callback, and the watchdog
+# captures the loop thread's stack right then (the blocking code is on top), logs it and counts
+# the block against the request endpoint and graph node that were running
+# (event_loop_blocks_total / event_loop_block_seconds). Blocks shorter than the threshold plus
+# one interval can slip between heartbeats; they still show up as lag.
+#
+# Attribution: LoopMonitorMiddleware labels each request's task with its scope, run_graph labels
+# it with the node about to run, and tasks created from a labelled task (gather, create_task)
+# inherit a copy of the labels through the loop's task factory.
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from typing import Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "1") == "1"
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.1"))
+LOOP_STACK_CAPTURE = os.getenv("LOOP_STACK_CAPTURE", "1") == "1"
+LOOP_STACK_DEPTH = int(os.getenv("LOOP_STACK_DEPTH", "25"))
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+loop_lag = registry.histogram("event_loop_lag_seconds", "How late the event loop ran the monitor's heartbeat", buckets=LAG_BUCKETS)
+loop_blocks = registry.counter(
+    "event_loop_blocks_total", "Times one callback blocked the event loop past LOOP_BLOCK_THRESHOLD", ["endpoint", "node"],
+)
+loop_block_seconds = registry.histogram(
+    "event_loop_block_seconds", "How long a detected block kept the event loop from running", ["endpoint", "node"], buckets=LAG_BUCKETS,
+)
+
+# task -> labels ("scope": the ASGI scope of the request, "node": the graph node)
+_labels: "weakref.WeakKeyDictionary[asyncio.Task, dict]" = weakref.WeakKeyDictionary()
+
+
+def label_task(**labels) -> None:
+    """Attach labels to the current task (and the tasks it creates from now on)."""
+    task = asyncio.current_task()
+    if task is not None:
+        _labels[task] = {**_labels.get(task, {}), **labels}
+
+
+def attribution(task: Optional[asyncio.Task]) -> tuple[str, str]:
+    labels = _labels.get(task, {}) if task is not None else {}
+    scope = labels.get("scope")
+    endpoint = "none"
+    if scope is not None:
+        endpoint = getattr(scope.get("endpoint"), "__name__", None) or "unrouted"
+    return endpoint, labels.get("node", "none")
+
+
+class LoopMonitorMiddleware:
+    """ASGI middleware labelling each HTTP request or WebSocket task with its scope."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            task = asyncio.current_task()
+            if task is not None:
+                # routing fills scope["endpoint"] later; it is read when a block is reported
+                _labels[task] = {"scope": scope}
+        await self.app(scope, receive, send)
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = LOOP_BLOCK_THRESHOLD, capture_stacks: bool = LOOP_STACK_CAPTURE):
+        self.interval = interval
+        self.threshold = threshold
+        self.capture_stacks = capture_stacks
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._expected = 0.0
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+        self._previous_factory = None
+        # heartbeat deadline the watchdog last reported, and the (endpoint, node) of that block
+        self._reported = 0.0
+        self._block: Optional[tuple[str, str]] = None
+
+    def start(self) -> None:
+        """Call from the event loop thread."""
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._previous_factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._task_factory)
+        self._expected = time.perf_counter() + self.interval
+        self._handle = self.loop.call_later(self.interval, self._beat)
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+        if self.loop is not None and self.loop.get_task_factory() == self._task_factory:
+            self.loop.set_task_factory(self._previous_factory)
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        parent = asyncio.current_task(loop)
+        if parent is not None:
+            labels = _labels.get(parent)
+            if labels:
+                _labels[task] = dict(labels)
+        return task
+
+    def _beat(self) -> None:
+        now = time.perf_counter()
+        lag = max(0.0, now - self._expected)
+        loop_lag.observe(lag)
+        block, self._block = self._block, None
+        if block is not None:
+            endpoint, node = block
+            loop_block_seconds.observe(lag, endpoint=endpoint, node=node)
+            logger.warning("Event loop was blocked for %.3f s (endpoint=%s, node=%s)", lag, endpoint, node)
+        self._expected = now + self.interval
+        self._handle = self.loop.call_later(self.interval, self._beat)
+
+    def _watch(self) -> None:
+        poll = min(self.interval, self.threshold) / 2
+        while not self._stop.wait(poll):
+            expected = self._expected
+            overdue = time.perf_counter() - expected
+            if overdue < self.threshold or self._reported == expected:
+                continue
+            self._reported = expected
+            where = attribution(asyncio.current_task(self.loop))
+            self._block = where
+            loop_blocks.inc(endpoint=where[0], node=where[1])
+            stack = ""
+            if self.capture_stacks:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    stack = "".join(traceback.format_stack(frame)[-LOOP_STACK_DEPTH:])
+            logger.warning(
+                "Event loop blocked for more than %.3f s (endpoint=%s, node=%s), loop thread stack:\n%s",
+                overdue, where[0], where[1], stack,
+            )
+
+
+loop_monitor: Optional[LoopMonitor] = LoopMonitor() if LOOP_MONITOR_ENABLED else None
@@ -1,48 +1,109 @@
 import os
+import asyncio
+from .startup import (
+    startup_profile,
+    LazyComponent,
+    import_module_component,
+    components_ready,
+    STARTUP_BACKGROUND_WARMUP,
+)
 from fastapi import FastAPI, Request, status
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-import logfire
+from .telemetry import configure_telemetry, instrument_app, instrument_clients
+from .logging_config import configure_logging
+from .loop_monitor import LoopMonitorMiddleware, loop_monitor
 import logging
 
 
 ### to run locally:           uvicorn app.main:app --host 127.0.0.1 --port 8000 --reload
 load_dotenv()  
 
+# All records go through one queue to a writer thread (LOG_* env vars, see logging_config.py)
+configure_logging()
+
+
+async def load_clients():
+    # dependencies pulls in pydantic-ai, the openai/supabase SDKs and numpy; import it in a
+    # worker thread so a background warm-up doesn't block the event loop.
+    dependencies = await import_module_component(f"{__package__}.dependencies")()
+    clients = await dependencies.init_clients()
+    from .http_pools import warm_connections
+    with startup_profile.phase("warm connections"):
+        await warm_connections(clients)
+    return clients
+
+
+async def finish_startup(app: FastAPI) -> None:
+    """Wait for every component, expose the clients on app.state and log the startup profile."""
+    components = app.state.components
+    await asyncio.gather(*(component.get() for component in components.values()))
+    app.state.clients = await components["clients"].get()
+    startup_profile.mark_ready()
+    logging.info("Startup complete:\n%s", startup_profile.report())
+
+
+def log_startup_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Background startup failed: %s", task.exception(), exc_info=task.exception())
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Initialize and tear down application resources.
-    """
-    from .dependencies import init_clients
-    
-    # Initialize clients and attach to app state
-    app.state.clients = await init_clients()
 
-    # Debug: log available client attributes after init
-    logging.info(f"clients attrs: {dir(app.state.clients)}")
+    The heavy components load concurrently. By default startup waits for them; with
+    STARTUP_BACKGROUND_WARMUP=1 the server starts accepting requests right away, requests
+    await the components they need and /ready returns 503 until everything is loaded.
+    """
+    # Lag and blocking-callback detection for the whole life of the loop (see loop_monitor.py)
+    if loop_monitor is not None:
+        loop_monitor.start()
+
+    with startup_profile.phase("instrumentation"):
+        instrument_clients()
+
+    app.state.components = {
+        "clients": LazyComponent("clients", load_clients),
+        "orchestration": LazyComponent("orchestration", import_module_component(f"{__package__}.orchestration")),
+    }
+    for component in app.state.components.values():
+        component.start()
+
+    warmup = None
+    if STARTUP_BACKGROUND_WARMUP:
+        warmup = asyncio.create_task(finish_startup(app))
+        warmup.add_done_callback(log_startup_failure)
+    else:
+        await finish_startup(app)
 
     try:
         yield
     finally:
+        if warmup is not None and not warmup.done():
+            warmup.cancel()
         # Optional cleanup: close any async connections if supported
-        clients = app.state.clients
+        clients = getattr(app.state, "clients", None)
         try:
-            await clients.supabase_client.close()
+            await clients.aclose()
         except Exception:
             pass
+        if loop_monitor is not None:
+            loop_monitor.stop()
 
 # Initialize FastAPI app with lifespan
 app = FastAPI(title="Chat API", lifespan=lifespan)
 
 
 
-logfire.configure(token=os.getenv("LOGFIRE_TOKEN"), scrubbing=False) #### move this to environent variable en scrubbing nu helemaal uit, maak filter
-logfire.instrument_fastapi(app, capture_headers=True)   
-logfire.instrument_httpx(capture_all=True)
-logfire.instrument_pydantic_ai()
+# Capture level, attribute caps and sampling are set by the TELEMETRY_* env vars (see telemetry.py)
+configure_telemetry()
+# instrument_fastapi adds middleware, so it has to happen before the app starts;
+# httpx and pydantic-ai are instrumented in the lifespan to keep their imports off this path.
+instrument_app(app)
 
 
 # Configure CORS immediately after app creation
@@ -56,6 +117,9 @@ origins = [
 ]
 
 
+# Labels every request's task so event-loop blocks are attributed to its endpoint
+app.add_middleware(LoopMonitorMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -69,6 +133,16 @@ app.add_middleware(
 async def read_root():
     return {"Hello": "Curious person"}
 
+@app.get("/ready")
+async def read_ready():
+    """Readiness probe: 503 until every lazily loaded component has finished loading."""
+    components = components_ready(app)
+    ready = bool(components) and all(components.values())
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"ready": ready, "components": components, "startup": startup_profile.as_dict()},
+    )
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logging.error("Unhandled exception: %s", exc, exc_info=True)
@@ -78,8 +152,13 @@ async def global_exception_handler(request: Request, exc: Exception):
     )
 
 # Include other routers
-from .routes import auth_routes, chat_routes
+from .routes import air_routes, auth_routes, chat_routes, metrics_routes, profile_routes
 app.include_router(auth_routes.router, prefix="/auth")
 app.include_router(chat_routes.router, prefix="/chat")
+app.include_router(metrics_routes.router)
+app.include_router(air_routes.router, prefix="/air")
+app.include_router(profile_routes.router, prefix="/admin")
+
+startup_profile.record("import:app.main", 0.0, startup_profile.elapsed())
 
 
@@ -0,0 +1,106 @@
+# model_routing.py
+# Routes agent sub-tasks between two Azure deployments: a small, fast model for the cheap,
+# well-constrained tasks (Update Agent extraction and JSON parsing, JSON repair) and each
+# agent's own large model for everything else.
+#
+# A task only goes to the small model when it is in MODEL_ROUTING_SMALL_TASKS and its
+# prompt is at most MODEL_ROUTING_MAX_SMALL_CHARS long. When a small-model result fails the
+# caller's check (e.g. the JSON doesn't parse) the task is run again on the large model.
+# Every decision is logged and counted in model_routing_decisions_total.
+#
+# Without AZURE_MODEL_NAME_SMALL routing is off and every task runs on its agent's model.
+import logging
+import os
+from typing import Any, Callable, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+AZURE_MODEL_NAME_SMALL = os.getenv("AZURE_MODEL_NAME_SMALL")
+MODEL_ROUTING_SMALL_TASKS = frozenset(
+    task.strip()
+    for task in os.getenv("MODEL_ROUTING_SMALL_TASKS", "update_extraction,update_parse,json_repair").split(",")
+    if task.strip()
+)
+MODEL_ROUTING_MAX_SMALL_CHARS = int(os.getenv("MODEL_ROUTING_MAX_SMALL_CHARS", "12000"))
+
+routing_decisions = registry.counter(
+    "model_routing_decisions_total", "Model routing decisions per task", ["task", "tier", "reason"],
+)
+
+
+def _prompt_chars(user_prompt: str, message_history: Optional[list]) -> int:
+    chars = len(user_prompt or "")
+    for message in message_history or []:
+        for part in getattr(message, "parts", []):
+            content = getattr(part, "content", "")
+            chars += len(content) if isinstance(content, str) else 0
+    return chars
+
+
+class ModelRouter:
+    """Runs agent tasks on the small or the large model; see the module comment for the rules."""
+
+    def __init__(
+        self,
+        small_model=None,
+        small_tasks: frozenset[str] = MODEL_ROUTING_SMALL_TASKS,
+        max_small_chars: int = MODEL_ROUTING_MAX_SMALL_CHARS,
+    ):
+        self.small_model = small_model
+        self.small_tasks = small_tasks
+        self.max_small_chars = max_small_chars
+
+    def choose(self, task: str, prompt_chars: int) -> tuple[str, str]:
+        """Return (tier, reason) for a task with a prompt of the given size."""
+        if self.small_model is None:
+            return "large", "no_small_model"
+        if task not in self.small_tasks:
+            return "large", "task_default"
+        if prompt_chars > self.max_small_chars:
+            return "large", "long_prompt"
+        return "small", "task_default"
+
+    async def run(
+        self,
+        agent,
+        task: str,
+        *,
+        user_prompt: str,
+        message_history: Optional[list] = None,
+        deps: Any = None,
+        accept: Optional[Callable[[Any], bool]] = None,
+    ):
+        """
+        agent.run() on the chosen model. `accept(result)` decides whether a small-model result
+        is good enough; if it returns False (or raises) the task is escalated to the large model.
+        """
+        prompt_chars = _prompt_chars(user_prompt, message_history)
+        tier, reason = self.choose(task, prompt_chars)
+        logger.info("Model routing: task=%s tier=%s reason=%s prompt_chars=%d", task, tier, reason, prompt_chars)
+        routing_decisions.inc(task=task, tier=tier, reason=reason)
+
+        if tier == "small":
+            try:
+                result = await agent.run(
+                    user_prompt=user_prompt, message_history=message_history, deps=deps, model=self.small_model,
+                )
+                if accept is None or accept(result):
+                    return result
+                escalation = "rejected_output"
+            except Exception as e:
+                logger.warning("Small model failed on task=%s, escalating: %s", task, e)
+                escalation = "small_model_error"
+            logger.info("Model routing: task=%s tier=large reason=%s", task, escalation)
+            routing_decisions.inc(task=task, tier="large", reason=escalation)
+
+        return await agent.run(user_prompt=user_prompt, message_history=message_history, deps=deps)
+
+
+# Used when the deps carry no router (routing off): every task runs on the agent's own model.
+default_router = ModelRouter()
+
+
+def get_router(deps) -> ModelRouter:
+    return getattr(deps, "model_router", None) or default_router
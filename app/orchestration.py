@@ -9,14 +9,23 @@ import uuid
 from supabase._async.client import AsyncClient as AsyncSupabase
 
 # Import pydantic-graph components
-from pydantic_graph import BaseNode, End, Graph, GraphRunContext
+from pydantic_graph import BaseNode, End, Graph, GraphRunContext, GraphRunResult
 
 #### Import agent workflow functions
 from .Meta_Agent.internal_logic_MA import MetaAgent_workflow  
 from .Reviewer_Agent.internal_logic_RA import ReviewerAgent_workflow
 from .Update_Agent.internal_logic_UA import UpdateAgent_workflow
 from .Writer_Agent.internal_logic_WA import WriterAgent_workflow
-from .classes import MultiAgentDeps, MultiAgentState, ChatMessage
+from .classes import MultiAgentDeps, MultiAgentState, ChatMessage, MessageLog
+from .history import ConversationHistoryView, history_view_for
+from .info_messages import fetch_session_info_messages
+from .framework_selector import covered_themes
+from .air_scoring import AIR_SCORE_PROMPT_SUMMARY
+from .checkpoints import GraphCheckpoint
+from .accounting import UsageScope, usage_scope
+from .prescreen import PreScreenBlocked, is_content_filter_error, prescreener
+from .tts import SpeechStream
+from .loop_monitor import label_task
 
 
 ########################################################################
@@ -41,6 +50,7 @@ async def fetch_user_profile(supabase_client: AsyncSupabase, user_id: str) -> di
             # No user found – return defaults
             return {
                 "user_description": "Unknown",
+                "company_id": None,
                 "company_description": "none",
                 "distilled_company_AIR_info": "none",
                 "distilled_user_AIR_info": "none",
@@ -64,6 +74,7 @@ async def fetch_user_profile(supabase_client: AsyncSupabase, user_id: str) -> di
         # 3) Build and return the merged profile
         return {
             "user_description": user.get("user_description", "Unknown"),
+            "company_id": company_id,
             "company_description": company_description,
             "distilled_company_AIR_info": user.get("distilled_company_AIR_info", "none"),
             "distilled_user_AIR_info": user.get("distilled_user_AIR_info", "none"),
@@ -74,13 +85,14 @@ async def fetch_user_profile(supabase_client: AsyncSupabase, user_id: str) -> di
         logging.error("Error fetching user profile: %s", e)
         return {
             "user_description": "Unknown",
+            "company_id": None,
             "company_description": "none",
             "distilled_company_AIR_info": "none",
             "distilled_user_AIR_info": "none",
             "TTS_flag": 0
         }
 
-async def fetch_conversation_history(supabase_client: AsyncSupabase, session_id: str, limit: int = 30) -> tuple[dict[str, ChatMessage], dict[str, ChatMessage]]:
+async def fetch_conversation_history(supabase_client: AsyncSupabase, session_id: str, limit: int = 30) -> tuple[MessageLog[ChatMessage], MessageLog[ChatMessage]]:
     """
     Fetch conversation history from Supabase for a given session_id.
     Only includes messages with role = 'writer' or 'User',
@@ -99,8 +111,8 @@ async def fetch_conversation_history(supabase_client: AsyncSupabase, session_id:
             .limit(limit) \
             .execute()
 
-        # 2. Dictionary to hold messages keyed by message_id
-        conversation_history: dict[str, ChatMessage] = {}
+        # 2. Append-only log holding messages keyed by message_id
+        conversation_history: MessageLog[ChatMessage] = MessageLog()
 
         # 3. Iterate through the messages (already oldest -> newest)
         for msg in (response.data or []):
@@ -129,10 +141,22 @@ async def fetch_conversation_history(supabase_client: AsyncSupabase, session_id:
                 created_at=created_at
             )
 
-            # 5. Insert into dict, keyed by the message_id
-            conversation_history[msg_id] = chat_msg
+            # 5. Append to the log, keyed by the message_id (rows arrive oldest -> newest)
+            conversation_history.append(chat_msg)
 
         # 6. Fetch the last system message for this session
+        latest_phase_prompt = await fetch_latest_phase_prompt(supabase_client, session_id)
+
+        return conversation_history, latest_phase_prompt
+
+    except Exception as e:
+        logging.error("Failed to fetch conversation history: %s", e)
+        raise
+
+
+async def fetch_latest_phase_prompt(supabase_client: AsyncSupabase, session_id: str) -> MessageLog[ChatMessage]:
+    """Fetch the last system (phase prompt) message of a session as a one-entry log (empty if none)."""
+    try:
         system_response = await supabase_client.table("chat_messages") \
             .select("*") \
             .eq("session_id", session_id) \
@@ -141,9 +165,9 @@ async def fetch_conversation_history(supabase_client: AsyncSupabase, session_id:
             .limit(1) \
             .execute()
 
-        latest_phase_prompt: dict[str, ChatMessage] = {}
+        latest_phase_prompt: MessageLog[ChatMessage] = MessageLog()
         
-        # 7. Process the system message if found
+        # Process the system message if found
         if system_response.data and len(system_response.data) > 0:
             system_msg = system_response.data[0]
             created_at_str = system_msg.get("created_at")
@@ -169,32 +193,35 @@ async def fetch_conversation_history(supabase_client: AsyncSupabase, session_id:
                 created_at=created_at
             )
 
-            latest_phase_prompt[msg_id] = system_chat_msg
+            latest_phase_prompt.append(system_chat_msg)
 
-        return conversation_history, latest_phase_prompt
+        return latest_phase_prompt
 
     except Exception as e:
-        logging.error(f"Failed to fetch conversation history: {e}")
+        logging.error("Failed to fetch phase prompt: %s", e)
         raise
 
 
-async def fetch_message_by_id(supabase_client, message_id: str) -> ChatMessage | None:
+async def fetch_message_by_id(supabase_client, message_id: str, session_id: str | None = None) -> ChatMessage | None:
     """
     Fetch a single chat message from Supabase using its message_id.
     
     Args:
         supabase_client: The Supabase client instance.
         message_id (str): The unique identifier of the message.
+        session_id (str, optional): Only return the message if it belongs to this session.
     
     Returns:
         A ChatMessage object if a matching record is found; otherwise, None.
     """
     try:
         # Query the 'chat_messages' table for a record with the given message_id.
-        response = await supabase_client.table("chat_messages") \
+        query = supabase_client.table("chat_messages") \
             .select("*") \
-            .eq("message_id", message_id) \
-            .execute()
+            .eq("message_id", message_id)
+        if session_id is not None:
+            query = query.eq("session_id", session_id)
+        response = await query.execute()
 
         # Ensure that the response contains data.
         if response.data and len(response.data) > 0:
@@ -226,8 +253,7 @@ async def fetch_message_by_id(supabase_client, message_id: str) -> ChatMessage |
             return None
 
     except Exception as e:
-        # Optionally, log the error.
-        print(f"Error fetching message by id {message_id}: {e}")
+        logging.error("Error fetching message by id %s: %s", message_id, e)
         raise
 
 
@@ -238,21 +264,62 @@ async def fetch_message_by_id(supabase_client, message_id: str) -> ChatMessage |
 
 async def create_context(clients, user_id: str, payload) -> GraphRunContext[MultiAgentState, MultiAgentDeps]:
     
-    # Fetch additional data for the context.
-    user_profile = await fetch_user_profile(clients.supabase_client, user_id)
-    conversation_history, latest_phase_prompt = await fetch_conversation_history(clients.supabase_client, payload.session_id)
-    latest_user_message = await fetch_message_by_id(clients.supabase_client, payload.message_id)
+    # Fetch additional data for the context; the queries are independent, so they run concurrently.
+    user_profile, (conversation_history, latest_phase_prompt), latest_user_message, session_info_messages = await asyncio.gather(
+        fetch_user_profile(clients.supabase_client, user_id),
+        fetch_conversation_history(clients.supabase_client, payload.session_id),
+        fetch_message_by_id(clients.supabase_client, payload.message_id),
+        fetch_session_info_messages(clients.supabase_client, payload.session_id),
+    )
+
+    return await build_context(
+        clients, user_id, payload.session_id,
+        user_profile=user_profile,
+        conversation_history=conversation_history,
+        latest_phase_prompt=latest_phase_prompt,
+        latest_user_message=latest_user_message,
+        info_rows=session_info_messages,
+        history_view=history_view_for(payload.session_id, conversation_history),
+    )
+
+
+async def build_context(
+    clients,
+    user_id: str,
+    session_id: str,
+    *,
+    user_profile: dict,
+    conversation_history: MessageLog[ChatMessage],
+    latest_phase_prompt: MessageLog[ChatMessage],
+    latest_user_message: ChatMessage,
+    info_rows: list,
+    history_view: ConversationHistoryView,
+) -> GraphRunContext[MultiAgentState, MultiAgentDeps]:
+    """Assemble the state and deps of one run from already fetched session data."""
+
+    # Optionally give the agents the numeric AIR scores instead of the appended distilled text
+    air_scores = getattr(clients, "air_scores", None)
+    if AIR_SCORE_PROMPT_SUMMARY and air_scores is not None:
+        user_profile = dict(user_profile)
+        summaries = await air_scores.prompt_summaries(user_id)
+        if summaries["user"]:
+            user_profile["distilled_user_AIR_info"] = f"AIR scores (0-1, recent and relevant facts weigh most): {summaries['user']}"
+        if summaries["company"]:
+            user_profile["distilled_company_AIR_info"] = f"AIR scores (0-1, recent and relevant facts weigh most): {summaries['company']}"
+
+    internalconversation: MessageLog[ChatMessage] = MessageLog()
+    internalconversation.append(latest_user_message)
 
     state = MultiAgentState(
-        internalconversation = {latest_user_message.message_id: latest_user_message},
+        internalconversation = internalconversation,
         latest_phase_prompt = latest_phase_prompt,
-        MA_response = {},
-        reviewer_response = {},
+        MA_response = MessageLog(),
+        reviewer_response = MessageLog(),
         reviewer_approval = False,
         session_finished= False,
-        writer_response={},
-        new_company_info={},
-        new_user_AIR_info={}, 
+        writer_response=None,
+        new_company_info=MessageLog(),
+        new_user_AIR_info=MessageLog(), 
         )
 
 
@@ -265,15 +332,95 @@ async def create_context(clients, user_id: str, payload) -> GraphRunContext[Mult
 
         #### other dependencies from supabase needed to run multi agent
         user_id=user_id,
-        session_id=payload.session_id,
+        session_id=session_id,
         user_message=latest_user_message,
         user_profile=user_profile,
         conversation_history=conversation_history,
+        history_view=history_view,
+        rag_engine=clients.rag_engine,
+        covered_themes=covered_themes(info_rows),
+        model_router=clients.model_router,
+        response_cache=clients.response_cache,
+        token_ledger=getattr(clients, "token_ledger", None),
     )
 
     # Set the dependency container as the deps.
     return GraphRunContext(state=state, deps=deps)
 
+
+########################################################################
+# Resident session state for long-lived (WebSocket) connections.
+########################################################################
+
+class SessionNotFound(Exception):
+    """The session doesn't exist or belongs to another user."""
+
+
+@dataclass
+class ResidentSession:
+    """
+    Session data kept for the life of a WebSocket connection. A turn then only fetches the
+    new user message and the current phase prompt instead of the profile, the history and
+    the session's info_messages; the history view keeps its converted messages as well.
+    """
+    user_id: str
+    session_id: str
+    user_profile: dict
+    conversation_history: MessageLog[ChatMessage]
+    latest_phase_prompt: MessageLog[ChatMessage]
+    info_rows: list[dict]
+    history_view: ConversationHistoryView
+    turns: int = 0
+
+    def commit(self, state: MultiAgentState) -> None:
+        """Fold a finished turn into the resident data, the same way store_*() updates Supabase."""
+        if state.writer_response is not None:
+            self.conversation_history.append(state.writer_response)
+        for column, category, infos in (
+            ("distilled_company_AIR_info", "company", state.new_company_info),
+            ("distilled_user_AIR_info", "user_air", state.new_user_AIR_info),
+        ):
+            for info in infos.values():
+                current = self.user_profile.get(column)
+                self.user_profile[column] = f"{current}\n{info.content_str}" if current else info.content_str
+                self.info_rows.append({"category": category, "content_dict": info.content_dict})
+        self.turns += 1
+
+
+async def session_belongs_to(supabase_client: AsyncSupabase, user_id: str, session_id: str) -> bool:
+    response = await supabase_client.table("chat_sessions") \
+        .select("id") \
+        .eq("id", session_id) \
+        .eq("user_id", user_id) \
+        .limit(1) \
+        .execute()
+    return bool(response.data)
+
+
+async def load_session(clients, user_id: str, session_id: str) -> ResidentSession:
+    """
+    Fetch everything a session's turns share, once, for a new connection. Raises
+    SessionNotFound unless the session belongs to the user (checked alongside the fetches).
+    """
+    owned, user_profile, (conversation_history, latest_phase_prompt), info_rows = await asyncio.gather(
+        session_belongs_to(clients.supabase_client, user_id, session_id),
+        fetch_user_profile(clients.supabase_client, user_id),
+        fetch_conversation_history(clients.supabase_client, session_id),
+        fetch_session_info_messages(clients.supabase_client, session_id),
+    )
+    if not owned:
+        raise SessionNotFound(session_id)
+    return ResidentSession(
+        user_id=user_id,
+        session_id=session_id,
+        user_profile=user_profile,
+        conversation_history=conversation_history,
+        latest_phase_prompt=latest_phase_prompt,
+        info_rows=info_rows,
+        history_view=ConversationHistoryView(conversation_history),
+    )
+
+
 ########################################################################
 # Define the nodes for the multi-agent workflow.
 ########################################################################
@@ -288,84 +435,208 @@ async def create_context(clients, user_id: str, payload) -> GraphRunContext[Mult
  #           return MetaAgentNode(self.ctx)
 
 
+@dataclass
+class PreScreenNode(BaseNode[MultiAgentState, MultiAgentDeps]):
+    # Cheap local check of the user message before any LLM call (see prescreen.py)
+
+    async def run(self, graph_ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]) -> UpdateAndMetaAgentNode:
+        message = graph_ctx.deps.user_message
+        if prescreener is not None and message:
+            verdict = prescreener.screen(message.message_id, message.content or "")
+            if verdict.blocked:
+                logging.info("Pre-screen blocked message_id=%s (rule %s)", message.message_id, verdict.rule)
+                raise PreScreenBlocked(verdict.rule)
+        return UpdateAndMetaAgentNode()
+
+
 @dataclass
 class UpdateAndMetaAgentNode(BaseNode[MultiAgentState, MultiAgentDeps]):
-    ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]
+    # Nodes carry no data: everything a node needs is in graph_ctx, so a checkpoint of the
+    # run is just the state plus the next node's name (see checkpoints.py).
 
     async def run(self, graph_ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]) -> ReviewerAgentNode:
+        # Past its token budget a turn skips fact extraction and only runs the meta agent
+        ledger = graph_ctx.deps.token_ledger
+        if ledger is not None and ledger.skip_stage("update"):
+            await MetaAgent_workflow(graph_ctx)
+            return ReviewerAgentNode()
+
         # fire both workflows at once
         update_task = UpdateAgent_workflow(graph_ctx)
         meta_task   = MetaAgent_workflow(graph_ctx)
 
-        # wait for both to complete
+        # wait for both to complete (both workflows mutate graph_ctx.state in place)
         await asyncio.gather(update_task, meta_task)
 
-        # (both workflows have mutated graph_ctx in place;
-        #  you can pick either returned ctx or just use graph_ctx itself)
-        self.ctx = graph_ctx
-
         # pass the unified context on to the reviewer
-        return ReviewerAgentNode(self.ctx)
+        return ReviewerAgentNode()
     
 @dataclass
 class MetaAgentNode(BaseNode[MultiAgentState, MultiAgentDeps]):
-    ctx: GraphRunContext[MultiAgentState, MultiAgentDeps] 
 
     async def run(self, graph_ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]) -> ReviewerAgentNode:
-        self.ctx = await MetaAgent_workflow(graph_ctx)
+        await MetaAgent_workflow(graph_ctx)
 
         # Pass to the ReviewerAgentNode.
-        return ReviewerAgentNode(self.ctx)
+        return ReviewerAgentNode()
 
 
 @dataclass
 class ReviewerAgentNode(BaseNode[MultiAgentState, MultiAgentDeps]):
-    ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]
 
     async def run(self, graph_ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]) -> Union[MetaAgentNode, WriterAgentNode]:
+        # Past its token budget a turn sends the meta agent's answer to the writer unreviewed
+        ledger = graph_ctx.deps.token_ledger
+        if ledger is not None and ledger.skip_stage("reviewer"):
+            graph_ctx.state.reviewer_approval = True
+            return WriterAgentNode()
+
         # Run the reviewer workflow using the reviewer agent.
-        self.ctx = await ReviewerAgent_workflow(graph_ctx)
+        await ReviewerAgent_workflow(graph_ctx)
         
         # Decide the next node based on the reviewer_approval flag.
-        if self.ctx.state.reviewer_approval == 1:
+        if graph_ctx.state.reviewer_approval == 1:
             logging.info("Reviewer approved the response. Routing to AudioNode.")
-            return WriterAgentNode(self.ctx)
+            return WriterAgentNode()
         else:
             logging.info("Reviewer did not approve the response. Routing back to MainAgentNode.")
-            return MetaAgentNode(self.ctx)
+            return MetaAgentNode()
 
 @dataclass
-class WriterAgentNode(BaseNode[MultiAgentState, MultiAgentDeps]):
-    ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]
+class WriterAgentNode(BaseNode[MultiAgentState, MultiAgentDeps, str]):
 
-    async def run(self, graph_ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]) -> End:
-        # Run the reviewer workflow using the reviewer agent.
-        self.ctx = await WriterAgent_workflow(graph_ctx)
+    async def run(self, graph_ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]) -> Union[AudioNode, End[str]]:
+        # Run the writer workflow; with deps.speech set its sentences are already being spoken.
+        await WriterAgent_workflow(graph_ctx)
         
-        # Decide the next node based on the reviewer_approval flag.
-        if self.ctx.deps.user_profile["TTS_flag"] == 1:
+        # Decide the next node based on the TTS_flag.
+        if graph_ctx.deps.user_profile.get("TTS_flag") == 1:
             logging.info("User put TTS_flag as 1, routing to audio agent")
-            return End(self.ctx)
+            return AudioNode()
         else:
             logging.info("TTS_flag was 0 so answer as text")
-            return End(self.ctx)
+            return End(graph_ctx.state.writer_response.content)
+
+
+@dataclass
+class AudioNode(BaseNode[MultiAgentState, MultiAgentDeps, str]):
+
+    async def run(self, graph_ctx: GraphRunContext[MultiAgentState, MultiAgentDeps]) -> End[str]:
+        # Speak the rest of the reply; the sentences streamed so far were synthesised while
+        # the writer generated. A cached or resumed writer output is spoken whole here.
+        text = graph_ctx.state.writer_response.content
+        speech = graph_ctx.deps.speech
+        if speech is not None:
+            await speech.finish(text)
+        else:
+            logging.info("No audio channel for this turn, answering as text")
+        return End(text)
 
 
 
 ########################################################################
 # Build the graph.
 ########################################################################
-multi_agent_graph = Graph(nodes=[UpdateAndMetaAgentNode, MetaAgentNode, ReviewerAgentNode, WriterAgentNode])
+multi_agent_graph = Graph(nodes=[PreScreenNode, UpdateAndMetaAgentNode, MetaAgentNode, ReviewerAgentNode, WriterAgentNode, AudioNode])
 
 ########################################################################
 # Runner function to start the orchestration workflow.
 ########################################################################
 
-async def run_multi_agent_workflow(clients, user_id: str, payload) -> GraphRunContext[MultiAgentState, MultiAgentDeps]:
+async def run_graph(clients, initial_ctx: GraphRunContext[MultiAgentState, MultiAgentDeps], message_id: str) -> GraphRunResult:
+    """
+    Run the graph for one message. With a checkpoint store, every node's outcome is
+    snapshotted under the message; a retry of a failed run resumes with the restored state
+    at the node that failed, so the LLM calls that already succeeded aren't made again.
+    """
+    deps = initial_ctx.deps
+    # Model requests of this run are accounted to the user, session and company
+    scope = UsageScope(deps.user_id, deps.session_id, (deps.user_profile or {}).get("company_id"))
+    if deps.token_ledger is not None:
+        await deps.token_ledger.prepare(scope)
+    with usage_scope(scope):
+        try:
+            return await _run_graph(clients, initial_ctx, message_id)
+        except Exception as e:
+            # Remember what Azure's content filter rejected, so a resend is blocked locally
+            if prescreener is not None and deps.user_message and is_content_filter_error(e):
+                prescreener.remember_blocked(message_id, deps.user_message.content or "")
+            raise
+
+
+async def _drive(graph_run) -> None:
+    # Step the run node by node, labelling the task so event-loop blocks name the node
+    while not isinstance(graph_run.next_node, End):
+        label_task(node=type(graph_run.next_node).__name__)
+        await graph_run.next(graph_run.next_node)
+
+
+async def _run_graph(clients, initial_ctx: GraphRunContext[MultiAgentState, MultiAgentDeps], message_id: str) -> GraphRunResult:
+    store = getattr(clients, "graph_checkpoints", None)
+    if store is None:
+        async with multi_agent_graph.iter(PreScreenNode(), state=initial_ctx.state, deps=initial_ctx.deps, infer_name=False) as graph_run:
+            await _drive(graph_run)
+        return graph_run.result
+
+    deps = initial_ctx.deps
+    persistence = GraphCheckpoint(store, (deps.user_id, deps.session_id, message_id))
+    persistence.set_graph_types(multi_agent_graph)
+    if await persistence.restore():
+        logging.info("Resuming graph run for message_id=%s from a checkpoint", message_id)
+        async with multi_agent_graph.iter_from_persistence(persistence, deps=deps) as graph_run:
+            await _drive(graph_run)
+    else:
+        async with multi_agent_graph.iter(PreScreenNode(), state=initial_ctx.state, deps=deps, persistence=persistence, infer_name=False) as graph_run:
+            await _drive(graph_run)
+    result = graph_run.result
+
+    await persistence.clear()
+    return result
+
+
+async def run_multi_agent_workflow(clients, user_id: str, payload) -> GraphRunResult:
     # Create GraphRunContext including dependencies.
     initial_ctx = await create_context(clients, user_id, payload)
     
-    # Run the graph using the initial node.
-    end_node = await multi_agent_graph.run(start_node=UpdateAndMetaAgentNode(initial_ctx), state=initial_ctx.state, deps=initial_ctx.deps) ### check dit nog
-    
-    return end_node
+    # Run the graph using the initial node (or resume a failed attempt of this message).
+    return await run_graph(clients, initial_ctx, payload.message_id)
+
+
+async def run_resident_turn(clients, session: ResidentSession, message_id: str, writer_stream=None, audio_sink=None):
+    """
+    Run the workflow for one message of a resident session. `writer_stream` receives the
+    writer's text deltas and, for TTS_flag users, `audio_sink` the spoken reply sentence by
+    sentence (see tts.py). The message is always read from the table, and only if it belongs
+    to the session, so a client can't put words in another session's (or its own) history.
+    """
+    latest_user_message, latest_phase_prompt = await asyncio.gather(
+        fetch_message_by_id(clients.supabase_client, message_id, session_id=session.session_id),
+        fetch_latest_phase_prompt(clients.supabase_client, session.session_id),
+    )
+    if latest_user_message is None:
+        raise ValueError(f"Message {message_id} not found in session {session.session_id}")
+    if latest_user_message.message_id not in session.conversation_history:
+        session.conversation_history.append(latest_user_message)
+    session.latest_phase_prompt = latest_phase_prompt
+
+    initial_ctx = await build_context(
+        clients, session.user_id, session.session_id,
+        user_profile=session.user_profile,
+        conversation_history=session.conversation_history,
+        latest_phase_prompt=latest_phase_prompt,
+        latest_user_message=latest_user_message,
+        info_rows=session.info_rows,
+        history_view=session.history_view,
+    )
+    initial_ctx.deps.writer_stream = writer_stream
+    tts_backend = getattr(clients, "tts_backend", None)
+    if audio_sink is not None and tts_backend is not None and session.user_profile.get("TTS_flag") == 1:
+        initial_ctx.deps.speech = SpeechStream(tts_backend, audio_sink)
+
+    try:
+        result = await run_graph(clients, initial_ctx, message_id)
+    finally:
+        if initial_ctx.deps.speech is not None:
+            await initial_ctx.deps.speech.aclose()
+    session.commit(result.state)
+    return result
@@ -0,0 +1,183 @@
+# prescreen.py
+# Local pre-screen of user messages before any LLM call. PreScreenNode runs it as the first
+# node of multi_agent_graph; a blocked message raises PreScreenBlocked, which send_message
+# answers like an Azure content-filter rejection, so no Update/Meta round trips are spent on it.
+#
+# A message is blocked when:
+#   - Azure's content filter already rejected this message_id, or a message with the same
+#     normalised text (verdicts are cached for PRESCREEN_VERDICT_TTL seconds, see remember_blocked)
+#   - one of the rules matches: the regexes in PRESCREEN_RULES_FILE, one per line, optionally
+#     named "name: regex", and the built-in prompt-injection patterns when
+#     PRESCREEN_DEFAULT_RULES=1 (off by default: they also match ordinary interview answers such
+#     as "forget the previous rules of our AI policy"); all rules are compiled into a single
+#     case-insensitive pattern
+#   - the classifier PRESCREEN_CLASSIFIER ("package.module:function", called with the text and
+#     returning a rule name when the text should be blocked, or None) says so
+#
+# Everything runs in-process; a screened message costs a few microseconds.
+import hashlib
+import importlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PRESCREEN_ENABLED = os.getenv("PRESCREEN_ENABLED", "1") == "1"
+PRESCREEN_DEFAULT_RULES = os.getenv("PRESCREEN_DEFAULT_RULES", "0") == "1"
+PRESCREEN_RULES_FILE = os.getenv("PRESCREEN_RULES_FILE", "")
+PRESCREEN_CLASSIFIER = os.getenv("PRESCREEN_CLASSIFIER", "")
+PRESCREEN_VERDICT_TTL = float(os.getenv("PRESCREEN_VERDICT_TTL", "86400"))
+PRESCREEN_CACHE_SIZE = int(os.getenv("PRESCREEN_CACHE_SIZE", "10000"))
+
+# Jailbreak phrasings that Azure's prompt shield rejects anyway (opt-in, see above)
+DEFAULT_RULES = {
+    "ignore_instructions": r"\b(?:ignore|disregard|forget)\s+(?:all\s+|any\s+)?(?:the\s+|your\s+)?(?:previous|prior|above|earlier)\s+(?:instructions|prompts?|rules)\b",
+    "system_prompt_leak": r"\b(?:reveal|print|show|repeat)\s+(?:me\s+)?(?:your|the)\s+(?:system\s+prompt|hidden\s+instructions)\b",
+    "dan_mode": r"\b(?:DAN|developer)\s+mode\s+(?:enabled|on|activated)\b",
+}
+
+prescreen_verdicts = registry.counter(
+    "prescreen_verdicts_total", "Pre-screen verdicts by result and the rule that decided", ["result", "rule"],
+)
+
+
+class PreScreenBlocked(Exception):
+    """A message was blocked by the local pre-screen; `rule` names what blocked it."""
+
+    def __init__(self, rule: str):
+        super().__init__(f"Message blocked by pre-screen rule {rule!r}")
+        self.rule = rule
+
+
+@dataclass
+class Verdict:
+    blocked: bool
+    rule: Optional[str] = None
+
+
+def normalise(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(normalise(text).encode(), digest_size=16).digest()
+
+
+def load_rules(path: str = PRESCREEN_RULES_FILE, defaults: bool = PRESCREEN_DEFAULT_RULES) -> dict[str, str]:
+    rules = dict(DEFAULT_RULES) if defaults else {}
+    if not path:
+        return rules
+    try:
+        with open(path, encoding="utf-8") as handle:
+            for number, line in enumerate(handle, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                name, sep, pattern = line.partition(": ")
+                if not sep or not name.isidentifier():
+                    name, pattern = f"rule_{number}", line
+                problem = _rule_problem(pattern)
+                if problem is not None:
+                    logger.error("Skipping pre-screen rule %s in %s line %d: %s", name, path, number, problem)
+                    continue
+                rules[name] = pattern
+    except OSError as e:
+        logger.error("Could not read PRESCREEN_RULES_FILE %s: %s", path, e)
+    return rules
+
+
+def _rule_problem(pattern: str) -> Optional[str]:
+    # Rules become named groups of one alternation, which reports the rule via match.lastgroup
+    try:
+        compiled = re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        return f"invalid regex: {e}"
+    if compiled.groupindex:
+        return "named groups are not allowed"
+    return None
+
+
+def load_classifier(spec: str = PRESCREEN_CLASSIFIER) -> Optional[Callable[[str], Optional[str]]]:
+    if not spec:
+        return None
+    module_name, _, attribute = spec.partition(":")
+    try:
+        return getattr(importlib.import_module(module_name), attribute)
+    except (ImportError, AttributeError) as e:
+        logger.error("Could not load PRESCREEN_CLASSIFIER %s, screening without it: %s", spec, e)
+        return None
+
+
+class PreScreener:
+    def __init__(
+        self,
+        rules: Optional[dict[str, str]] = None,
+        classifier: Optional[Callable[[str], Optional[str]]] = None,
+        ttl: float = PRESCREEN_VERDICT_TTL,
+        max_entries: int = PRESCREEN_CACHE_SIZE,
+    ):
+        self.rules = rules or {}
+        self.classifier = classifier
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # One alternation with a named group per rule: a single scan finds the first match
+        self._pattern = re.compile(
+            "|".join(f"(?P<{name}>{pattern})" for name, pattern in self.rules.items()), re.IGNORECASE,
+        ) if self.rules else None
+        # message_id or text digest -> (expires_at, rule) of messages Azure's filter rejected
+        self._blocked: "OrderedDict[object, tuple[float, str]]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "PreScreener":
+        return cls(rules=load_rules(), classifier=load_classifier())
+
+    def _cached(self, key) -> Optional[str]:
+        entry = self._blocked.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._blocked[key]
+            return None
+        return entry[1]
+
+    def screen(self, message_id: Optional[str], text: str) -> Verdict:
+        rule = (self._cached(message_id) if message_id else None) or self._cached(_digest(text))
+        if rule is None and self._pattern is not None:
+            match = self._pattern.search(text)
+            if match is not None:
+                rule = match.lastgroup
+        if rule is None and self.classifier is not None:
+            try:
+                rule = self.classifier(text)
+            except Exception as e:
+                logger.warning("Pre-screen classifier failed, letting the message through: %s", e)
+        verdict = Verdict(blocked=rule is not None, rule=rule)
+        prescreen_verdicts.inc(result="blocked" if verdict.blocked else "passed", rule=rule or "")
+        return verdict
+
+    def remember_blocked(self, message_id: Optional[str], text: str, rule: str = "content_filter") -> None:
+        """Cache the verdict for a message the model endpoint rejected, so retries stop locally."""
+        expires_at = time.monotonic() + self.ttl
+        for key in filter(None, (message_id, _digest(text) if text else None)):
+            self._blocked[key] = (expires_at, rule)
+            self._blocked.move_to_end(key)
+        while len(self._blocked) > self.max_entries:
+            self._blocked.popitem(last=False)
+
+
+prescreener: Optional[PreScreener] = PreScreener.from_env() if PRESCREEN_ENABLED else None
+
+
+def is_content_filter_error(error: Exception) -> bool:
+    body = getattr(error, "body", None)
+    if not isinstance(body, dict):
+        return False
+    error_data = body.get("error") or body
+    return isinstance(error_data, dict) and error_data.get("code") == "content_filter"
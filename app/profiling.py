@@ -0,0 +1,206 @@
+# profiling.py
+# On-demand profiling of a single /chat/send_message call. An admin sends the header
+#   X-Profile-Request: sample | cprofile
+# and that request runs under a profiler; the response carries X-Profile-Id, and the profile is
+# downloaded from /admin/profiles/{id}. Requests without the header only pay the header lookup.
+#
+#   sample    a thread samples the event-loop thread's stack every PROFILE_SAMPLE_INTERVAL
+#             seconds and writes collapsed stacks ("frame;frame;frame count", the input of
+#             flamegraph.pl / speedscope). With the loop monitor on (loop_monitor.py), only the
+#             samples taken while a task of this request was running are kept.
+#   cprofile  cProfile over the request, written as a pstats file (python -m pstats, snakeviz).
+#             cProfile sees the whole loop thread, so other requests served meanwhile show up too.
+#
+# One profile runs at a time per process; a second profiled request runs unprofiled and gets
+# X-Profile-Error: busy. Profiles are files in PROFILE_DIR (shared by the workers of a host);
+# the oldest are removed beyond PROFILE_MAX_STORED.
+import asyncio
+import cProfile
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Optional
+
+import orjson
+
+from . import loop_monitor
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile-request"
+PROFILE_DEFAULT_MODE = os.getenv("PROFILE_DEFAULT_MODE", "sample")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "frits-profiles"))
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "50"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+MODES = {"sample": "collapsed.txt", "cprofile": "pstats"}
+_PROFILE_ID = re.compile(r"[0-9a-f]{32}")
+
+profiled_requests = registry.counter("profiled_requests_total", "Requests run under the on-demand profiler", ["mode", "outcome"])
+
+_busy = False
+
+
+class ProfilerBusy(Exception):
+    """Another request of this process is being profiled."""
+
+
+@dataclass
+class ProfileInfo:
+    profile_id: str
+    mode: str
+    label: str
+    user_id: str
+    started_at: float
+    seconds: float
+    samples: Optional[int] = None
+
+
+def _path(profile_id: str, suffix: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.{suffix}")
+
+
+class StackSampler:
+    """Samples one thread's stack from a background thread and counts the collapsed stacks."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL, scope: Optional[dict] = None):
+        self.thread_id = thread_id
+        self.interval = interval
+        # keep only samples taken while a task labelled with this ASGI scope was running
+        self.scope = scope if loop_monitor.loop_monitor is not None else None
+        self.loop = asyncio.get_running_loop()
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            if self.scope is not None:
+                task = asyncio.current_task(self.loop)
+                if task is None or loop_monitor._labels.get(task, {}).get("scope") is not self.scope:
+                    continue
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def collapsed(self) -> bytes:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()).encode()
+
+
+def _write(info: ProfileInfo, suffix: str, data: Optional[bytes], profiler: Optional[cProfile.Profile]) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if profiler is not None:
+        profiler.dump_stats(_path(info.profile_id, suffix))
+    else:
+        with open(_path(info.profile_id, suffix), "wb") as handle:
+            handle.write(data)
+    with open(_path(info.profile_id, "json"), "wb") as handle:
+        handle.write(orjson.dumps(asdict(info)))
+    _prune()
+
+
+def _prune() -> None:
+    infos = list_profiles()
+    for info in infos[PROFILE_MAX_STORED:]:
+        for suffix in (MODES[info.mode], "json"):
+            try:
+                os.remove(_path(info.profile_id, suffix))
+            except OSError:
+                pass
+
+
+def list_profiles() -> list[ProfileInfo]:
+    """Stored profiles, newest first."""
+    infos = []
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name), "rb") as handle:
+                infos.append(ProfileInfo(**orjson.loads(handle.read())))
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning("Skipping unreadable profile metadata %s: %s", name, e)
+    return sorted(infos, key=lambda info: info.started_at, reverse=True)
+
+
+def profile_file(profile_id: str) -> Optional[tuple[str, ProfileInfo]]:
+    """Path and metadata of a stored profile, or None (ids are validated, so no path tricks)."""
+    if not _PROFILE_ID.fullmatch(profile_id):
+        return None
+    for info in list_profiles():
+        if info.profile_id == profile_id:
+            path = _path(profile_id, MODES[info.mode])
+            return (path, info) if os.path.exists(path) else None
+    return None
+
+
+async def run_profiled(awaitable: Awaitable, mode: str, *, label: str, user_id: str, scope: Optional[dict] = None):
+    """
+    Await `awaitable` under the profiler and store the profile; returns (result, profile_id).
+    Raises ProfilerBusy (before awaiting anything) when another profile is running.
+    """
+    global _busy
+    mode = mode.strip().lower()
+    if mode not in MODES:
+        mode = PROFILE_DEFAULT_MODE
+    if _busy:
+        profiled_requests.inc(mode=mode, outcome="busy")
+        raise ProfilerBusy()
+    _busy = True
+
+    info = ProfileInfo(profile_id=uuid.uuid4().hex, mode=mode, label=label, user_id=user_id, started_at=time.time(), seconds=0.0)
+    profiler = sampler = None
+    start = time.perf_counter()
+    try:
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            sampler = StackSampler(threading.get_ident(), scope=scope)
+            sampler.start()
+        try:
+            result = await awaitable
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            info.seconds = time.perf_counter() - start
+    finally:
+        _busy = False
+
+    if sampler is not None:
+        info.samples = sum(sampler.stacks.values())
+    try:
+        await asyncio.to_thread(_write, info, MODES[mode], sampler.collapsed() if sampler is not None else None, profiler)
+    except OSError as e:
+        profiled_requests.inc(mode=mode, outcome="error")
+        logger.error("Could not store profile %s: %s", info.profile_id, e)
+        return result, None
+    profiled_requests.inc(mode=mode, outcome="stored")
+    logger.info("Stored %s profile %s of %s (%.2f s)", mode, info.profile_id, label, info.seconds)
+    return result, info.profile_id
@@ -0,0 +1,400 @@
+# rag.py
+# In-process retrieval for the Reviewer Agent.
+#
+# Framework texts from promptconfig and a company's extracted info_messages are chunked,
+# embedded with a pluggable embedder and stored in a NumPy matrix. The framework index is
+# written to a memory-mapped .npy file (keyed by a hash of the texts) so every worker on a
+# host shares the same pages; company indexes are small and live in memory with a TTL, at
+# most RAG_COMPANY_INDEX_MAX of them (least recently used first out).
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Protocol, Sequence
+
+import numpy as np
+
+from . import promptconfig
+from .info_messages import fetch_company_info_messages
+
+logger = logging.getLogger(__name__)
+
+RAG_ENABLED = os.getenv("RAG_ENABLED", "1") == "1"
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
+RAG_EMBED_DIM = int(os.getenv("RAG_EMBED_DIM", "1024"))
+RAG_CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS", "900"))
+RAG_COMPANY_INDEX_TTL = float(os.getenv("RAG_COMPANY_INDEX_TTL", "300"))
+RAG_COMPANY_INDEX_MAX = int(os.getenv("RAG_COMPANY_INDEX_MAX", "64"))
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join(tempfile.gettempdir(), "frits_rag"))
+
+# promptconfig texts that make up the framework corpus: (source name, attribute)
+FRAMEWORK_SOURCES = [
+    ("interview_goal", "interview_goal_definition"),
+    ("topic_info", "general_topic_info_full"),
+    ("topic_summary", "general_topic_info_summary"),
+    ("company_framework", "general_framework_info_company"),
+    ("company_themes", "framework_themes_company"),
+    ("user_framework", "general_framework_info_user"),
+    ("user_themes", "framework_themes_user"),
+]
+
+
+########################################################################
+# Chunking
+########################################################################
+
+@dataclass(slots=True)
+class Chunk:
+    text: str
+    source: str
+    metadata: dict = field(default_factory=dict)
+
+    @property
+    def reference(self) -> str:
+        ref = self.source
+        if "chunk" in self.metadata:
+            ref += f"#{self.metadata['chunk']}"
+        elif self.metadata.get("info_id"):
+            ref += f"#{str(self.metadata['info_id'])[:8]}"
+        return ref
+
+
+def chunk_text(text: str, source: str, max_chars: int = RAG_CHUNK_CHARS, metadata: Optional[dict] = None) -> list[Chunk]:
+    """
+    Split text on blank lines and pack consecutive paragraphs into chunks of at most
+    max_chars. Paragraphs longer than max_chars are split on sentence ends.
+    """
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text or "") if p.strip()]
+
+    pieces: list[str] = []
+    for paragraph in paragraphs:
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        sentence_buffer = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            if sentence_buffer and len(sentence_buffer) + len(sentence) + 1 > max_chars:
+                pieces.append(sentence_buffer)
+                sentence_buffer = ""
+            sentence_buffer = f"{sentence_buffer} {sentence}".strip()
+        if sentence_buffer:
+            pieces.append(sentence_buffer)
+
+    chunks: list[Chunk] = []
+    buffer = ""
+    for piece in pieces:
+        if buffer and len(buffer) + len(piece) + 2 > max_chars:
+            chunks.append(buffer)
+            buffer = ""
+        buffer = f"{buffer}\n\n{piece}" if buffer else piece
+    if buffer:
+        chunks.append(buffer)
+
+    return [
+        Chunk(text=chunk, source=source, metadata={**(metadata or {}), "chunk": i})
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+########################################################################
+# Embedders
+########################################################################
+
+class Embedder(Protocol):
+    """Anything that turns texts into L2-normalised float32 vectors of a fixed dimension."""
+    dim: int
+    name: str
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        ...
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """
+    Offline embedder: signed feature hashing of word unigrams and bigrams with sublinear
+    term frequency. Deterministic across processes (crc32, not the salted built-in hash),
+    so vectors written to disk by one worker are valid in another.
+    """
+
+    def __init__(self, dim: int = RAG_EMBED_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> dict[int, float]:
+        tokens = _TOKEN_RE.findall(text.lower())
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        counts: dict[int, float] = {}
+        for gram in grams:
+            h = zlib.crc32(gram.encode("utf-8"))
+            bucket = h % self.dim
+            sign = 1.0 if (h >> 31) & 1 else -1.0
+            counts[bucket] = counts.get(bucket, 0.0) + sign
+        return counts
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, value in self._features(text).items():
+                vectors[row, bucket] = np.sign(value) * np.log1p(abs(value))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+########################################################################
+# Vector index
+########################################################################
+
+@dataclass(slots=True)
+class RetrievedChunk:
+    chunk: Chunk
+    score: float
+
+
+class VectorIndex:
+    """
+    Row-per-chunk float32 matrix with batched top-k cosine search.
+    With a path the matrix is a memory-mapped .npy file that grows by doubling.
+    """
+
+    def __init__(self, dim: int, path: Optional[str] = None, capacity: int = 256):
+        self.dim = dim
+        self.path = path
+        self.chunks: list[Chunk] = []
+        self._size = 0
+        self._matrix = self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> np.ndarray:
+        if self.path is None:
+            return np.zeros((capacity, self.dim), dtype=np.float32)
+        return np.lib.format.open_memmap(self.path, mode="w+", dtype=np.float32, shape=(capacity, self.dim))
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._matrix[: self._size]
+
+    def add(self, vectors: np.ndarray, chunks: Sequence[Chunk]) -> None:
+        if len(vectors) != len(chunks):
+            raise ValueError("vectors and chunks must have the same length")
+        needed = self._size + len(vectors)
+        if needed > len(self._matrix):
+            capacity = len(self._matrix)
+            while capacity < needed:
+                capacity *= 2
+            old = np.array(self.vectors)
+            if isinstance(self._matrix, np.memmap):
+                del self._matrix
+            self._matrix = self._allocate(capacity)
+            self._matrix[: len(old)] = old
+        self._matrix[self._size:needed] = vectors
+        self._size = needed
+        self.chunks.extend(chunks)
+
+    def flush(self) -> None:
+        if isinstance(self._matrix, np.memmap):
+            self._matrix.flush()
+
+    def search(self, queries: np.ndarray, k: int = RAG_TOP_K) -> list[list[RetrievedChunk]]:
+        """Return the top-k chunks per query row (queries must be L2-normalised)."""
+        if self._size == 0 or len(queries) == 0:
+            return [[] for _ in range(len(queries))]
+        k = min(k, self._size)
+        scores = queries @ self.vectors.T  # (queries, chunks) cosine similarities
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            ordered = candidates[np.argsort(-scores[row, candidates])]
+            results.append([RetrievedChunk(self.chunks[i], float(scores[row, i])) for i in ordered])
+        return results
+
+    @classmethod
+    def open(cls, path: str) -> "VectorIndex":
+        """Open a previously saved index read-only (the .npy matrix plus its .json chunk sidecar)."""
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            chunks = [Chunk(**item) for item in json.load(f)]
+        matrix = np.load(path, mmap_mode="r")
+        index = cls.__new__(cls)
+        index.dim = matrix.shape[1]
+        index.path = path
+        index.chunks = chunks
+        index._size = len(chunks)
+        index._matrix = matrix
+        return index
+
+    def save_sidecar(self) -> None:
+        if self.path is None:
+            return
+        self.flush()
+        with open(self.path + ".json", "w", encoding="utf-8") as f:
+            json.dump([{"text": c.text, "source": c.source, "metadata": c.metadata} for c in self.chunks], f)
+
+
+def build_index(embedder: Embedder, chunks: Sequence[Chunk], path: Optional[str] = None, batch_size: int = 64) -> VectorIndex:
+    index = VectorIndex(embedder.dim, path=path, capacity=max(1, len(chunks)))
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        index.add(embedder.embed([c.text for c in batch]), batch)
+    return index
+
+
+########################################################################
+# Corpus builders
+########################################################################
+
+def framework_chunks() -> list[Chunk]:
+    chunks: list[Chunk] = []
+    for source, attribute in FRAMEWORK_SOURCES:
+        chunks.extend(chunk_text(getattr(promptconfig, attribute, ""), source))
+    return chunks
+
+
+def info_message_chunks(rows: Sequence[dict]) -> list[Chunk]:
+    chunks = []
+    for row in rows:
+        text = (row.get("content_str") or "").strip()
+        if not text:
+            continue
+        content = row.get("content_dict") or {}
+        themes = content.get("themes") or []
+        if themes:
+            text = f"{text} (themes: {', '.join(map(str, themes))})"
+        chunks.append(Chunk(
+            text=text,
+            source=f"info_message:{row.get('category', 'unknown')}",
+            metadata={"info_id": row.get("info_id"), "created_at": row.get("created_at")},
+        ))
+    return chunks
+
+
+def load_framework_index(embedder: Embedder, index_dir: str = RAG_INDEX_DIR) -> VectorIndex:
+    """
+    Build the framework index once per host. The file name carries a hash of the texts and
+    the embedder, so a prompt change or another embedder writes a new file instead of
+    reading stale vectors.
+    """
+    chunks = framework_chunks()
+    digest = hashlib.sha256(embedder.name.encode("utf-8"))
+    for chunk in chunks:
+        digest.update(chunk.source.encode("utf-8"))
+        digest.update(chunk.text.encode("utf-8"))
+    path = os.path.join(index_dir, f"framework-{digest.hexdigest()[:16]}.npy")
+
+    try:
+        if os.path.exists(path) and os.path.exists(path + ".json"):
+            return VectorIndex.open(path)
+        os.makedirs(index_dir, exist_ok=True)
+        # Write under a temporary name so a concurrently starting worker never opens a half-written file.
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        index = build_index(embedder, chunks, path=tmp_path)
+        index.save_sidecar()
+        os.replace(tmp_path + ".json", path + ".json")
+        os.replace(tmp_path, path)
+        return VectorIndex.open(path)
+    except OSError as e:
+        logger.warning("Could not memory-map the framework index in %s (%s); keeping it in memory", index_dir, e)
+        return build_index(embedder, chunks)
+
+
+########################################################################
+# Engine
+########################################################################
+
+class RAGEngine:
+    """Retrieves framework and company context for a query; one instance per process."""
+
+    def __init__(self, embedder: Embedder, framework_index: VectorIndex, supabase_client=None, max_company_indexes: int = RAG_COMPANY_INDEX_MAX):
+        self.embedder = embedder
+        self.framework_index = framework_index
+        self.supabase_client = supabase_client
+        self.max_company_indexes = max_company_indexes
+        # company_id -> (built_at, index), least recently used first
+        self._company_indexes: "OrderedDict[str, tuple[float, VectorIndex]]" = OrderedDict()
+        # only for companies with a cached index or a build in progress
+        self._company_locks: dict[str, asyncio.Lock] = {}
+
+    @classmethod
+    def create(cls, supabase_client=None, embedder: Optional[Embedder] = None) -> "RAGEngine":
+        embedder = embedder or HashingEmbedder()
+        return cls(embedder, load_framework_index(embedder), supabase_client)
+
+    async def company_index(self, company_id: Optional[str]) -> Optional[VectorIndex]:
+        if not company_id or self.supabase_client is None:
+            return None
+        cached = self._company_indexes.get(company_id)
+        if cached and time.monotonic() - cached[0] < RAG_COMPANY_INDEX_TTL:
+            self._company_indexes.move_to_end(company_id)
+            return cached[1]
+
+        lock = self._company_locks.setdefault(company_id, asyncio.Lock())
+        async with lock:
+            cached = self._company_indexes.get(company_id)
+            if cached and time.monotonic() - cached[0] < RAG_COMPANY_INDEX_TTL:
+                return cached[1]
+            rows = await fetch_company_info_messages(self.supabase_client, company_id)
+            chunks = info_message_chunks(rows)
+            index = await asyncio.to_thread(build_index, self.embedder, chunks)
+            self._company_indexes[company_id] = (time.monotonic(), index)
+            self._company_indexes.move_to_end(company_id)
+            self._evict_company_indexes()
+            return index
+
+    def _evict_company_indexes(self) -> None:
+        now = time.monotonic()
+        for company_id, (built_at, _) in list(self._company_indexes.items()):
+            if now - built_at >= RAG_COMPANY_INDEX_TTL:
+                del self._company_indexes[company_id]
+        while len(self._company_indexes) > self.max_company_indexes:
+            self._company_indexes.popitem(last=False)
+        for company_id, lock in list(self._company_locks.items()):
+            if company_id not in self._company_indexes and not lock.locked():
+                del self._company_locks[company_id]
+
+    def invalidate_company(self, company_id: str) -> None:
+        self._company_indexes.pop(company_id, None)
+
+    async def retrieve(self, queries: Sequence[str], company_id: Optional[str] = None, k: int = RAG_TOP_K) -> list[RetrievedChunk]:
+        """
+        Embed all queries in one batch, search the framework and company indexes and return
+        the k best distinct chunks across them.
+        """
+        queries = [q for q in queries if q and q.strip()]
+        if not queries:
+            return []
+        query_vectors = self.embedder.embed(queries)
+
+        indexes = [self.framework_index]
+        company = await self.company_index(company_id)
+        if company is not None and len(company):
+            indexes.append(company)
+
+        best: dict[tuple[str, str], RetrievedChunk] = {}
+        for index in indexes:
+            for hits in index.search(query_vectors, k):
+                for hit in hits:
+                    key = (hit.chunk.reference, hit.chunk.text[:64])
+                    if key not in best or best[key].score < hit.score:
+                        best[key] = hit
+        return sorted(best.values(), key=lambda hit: hit.score, reverse=True)[:k]
+
+
+def format_retrieved_context(results: Sequence[RetrievedChunk]) -> str:
+    """Render retrieved chunks with their references so the reviewer can cite them."""
+    if not results:
+        return ""
+    blocks = [f"[{hit.chunk.reference}] (similarity {hit.score:.2f})\n{hit.chunk.text}" for hit in results]
+    return "\n\n".join(blocks)
@@ -0,0 +1,204 @@
+# response_cache.py
+# Opt-in cache of agent stage outputs for repeated early-phase turns.
+#
+# In the Introduction phase many users send practically the same first messages and get the
+# same greeting flow, so the Meta, Reviewer and Writer stages redo identical work. A stage
+# output is cached under the normalised (phase, last user message, earlier conversation,
+# profile fingerprint) plus the outputs of the stages before it in this turn (the agents'
+# internal conversation), and reused when a later turn matches:
+#   exact    same normalised inputs (sha256 of the key)
+#   similar  same phase/conversation/profile and a last user message whose local hashing
+#            embedding has cosine similarity >= RESPONSE_CACHE_SIMILARITY (0 disables)
+# Only turns in RESPONSE_CACHE_PHASES with at most RESPONSE_CACHE_MAX_HISTORY earlier
+# messages are cached. The Update Agent never is: its facts are personal. Since the key holds
+# the earlier stages' outputs, a Reviewer or Writer entry only matches after the same Meta
+# (and Reviewer) output, whether that came from the cache or a fresh model call.
+import hashlib
+import logging
+import os
+import re
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, Optional
+
+import numpy as np
+
+from .framework_selector import detect_phase
+from .metrics import registry
+from .rag import HashingEmbedder
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_PHASES = frozenset(
+    phase.strip() for phase in os.getenv("RESPONSE_CACHE_PHASES", "introduction").split(",") if phase.strip()
+)
+RESPONSE_CACHE_STAGES = frozenset(
+    stage.strip() for stage in os.getenv("RESPONSE_CACHE_STAGES", "meta,reviewer,writer").split(",") if stage.strip()
+)
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("RESPONSE_CACHE_MAX_HISTORY", "2"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+
+# Live caches, for the entries gauge
+_caches: "weakref.WeakSet[ResponseCache]" = weakref.WeakSet()
+
+response_cache_lookups = registry.counter(
+    "response_cache_lookups_total", "Agent stage response cache lookups by outcome", ["stage", "result"],
+)
+
+# Profile fields that shape the early-phase answers
+PROFILE_FIELDS = ("user_description", "company_description", "distilled_company_AIR_info", "distilled_user_AIR_info")
+
+_WS_RE = re.compile(r"\s+")
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def normalise(text: str) -> str:
+    return _WS_RE.sub(" ", _PUNCT_RE.sub(" ", (text or "").lower())).strip()
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+@dataclass(slots=True)
+class TurnKey:
+    """Normalised cache key of one turn; `bucket` is everything except the user message."""
+    phase: str
+    message: str
+    bucket: str
+
+    def exact(self, stage: str) -> str:
+        return _digest(stage, self.bucket, self.message)
+
+
+@dataclass(slots=True)
+class _Entry:
+    stage: str
+    bucket: str
+    text: str
+    vector: Optional[np.ndarray]
+    expires_at: float
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+        similarity: float = RESPONSE_CACHE_SIMILARITY,
+        phases: frozenset[str] = RESPONSE_CACHE_PHASES,
+        stages: frozenset[str] = RESPONSE_CACHE_STAGES,
+        max_history: int = RESPONSE_CACHE_MAX_HISTORY,
+        embedder: Optional[HashingEmbedder] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.phases = phases
+        self.stages = stages
+        self.max_history = max_history
+        self.embedder = embedder or (HashingEmbedder() if similarity > 0 else None)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        _caches.add(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def turn_key(self, deps, phase_indicator: str, upstream: Iterable = ()) -> Optional[TurnKey]:
+        """
+        Key for the current turn, or None when the turn isn't cacheable. `upstream` are the
+        messages the stage's input is built from besides the user message (the earlier stages'
+        outputs of this turn); they are part of the bucket.
+        """
+        phase = detect_phase(phase_indicator)
+        if phase not in self.phases:
+            return None
+        history = deps.conversation_history
+        user_message = deps.user_message
+        earlier = [msg for msg in history.values() if msg.message_id != getattr(user_message, "message_id", None)]
+        if len(earlier) > self.max_history:
+            return None
+        profile = deps.user_profile or {}
+        bucket = _digest(
+            phase,
+            *(normalise(str(profile.get(field, ""))) for field in PROFILE_FIELDS),
+            *(f"{msg.role.lower()}:{normalise(msg.content)}" for msg in earlier),
+            _digest(*(f"{msg.role}:{msg.content}" for msg in upstream)),
+        )
+        return TurnKey(phase=phase, message=normalise(getattr(user_message, "content", "")), bucket=bucket)
+
+    def get(self, stage: str, key: TurnKey) -> tuple[Optional[str], str]:
+        """Return (text, "exact" | "similar" | "miss")."""
+        now = time.monotonic()
+        exact_key = key.exact(stage)
+        entry = self._entries.get(exact_key)
+        if entry is not None:
+            if entry.expires_at >= now:
+                self._entries.move_to_end(exact_key)
+                return entry.text, "exact"
+            del self._entries[exact_key]
+
+        if self.embedder is None or not key.message:
+            return None, "miss"
+        candidates = [
+            (cache_key, entry) for cache_key, entry in self._entries.items()
+            if entry.stage == stage and entry.bucket == key.bucket and entry.vector is not None and entry.expires_at >= now
+        ]
+        if not candidates:
+            return None, "miss"
+        query = self.embedder.embed([key.message])[0]
+        scores = np.stack([entry.vector for _, entry in candidates]) @ query
+        best = int(np.argmax(scores))
+        if scores[best] >= self.similarity:
+            cache_key, entry = candidates[best]
+            self._entries.move_to_end(cache_key)
+            return entry.text, "similar"
+        return None, "miss"
+
+    def put(self, stage: str, key: TurnKey, text: str) -> None:
+        vector = self.embedder.embed([key.message])[0] if self.embedder is not None and key.message else None
+        exact_key = key.exact(stage)
+        self._entries[exact_key] = _Entry(stage, key.bucket, text, vector, time.monotonic() + self.ttl)
+        self._entries.move_to_end(exact_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+async def cached_stage_output(graph_ctx, stage: str, run: Callable[[], Awaitable]) -> str:
+    """
+    Text output of an agent stage: served from deps.response_cache when this turn and stage
+    are cacheable and a matching entry exists, otherwise `run()` (an agent.run call) is
+    awaited and its output stored.
+    """
+    cache: Optional[ResponseCache] = getattr(graph_ctx.deps, "response_cache", None)
+    key = None
+    if cache is not None and stage in cache.stages:
+        phase_prompt = graph_ctx.state.latest_phase_prompt.latest()
+        user_message_id = getattr(graph_ctx.deps.user_message, "message_id", None)
+        upstream = [msg for msg in graph_ctx.state.internalconversation.values() if msg.message_id != user_message_id]
+        key = cache.turn_key(graph_ctx.deps, phase_prompt.content if phase_prompt else "", upstream)
+
+    if key is None:
+        if cache is not None:
+            response_cache_lookups.inc(stage=stage, result="skipped")
+        return str((await run()).data)
+
+    text, result = cache.get(stage, key)
+    response_cache_lookups.inc(stage=stage, result=result)
+    if text is not None:
+        logger.info("Response cache %s hit for stage=%s phase=%s", result, stage, key.phase)
+        return text
+
+    text = str((await run()).data)
+    cache.put(stage, key, text)
+    return text
+
+
+registry.gauge("response_cache_entries", "Entries in the agent stage response caches").set_function(
+    lambda: [({}, sum(len(cache) for cache in list(_caches)))]
+)
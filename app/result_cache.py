@@ -0,0 +1,124 @@
+# result_cache.py
+# Stored send_message results keyed by the triggering message_id, so a client that retries
+# an already answered message gets the stored writer response back instead of a new run.
+#
+# Lookups go to an in-process LRU. With TURN_RESULT_PERSIST=1 they fall back to the Supabase
+# table TURN_RESULT_TABLE, which is shared by all workers; it is off by default because the table
+# has to be created first:
+#
+#   create table turn_results (
+#       message_id uuid primary key,
+#       user_id    uuid not null,
+#       session_id uuid not null,
+#       response   jsonb not null,
+#       created_at timestamptz not null default now()
+#   );
+#
+# Only successful turns are stored; a retry after an error runs the workflow again.
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TURN_RESULT_CACHE_ENABLED = os.getenv("TURN_RESULT_CACHE_ENABLED", "1") == "1"
+TURN_RESULT_CACHE_SIZE = int(os.getenv("TURN_RESULT_CACHE_SIZE", "2048"))
+TURN_RESULT_CACHE_TTL = float(os.getenv("TURN_RESULT_CACHE_TTL", "86400"))
+TURN_RESULT_TABLE = os.getenv("TURN_RESULT_TABLE", "turn_results")
+TURN_RESULT_PERSIST = os.getenv("TURN_RESULT_PERSIST", "0") == "1"
+
+turn_result_lookups = registry.counter(
+    "chat_turn_result_lookups_total", "Stored turn result lookups by outcome", ["result"],
+)
+
+
+class TurnResultCache:
+    """In-memory LRU/TTL of turn results with the Supabase table as the shared, durable layer."""
+
+    def __init__(
+        self,
+        supabase_client=None,
+        table: str = TURN_RESULT_TABLE,
+        max_entries: int = TURN_RESULT_CACHE_SIZE,
+        ttl: float = TURN_RESULT_CACHE_TTL,
+        persist: bool = TURN_RESULT_PERSIST,
+    ):
+        self.supabase_client = supabase_client if persist else None
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # message_id -> (expires_at, user_id, session_id, response)
+        self._entries: "OrderedDict[str, tuple[float, str, str, dict]]" = OrderedDict()
+
+    async def get(self, user_id: str, session_id: str, message_id: str) -> Optional[dict]:
+        """Return the stored response for this message of this user and session, or None."""
+        entry = self._entries.get(message_id)
+        if entry is not None:
+            expires_at, owner, session, response = entry
+            if expires_at < time.monotonic():
+                del self._entries[message_id]
+            elif (owner, session) == (user_id, session_id):
+                self._entries.move_to_end(message_id)
+                turn_result_lookups.inc(result="memory")
+                return response
+
+        response = await self._fetch(user_id, session_id, message_id)
+        if response is not None:
+            self._remember(user_id, session_id, message_id, response)
+            turn_result_lookups.inc(result="database")
+            return response
+        turn_result_lookups.inc(result="miss")
+        return None
+
+    async def put(self, user_id: str, session_id: str, message_id: str, response: dict) -> None:
+        if response.get("error"):
+            return
+        self._remember(user_id, session_id, message_id, response)
+        if self.supabase_client is None:
+            return
+        try:
+            await self.supabase_client.table(self.table).upsert({
+                "message_id": message_id,
+                "user_id": user_id,
+                "session_id": session_id,
+                "response": response,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }).execute()
+        except Exception as e:
+            # The in-memory entry still covers retries that reach this process
+            logger.warning("Could not persist turn result for message_id=%s: %s", message_id, e)
+
+    def _remember(self, user_id: str, session_id: str, message_id: str, response: dict) -> None:
+        self._entries[message_id] = (time.monotonic() + self.ttl, user_id, session_id, response)
+        self._entries.move_to_end(message_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _fetch(self, user_id: str, session_id: str, message_id: str) -> Optional[dict]:
+        if self.supabase_client is None:
+            return None
+        try:
+            result = await self.supabase_client.table(self.table) \
+                .select("response, created_at") \
+                .eq("message_id", message_id) \
+                .eq("user_id", user_id) \
+                .eq("session_id", session_id) \
+                .limit(1) \
+                .execute()
+        except Exception as e:
+            logger.warning("Could not read turn result for message_id=%s: %s", message_id, e)
+            return None
+        rows = result.data or []
+        if not rows:
+            return None
+        created_at = rows[0].get("created_at")
+        if created_at and self.ttl > 0:
+            age = (datetime.now(timezone.utc) - datetime.fromisoformat(created_at)).total_seconds()
+            if age > self.ttl:
+                return None
+        return rows[0].get("response")
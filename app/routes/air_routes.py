@@ -0,0 +1,56 @@
+import logging
+import math
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+
+from ..auth import get_current_user
+from ..startup import get_component
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# The scoring engine (NumPy) is reached through the clients component, so this module stays
+# off the app.main import path like chat_routes.
+
+
+def _score(value) -> Optional[float]:
+    return None if math.isnan(value) else round(float(value), 3)
+
+
+@router.get("/scores/me", response_model=dict, tags=["air"])
+async def get_my_scores(request: Request, user: dict = Depends(get_current_user)):
+    if user["role"] not in ["admin", "authenticated"]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions.")
+    clients = await get_component(request.app, "clients")
+    scores = await clients.air_scores.user_scores(user["user_id"])
+    return {
+        "user_id": user["user_id"],
+        "scores": {category: scores.group_scores(user["user_id"], category).as_dict() for category in ("user", "company")},
+    }
+
+
+@router.get("/companies/{company_id}/scores", response_model=dict, tags=["air"])
+async def get_company_scores(request: Request, company_id: str, user: dict = Depends(get_current_user)):
+    """Company rollup per theme plus each user's overall scores (admin only)."""
+    if user["role"] != "admin":
+        logger.warning("User %s with role %s requested company AIR scores.", user["user_id"], user["role"])
+        raise HTTPException(status_code=403, detail="Insufficient permissions.")
+    clients = await get_component(request.app, "clients")
+    scores = await clients.air_scores.company_scores(company_id)
+
+    user_score, _, user_facts = scores.scores("user")
+    company_score, _, company_facts = scores.scores("company")
+    return {
+        "company_id": company_id,
+        "scores": {category: scores.total(category).as_dict() for category in ("user", "company")},
+        "users": [
+            {
+                "user_id": user_id,
+                "user": _score(user_score[i, -1]),
+                "company": _score(company_score[i, -1]),
+                "facts": int(user_facts[i, -1] + company_facts[i, -1]),
+            }
+            for i, user_id in enumerate(scores.groups)
+        ],
+    }
@@ -5,7 +5,6 @@ from pydantic import BaseModel
 from ..auth import validate_supabase_token, create_fastapi_token
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 router = APIRouter()
 
 class TokenResponse(BaseModel):
@@ -27,8 +26,8 @@ def get_fastapi_token(authorization: str = Header(None)):
     user_id = user_info["user_id"]
     role = user_info["role"]
 
-    logger.debug(f"Generating FastAPI token for user_id={user_id}, role={role}")
+    logger.debug("Generating FastAPI token for user_id=%s, role=%s", user_id, role)
     fastapi_token = create_fastapi_token(user_id, role)
-    logger.info(f"Generated FastAPI token for user_id={user_id}, role={role}")
+    logger.info("Generated FastAPI token for user_id=%s, role=%s", user_id, role)
 
     return TokenResponse(access_token=fastapi_token)
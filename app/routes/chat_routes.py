@@ -1,19 +1,38 @@
+from __future__ import annotations
 import logging
-from fastapi import APIRouter, Depends, Request
-from ..auth import get_current_user
-from ..orchestration import run_multi_agent_workflow
-from pydantic_ai.exceptions import ModelHTTPError
-from supabase._async.client import AsyncClient as AsyncSupabase
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from ..auth import decode_fastapi_token, get_current_user
+from ..startup import get_component
+from ..coalescing import turn_flight, session_locks
+from ..admission import chat_admission, AdmissionRejected
+from ..metrics import registry
+from ..prescreen import PreScreenBlocked
+from ..profiling import PROFILE_HEADER, ProfilerBusy, run_profiled
 import asyncio
-import threading
+import base64
+import os
 from ..classes import MultiAgentState, InputMessage, OutputMessage
 
+# The orchestration module (agents, pydantic-ai) and the SDKs are loaded by the lifespan as
+# lazy components; importing them here would put them back on the app.main import path.
+if TYPE_CHECKING:
+    from supabase._async.client import AsyncClient as AsyncSupabase
+
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+CONTENT_FILTER_MESSAGE = "Sorry, this prompt was filtered due to our content management policy. Please modify your input and try again."
+
+# How often send_message checks whether its client is still connected
+CHAT_DISCONNECT_POLL_SECONDS = float(os.getenv("CHAT_DISCONNECT_POLL_SECONDS", "0.5"))
+
+client_disconnects = registry.counter(
+    "chat_client_disconnects_total", "send_message requests whose client disconnected before the response",
+)
+
 
 async def store_chat_messages(supabase_client: AsyncSupabase, run_info: MultiAgentState, user_id: str, session_id: str):
     chat_records = []
@@ -57,7 +76,7 @@ async def store_chat_messages(supabase_client: AsyncSupabase, run_info: MultiAge
         await supabase_client.from_("chat_messages").insert(chat_records).execute()
 
 
-async def store_info_messages(supabase_client: AsyncSupabase, run_info: MultiAgentState, user_id: str, payload):
+async def store_info_messages(supabase_client: AsyncSupabase, run_info: MultiAgentState, user_id: str, payload, air_scores=None):
     info_records = []
 
     async def update_user_info(column: str, new_content: str):
@@ -95,6 +114,11 @@ async def store_info_messages(supabase_client: AsyncSupabase, run_info: MultiAge
     if info_records:
         await supabase_client.from_("info_messages").insert(info_records).execute()
 
+        # Keep cached AIR scores of this user (and their company) current
+        if air_scores is not None:
+            for record in info_records:
+                air_scores.record(user_id, record["category"], record["content_dict"], record["created_at"])
+
 async def update_session_info(supabase_client, finalstate, session_id: str) -> None:
     """
     Update the 'finished' boolean in the 'chat_sessions' table for the given session.
@@ -131,73 +155,291 @@ async def update_session_info(supabase_client, finalstate, session_id: str) -> N
         
 
 @router.post("/send_message", response_model=dict, tags=["chat"])
-async def send_message(request: Request, payload: InputMessage, user: dict = Depends(get_current_user)):
-    # For diagnostics: log current thread and event loop details.
-    current_thread = threading.current_thread().name
-    try:
-        current_loop = asyncio.get_running_loop()
-    except RuntimeError:
-        current_loop = None
-
-    logger.info(f"send_message called on thread: {current_thread}, current_loop: {current_loop}")
-
+async def send_message(request: Request, response: Response, payload: InputMessage, user: dict = Depends(get_current_user)):
     user_id = user["user_id"]
     role = user["role"]
 
     # Check user permissions.
     if role not in ["admin", "authenticated"]:
-        logger.warning(f"User {user_id} with role {role} attempted unauthorized access.")
+        logger.warning("User %s with role %s attempted unauthorized access.", user_id, role)
         return {
             "error": True,
             "response": "Insufficient permissions.",
             "session_id": payload.session_id
         }
 
-    # Retrieve the clients container from app.state.
-    clients = request.app.state.clients
+    # Retrieve the clients container and the agent workflow (loaded by the lifespan;
+    # awaiting them here only blocks while a background warm-up is still running).
+    clients = await get_component(request.app, "clients")
+    orchestration = await get_component(request.app, "orchestration")
+
+    # Duplicate sends of the same message share one pipeline run; the user is part of the key
+    # so nobody can join another user's run by reusing its ids.
+    key = (user_id, payload.session_id, payload.message_id)
+    try:
+        # If the client goes away first, the run is cancelled (unless a duplicate send still
+        # waits for it); the graph's checkpoints let a resend resume where it stopped.
+        work = _until_disconnected(
+            request,
+            turn_flight.do(key, lambda: _process_turn(clients, orchestration, user_id, payload), cancel_when_abandoned=True),
+        )
+        # Admins can run this one request under a profiler (see profiling.py)
+        profile_mode = request.headers.get(PROFILE_HEADER)
+        if profile_mode is None:
+            return await work
+        if role != "admin":
+            logger.warning("User %s with role %s sent %s; ignored.", user_id, role, PROFILE_HEADER)
+            return await work
+        try:
+            result, profile_id = await run_profiled(
+                work, profile_mode, label=f"send_message session_id={payload.session_id} message_id={payload.message_id}",
+                user_id=user_id, scope=request.scope,
+            )
+        except ProfilerBusy:
+            response.headers["X-Profile-Error"] = "busy"
+            return await work
+        if profile_id is not None:
+            response.headers["X-Profile-Id"] = profile_id
+        return result
+    except ClientDisconnected:
+        client_disconnects.inc()
+        logger.info("Client disconnected before the response for user_id=%s, session_id=%s", user_id, payload.session_id)
+        # Nobody reads this; 499 is what the access logs and proxies use for "client closed request"
+        return Response(status_code=499)
+    except AdmissionRejected as shed:
+        raise HTTPException(
+            status_code=shed.status_code,
+            detail="The server is busy, please retry shortly." if shed.status_code == 503 else "Too many messages in progress.",
+            headers={"Retry-After": str(shed.retry_after)},
+        )
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away before its response was ready."""
 
-    Fritsmessage = None
-    finalstate = None
-    error_occurred = False
 
+async def _until_disconnected(request: Request, awaitable: Awaitable):
+    """
+    Await `awaitable` while polling the connection; when the client disconnects first, the
+    awaitable is cancelled and ClientDisconnected is raised.
+    """
+    work = asyncio.ensure_future(awaitable)
     try:
-        logger.info(f"Calling multi-agent workflow for user_id={user['user_id']}, session_id={payload.session_id}")
-        result = await run_multi_agent_workflow(clients, user_id, payload)
-        if isinstance(result, tuple):
-            result = result[0]
-        finalstate = result.state
-        Fritsmessage = finalstate.writer_response.content
-        logger.info("Multi-agent workflow completed successfully.")
-        
-    except ModelHTTPError as err:
-        # Use the "error" key if it exists, otherwise use err.body directly.
-        error_data = err.body.get("error") or err.body
-        if error_data.get("code") == "content_filter":
-            Fritsmessage = "Sorry, this prompt was filtered due to our content management policy. Please modify your input and try again."
+        while True:
+            done, _ = await asyncio.wait({work}, timeout=CHAT_DISCONNECT_POLL_SECONDS)
+            if done:
+                return work.result()
+            if await request.is_disconnected():
+                work.cancel()
+                try:
+                    await work
+                except asyncio.CancelledError:
+                    pass
+                raise ClientDisconnected()
+    finally:
+        # Our own cancellation (e.g. shutdown) goes to the work as well
+        if not work.done():
+            work.cancel()
+
+
+async def _process_turn(clients, orchestration, user_id: str, payload: InputMessage, run: Optional[Callable[[], Awaitable]] = None) -> dict:
+    """
+    Run the multi-agent workflow for one message and store its results. Turns of the same
+    session are serialised, so a turn only starts once the previous one has been persisted.
+    `run` replaces the default workflow call (the WebSocket endpoint runs resident turns).
+    """
+    from pydantic_ai.exceptions import ModelHTTPError
+
+    # A retry of a message that was already answered gets the stored response back
+    turn_results = getattr(clients, "turn_results", None)
+    if turn_results is not None:
+        stored = await turn_results.get(user_id, payload.session_id, payload.message_id)
+        if stored is not None:
+            logger.info("Returning stored result for message_id=%s, session_id=%s", payload.message_id, payload.session_id)
+            return stored
+
+    # Wait for the previous turn of this session first, so a queued turn doesn't hold an
+    # admission slot while it can't run anyway.
+    async with session_locks.hold(payload.session_id), chat_admission.admit(user_id):
+        Fritsmessage = None
+        finalstate = None
+        error_occurred = False
+
+        try:
+            logger.info("Calling multi-agent workflow for user_id=%s, session_id=%s", user_id, payload.session_id)
+            result = await (run() if run is not None else orchestration.run_multi_agent_workflow(clients, user_id, payload))
+            if isinstance(result, tuple):
+                result = result[0]
+            finalstate = result.state
+            Fritsmessage = finalstate.writer_response.content
+            logger.info("Multi-agent workflow completed successfully.")
+            
+        except PreScreenBlocked as blocked:
+            # Answered like Azure's content filter would, without any model call
+            Fritsmessage = CONTENT_FILTER_MESSAGE
             error_occurred = True
-            logger.error("Content policy violation detected. Returning error: %s", Fritsmessage)
-        else:
+            logger.info("Message %s blocked by pre-screen rule %s", payload.message_id, blocked.rule)
+        except ModelHTTPError as err:
+            # Use the "error" key if it exists, otherwise use err.body directly.
+            error_data = err.body.get("error") or err.body
+            if error_data.get("code") == "content_filter":
+                Fritsmessage = CONTENT_FILTER_MESSAGE
+                error_occurred = True
+                logger.error("Content policy violation detected. Returning error: %s", Fritsmessage)
+            else:
+                Fritsmessage = "An error occurred while processing your request."
+                error_occurred = True
+                logger.error("ModelHTTPError in multi-agent workflow: %s", err, exc_info=True)
+        except Exception as e:
+            logger.error("Error in multi-agent workflow: %s", e, exc_info=True)
             Fritsmessage = "An error occurred while processing your request."
             error_occurred = True
-            logger.error("ModelHTTPError in multi-agent workflow: %s", err, exc_info=True)
-    except Exception as e:
-        logger.error("Error in multi-agent workflow: %s", e, exc_info=True)
-        Fritsmessage = "An error occurred while processing your request."
-        error_occurred = True
 
-    if finalstate:
-        await store_chat_messages(clients.supabase_client, finalstate, user_id, payload.session_id)
-        await store_info_messages(clients.supabase_client, finalstate, user_id, payload)
-        
-        if finalstate.session_finished:
-            logger.info("Session finished; updating session_info in Supabase")
-            await update_session_info(clients.supabase_client, finalstate, payload.session_id)
+        response = {
+            "error": error_occurred,
+            "response": Fritsmessage,
+            "session_id": payload.session_id
+        }
+
+        async def persist_turn() -> None:
+            if finalstate:
+                await store_chat_messages(clients.supabase_client, finalstate, user_id, payload.session_id)
+                await store_info_messages(clients.supabase_client, finalstate, user_id, payload, getattr(clients, "air_scores", None))
+
+                if finalstate.session_finished:
+                    logger.info("Session finished; updating session_info in Supabase")
+                    await update_session_info(clients.supabase_client, finalstate, payload.session_id)
+
+            if turn_results is not None and finalstate and not error_occurred:
+                await turn_results.put(user_id, payload.session_id, payload.message_id, response)
+
+        # The graph's checkpoints are gone once it has finished, so a disconnect must not cut the
+        # storing short: a resend would run every LLM call again and store a second set of
+        # messages next to the half-written one. Only the graph run itself is cancellable.
+        persisting = asyncio.ensure_future(persist_turn())
+        try:
+            await asyncio.shield(persisting)
+        except asyncio.CancelledError:
+            await persisting
+            raise
     
-    logger.info(f"Processed message for user_id={user_id}, session_id={payload.session_id}")
-    logger.info("Returning error: %s, message: %s", error_occurred, Fritsmessage)
-
-    return {
-        "error": error_occurred,
-        "response": Fritsmessage,
-        "session_id": payload.session_id
-    }
\ No newline at end of file
+    logger.info("Processed message for user_id=%s, session_id=%s", user_id, payload.session_id)
+    logger.info("Returning error: %s", error_occurred)
+    logger.debug("Response for message_id=%s: %s", payload.message_id, Fritsmessage)
+
+    return response
+
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket, session_id: str, token: Optional[str] = None):
+    """
+    Chat over one WebSocket per session. The client authenticates once (Authorization header
+    or ?token=), the session's profile, history and phase prompt stay resident for the life
+    of the connection, and the writer's answer is streamed back.
+
+    Client frames:  {"type": "message", "message_id": ...}   {"type": "ping"}
+    Server frames:  {"type": "ready"}  {"type": "delta", "message_id", "text"}
+                    {"type": "audio", "message_id", "sentence", "text", "format", "data"}
+                    {"type": "response", "message_id", "error", "response", "session_id"}
+                    {"type": "error", "message_id", "status", "detail", "retry_after"}  {"type": "pong"}
+    The message must already be stored in this session; it is read from the table.
+    Users with TTS_flag get "audio" frames (base64 "data" of the "format" media type) for each
+    sentence while the reply is written; all of them arrive before the "response" frame.
+    """
+    authorization = websocket.headers.get("authorization", "")
+    try:
+        user = decode_fastapi_token(token or authorization.removeprefix("Bearer ").strip())
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+    user_id = user["user_id"]
+    if user["role"] not in ["admin", "authenticated"]:
+        logger.warning("User %s with role %s attempted unauthorized websocket access.", user_id, user["role"])
+        await websocket.close(code=1008, reason="Insufficient permissions.")
+        return
+
+    await websocket.accept()
+    clients = await get_component(websocket.app, "clients")
+    orchestration = await get_component(websocket.app, "orchestration")
+    session = await _open_session(websocket, clients, orchestration, user_id, session_id)
+    if session is None:
+        return
+    await websocket.send_json({"type": "ready", "session_id": session_id})
+    logger.info("WebSocket session opened for user_id=%s, session_id=%s", user_id, session_id)
+
+    try:
+        while True:
+            try:
+                frame = await websocket.receive_json()
+            except ValueError:
+                frame = None
+            if not isinstance(frame, dict):
+                await websocket.send_json({"type": "error", "status": 400, "detail": "Frames must be JSON objects."})
+                continue
+            if frame.get("type") == "ping":
+                await websocket.send_json({"type": "pong"})
+                continue
+            message_id = frame.get("message_id")
+            if frame.get("type") != "message" or not message_id:
+                await websocket.send_json({"type": "error", "status": 400, "detail": "Expected a message frame with a message_id."})
+                continue
+
+            async def stream(text: str, message_id=message_id):
+                await websocket.send_json({"type": "delta", "message_id": message_id, "text": text})
+
+            async def speak(sentence: int, text: str, data: bytes, media_type: str, message_id=message_id):
+                await websocket.send_json({
+                    "type": "audio", "message_id": message_id, "sentence": sentence, "text": text,
+                    "format": media_type, "data": base64.b64encode(data).decode(),
+                })
+
+            payload = InputMessage(message_id=message_id, session_id=session_id)
+            turns = session.turns
+            run = lambda: orchestration.run_resident_turn(clients, session, message_id, stream, speak)
+            try:
+                response = await turn_flight.do(
+                    (user_id, session_id, message_id),
+                    lambda: _process_turn(clients, orchestration, user_id, payload, run),
+                )
+            except AdmissionRejected as shed:
+                await websocket.send_json({
+                    "type": "error", "message_id": message_id, "status": shed.status_code,
+                    "detail": "The server is busy, please retry shortly." if shed.status_code == 503 else "Too many messages in progress.",
+                    "retry_after": shed.retry_after,
+                })
+                continue
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # e.g. storing the turn failed; the resident data may now differ from the tables
+                logger.error("WebSocket turn failed for message_id=%s, session_id=%s: %s", message_id, session_id, e, exc_info=True)
+                await websocket.send_json({
+                    "type": "error", "message_id": message_id, "status": 500,
+                    "detail": "An error occurred while processing your request.",
+                })
+                session = await _open_session(websocket, clients, orchestration, user_id, session_id)
+                if session is None:
+                    return
+                continue
+            await websocket.send_json({"type": "response", "message_id": message_id, **response})
+            if session.turns == turns and not response.get("error"):
+                # Answered without a resident run (stored result, or joined a POST of the same
+                # message), so the resident history misses this turn
+                session = await _open_session(websocket, clients, orchestration, user_id, session_id)
+                if session is None:
+                    return
+    except WebSocketDisconnect:
+        logger.info("WebSocket session closed for user_id=%s, session_id=%s after %d turns", user_id, session_id, session.turns)
+
+
+async def _open_session(websocket: WebSocket, clients, orchestration, user_id: str, session_id: str):
+    """Load (or reload) the resident session; on failure the socket is closed and None returned."""
+    try:
+        return await orchestration.load_session(clients, user_id, session_id)
+    except orchestration.SessionNotFound:
+        logger.warning("User %s opened a WebSocket for session %s, which is not theirs.", user_id, session_id)
+        await websocket.close(code=1008, reason="Unknown session.")
+    except Exception as e:
+        logger.error("Could not load session %s for the WebSocket: %s", session_id, e, exc_info=True)
+        await websocket.close(code=1011, reason="Could not load the session.")
+    return None
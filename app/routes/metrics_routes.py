@@ -0,0 +1,19 @@
+import os
+import logging
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from ..metrics import registry
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# Optional shared secret for scrapers; unset keeps /metrics open (cluster-internal scraping).
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+@router.get("/metrics", response_class=PlainTextResponse, tags=["monitoring"])
+def get_metrics(authorization: str = Header(None)):
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
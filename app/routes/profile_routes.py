@@ -0,0 +1,39 @@
+import logging
+from dataclasses import asdict
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+
+from ..auth import get_current_user
+from ..profiling import MODES, list_profiles, profile_file
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# Profiles of single send_message calls, recorded when an admin sends X-Profile-Request
+# (see profiling.py).
+
+
+def _require_admin(user: dict) -> None:
+    if user["role"] != "admin":
+        logger.warning("User %s with role %s requested request profiles.", user["user_id"], user["role"])
+        raise HTTPException(status_code=403, detail="Insufficient permissions.")
+
+
+@router.get("/profiles", response_model=list, tags=["admin"])
+async def get_profiles(user: dict = Depends(get_current_user)):
+    """Stored profiles, newest first (admin only)."""
+    _require_admin(user)
+    return [asdict(info) for info in list_profiles()]
+
+
+@router.get("/profiles/{profile_id}", tags=["admin"])
+async def download_profile(profile_id: str, user: dict = Depends(get_current_user)):
+    """Download one profile: collapsed stacks (sample) or a pstats file (cprofile)."""
+    _require_admin(user)
+    found = profile_file(profile_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    path, info = found
+    media_type = "text/plain" if info.mode == "sample" else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=f"profile-{profile_id}.{MODES[info.mode]}")
@@ -0,0 +1,109 @@
+# startup.py
+# Startup timing and lazily loaded application components.
+#
+# app.main only imports what is needed to build the FastAPI app. The heavy parts (agent
+# modules with their prompt strings, pydantic-ai, the openai/supabase SDKs, the RAG index)
+# are components that the lifespan starts concurrently. With STARTUP_BACKGROUND_WARMUP=1
+# the server accepts traffic before they finish; requests that need a component await it
+# and /ready reports 503 until everything is loaded.
+import asyncio
+import importlib
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+STARTUP_BACKGROUND_WARMUP = os.getenv("STARTUP_BACKGROUND_WARMUP", "0") == "1"
+
+
+class StartupProfile:
+    """Records named startup phases relative to the moment this module was imported."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: list[tuple[str, float, float]] = []  # (name, offset_s, duration_s)
+        self.ready_at: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start - self.started, time.perf_counter() - start))
+
+    def record(self, name: str, offset: float, duration: float) -> None:
+        self.phases.append((name, offset, duration))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def mark_ready(self) -> None:
+        if self.ready_at is None:
+            self.ready_at = self.elapsed()
+
+    def as_dict(self) -> dict:
+        return {
+            "phases": [
+                {"name": name, "offset_ms": round(offset * 1000, 1), "duration_ms": round(duration * 1000, 1)}
+                for name, offset, duration in self.phases
+            ],
+            "time_to_ready_ms": round(self.ready_at * 1000, 1) if self.ready_at is not None else None,
+        }
+
+    def report(self) -> str:
+        lines = [f"{name:<32} +{offset * 1000:8.1f} ms  {duration * 1000:8.1f} ms" for name, offset, duration in self.phases]
+        if self.ready_at is not None:
+            lines.append(f"{'ready':<32} +{self.ready_at * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+startup_profile = StartupProfile()
+
+
+class LazyComponent:
+    """
+    A named piece of the application that is loaded once, in the background, on first
+    start() or get(). Loaders are async callables; sync work should use asyncio.to_thread.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Awaitable[Any]]):
+        self.name = name
+        self._loader = loader
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        if self._task is None:
+            self._task = asyncio.create_task(self._load(), name=f"load:{self.name}")
+        return self._task
+
+    async def _load(self) -> Any:
+        with startup_profile.phase(f"component:{self.name}"):
+            return await self._loader()
+
+    @property
+    def ready(self) -> bool:
+        return self._task is not None and self._task.done() and not self._task.cancelled() and self._task.exception() is None
+
+    async def get(self) -> Any:
+        return await asyncio.shield(self.start())
+
+
+def import_module_component(module_name: str) -> Callable[[], Awaitable[Any]]:
+    """Loader that imports a module in a worker thread so the event loop keeps serving."""
+    async def load():
+        return await asyncio.to_thread(importlib.import_module, module_name)
+    return load
+
+
+async def get_component(app, name: str) -> Any:
+    """Await a component registered on app.state.components by the lifespan."""
+    return await app.state.components[name].get()
+
+
+def components_ready(app) -> dict[str, bool]:
+    components = getattr(app.state, "components", {})
+    return {name: component.ready for name, component in components.items()}
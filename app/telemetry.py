@@ -0,0 +1,73 @@
+# telemetry.py
+# logfire / OpenTelemetry setup: what gets captured and how much of it is kept.
+#
+# TELEMETRY_CAPTURE picks how much payload goes into spans:
+#   none    spans and timings only, no HTTP bodies or headers
+#   capped  (default) HTTP request/response bodies and agent messages, every attribute
+#           value cut at TELEMETRY_MAX_ATTRIBUTE_CHARS characters
+#   full    everything, uncut, including HTTP headers (debugging only, off by default)
+#
+# Sampling is tail-based: traces with an error or that take longer than
+# TELEMETRY_SLOW_TRACE_SECONDS are always kept, the rest with probability
+# TELEMETRY_SAMPLE_RATE. TELEMETRY_HEAD_SAMPLE_RATE < 1 additionally drops traces when they
+# start, before any payload is serialised (cheapest, but those traces are gone even if slow).
+# See benchmarks/bench_telemetry.py for the overhead of each setting.
+import os
+import logging
+
+import logfire
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_CAPTURE = os.getenv("TELEMETRY_CAPTURE", "capped")
+TELEMETRY_MAX_ATTRIBUTE_CHARS = int(os.getenv("TELEMETRY_MAX_ATTRIBUTE_CHARS", "2048"))
+TELEMETRY_SAMPLE_RATE = float(os.getenv("TELEMETRY_SAMPLE_RATE", "0.1"))
+TELEMETRY_HEAD_SAMPLE_RATE = float(os.getenv("TELEMETRY_HEAD_SAMPLE_RATE", "1.0"))
+TELEMETRY_SLOW_TRACE_SECONDS = float(os.getenv("TELEMETRY_SLOW_TRACE_SECONDS", "5"))
+TELEMETRY_SCRUBBING = os.getenv("TELEMETRY_SCRUBBING", "0") == "1"
+
+CAPTURE_MODES = ("none", "capped", "full")
+if TELEMETRY_CAPTURE not in CAPTURE_MODES:
+    logger.warning("Unknown TELEMETRY_CAPTURE=%r, using 'capped'", TELEMETRY_CAPTURE)
+    TELEMETRY_CAPTURE = "capped"
+
+
+def sampling_options() -> logfire.SamplingOptions:
+    if TELEMETRY_SAMPLE_RATE >= 1.0:
+        return logfire.SamplingOptions(head=TELEMETRY_HEAD_SAMPLE_RATE)
+    return logfire.SamplingOptions.level_or_duration(
+        head=TELEMETRY_HEAD_SAMPLE_RATE,
+        level_threshold="error",
+        duration_threshold=TELEMETRY_SLOW_TRACE_SECONDS,
+        background_rate=TELEMETRY_SAMPLE_RATE,
+    )
+
+
+def configure_telemetry(**overrides) -> None:
+    """Call once, before any span is created (the tracer provider reads the limits then)."""
+    if TELEMETRY_CAPTURE != "full":
+        # The OTel SDK truncates string attribute values at this length when they are set
+        os.environ.setdefault("OTEL_ATTRIBUTE_VALUE_LENGTH_LIMIT", str(TELEMETRY_MAX_ATTRIBUTE_CHARS))
+    options = dict(
+        token=os.getenv("LOGFIRE_TOKEN"),
+        scrubbing=None if TELEMETRY_SCRUBBING else False,
+        sampling=sampling_options(),
+    )
+    options.update(overrides)
+    logfire.configure(**options)
+
+
+def instrument_app(app) -> None:
+    """Instrument the FastAPI app; adds middleware, so it must run before the app starts."""
+    logfire.instrument_fastapi(app, capture_headers=TELEMETRY_CAPTURE == "full")
+
+
+def instrument_clients() -> None:
+    """Instrument outgoing HTTP calls and the pydantic-ai agents."""
+    if TELEMETRY_CAPTURE == "full":
+        logfire.instrument_httpx(capture_all=True)
+    elif TELEMETRY_CAPTURE == "capped":
+        logfire.instrument_httpx(capture_request_body=True, capture_response_body=True)
+    else:
+        logfire.instrument_httpx()
+    logfire.instrument_pydantic_ai()
@@ -0,0 +1,245 @@
+# tts.py
+# Streaming text-to-speech for users with TTS_flag set. The writer's text deltas are cut into
+# sentences as they arrive (SentenceChunker) and each sentence is synthesised while the writer
+# keeps generating (SpeechStream), so the first audio reaches the client after one sentence
+# instead of after the whole reply. AudioNode in orchestration.py waits for the last sentence.
+#
+# Backends (TTS_BACKEND, default "azure" when AZURE_SPEECH_KEY is set, otherwise "none"):
+#   azure   Azure AI Speech REST API (AZURE_SPEECH_REGION, TTS_VOICE, TTS_OUTPUT_FORMAT); the
+#           audio is passed on as the response body streams in
+#   stub    silent WAV of roughly the spoken length, for local runs and tests
+#   none    no audio; TTS_flag users get the text only
+# Any object with `media_type` and an async-generator `synthesize(text)` can be passed instead.
+import asyncio
+import io
+import logging
+import os
+import re
+import time
+import wave
+from typing import AsyncIterator, Awaitable, Callable, Optional, Protocol
+from xml.sax.saxutils import escape
+
+import httpx
+
+from .http_pools import HTTP_CONNECT_TIMEOUT, pool_limits, register_pool
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+AZURE_SPEECH_KEY = os.getenv("AZURE_SPEECH_KEY", "")
+AZURE_SPEECH_REGION = os.getenv("AZURE_SPEECH_REGION", "westeurope")
+TTS_BACKEND = os.getenv("TTS_BACKEND", "azure" if AZURE_SPEECH_KEY else "none")
+TTS_VOICE = os.getenv("TTS_VOICE", "en-US-AvaMultilingualNeural")
+TTS_OUTPUT_FORMAT = os.getenv("TTS_OUTPUT_FORMAT", "audio-24khz-48kbitrate-mono-mp3")
+TTS_HTTP_TIMEOUT = float(os.getenv("TTS_HTTP_TIMEOUT", "30"))
+# Sentences shorter than this are merged with the next one; text without a sentence end is
+# cut at a comma or space once it grows past the maximum
+TTS_MIN_CHUNK_CHARS = int(os.getenv("TTS_MIN_CHUNK_CHARS", "20"))
+TTS_MAX_CHUNK_CHARS = int(os.getenv("TTS_MAX_CHUNK_CHARS", "300"))
+
+tts_chunks = registry.counter("tts_chunks_total", "Sentences synthesised, by backend and outcome", ["backend", "outcome"])
+tts_first_audio = registry.histogram(
+    "tts_first_audio_seconds", "Time from the writer's first text delta to the first audio frame of a reply",
+)
+
+# sentence index, sentence text, audio bytes, media type
+AudioSink = Callable[[int, str, bytes, str], Awaitable[None]]
+
+
+class TTSBackend(Protocol):
+    name: str
+    media_type: str
+
+    def synthesize(self, text: str) -> AsyncIterator[bytes]:
+        ...
+
+
+########################################################################
+# Backends
+########################################################################
+
+def _media_type(output_format: str) -> str:
+    for marker, media_type in (("mp3", "audio/mpeg"), ("riff", "audio/wav"), ("ogg", "audio/ogg"), ("webm", "audio/webm")):
+        if marker in output_format:
+            return media_type
+    return "audio/pcm"
+
+
+class AzureSpeechBackend:
+    name = "azure"
+
+    def __init__(
+        self,
+        key: str = AZURE_SPEECH_KEY,
+        region: str = AZURE_SPEECH_REGION,
+        voice: str = TTS_VOICE,
+        output_format: str = TTS_OUTPUT_FORMAT,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ):
+        self.url = f"https://{region}.tts.speech.microsoft.com/cognitiveservices/v1"
+        self.voice = voice
+        self.output_format = output_format
+        self.media_type = _media_type(output_format)
+        self.headers = {
+            "Ocp-Apim-Subscription-Key": key,
+            "Content-Type": "application/ssml+xml",
+            "X-Microsoft-OutputFormat": output_format,
+            "User-Agent": "frits-backend",
+        }
+        if http_client is None:
+            http_client = httpx.AsyncClient(
+                limits=pool_limits(), timeout=httpx.Timeout(TTS_HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            )
+            register_pool("tts", http_client)
+        self.http_client = http_client
+
+    def _ssml(self, text: str) -> str:
+        return f"<speak version='1.0' xml:lang='en-US'><voice name='{self.voice}'>{escape(text)}</voice></speak>"
+
+    async def synthesize(self, text: str) -> AsyncIterator[bytes]:
+        async with self.http_client.stream("POST", self.url, headers=self.headers, content=self._ssml(text).encode()) as response:
+            response.raise_for_status()
+            async for data in response.aiter_bytes():
+                yield data
+
+
+class StubTTSBackend:
+    """Silent 16 kHz WAV, ~60 ms per word; `delay` simulates the synthesis time."""
+
+    name = "stub"
+    media_type = "audio/wav"
+
+    def __init__(self, delay: float = 0.0, rate: int = 16000):
+        self.delay = delay
+        self.rate = rate
+
+    async def synthesize(self, text: str) -> AsyncIterator[bytes]:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        frames = int(self.rate * 0.06 * max(1, len(text.split())))
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.rate)
+            wav.writeframes(b"\x00\x00" * frames)
+        yield buffer.getvalue()
+
+
+def build_tts_backend() -> Optional[TTSBackend]:
+    if TTS_BACKEND == "azure":
+        if not AZURE_SPEECH_KEY:
+            logger.error("TTS_BACKEND=azure needs AZURE_SPEECH_KEY; text-to-speech is off")
+            return None
+        return AzureSpeechBackend()
+    if TTS_BACKEND == "stub":
+        return StubTTSBackend()
+    if TTS_BACKEND != "none":
+        logger.error("Unknown TTS_BACKEND %r; text-to-speech is off", TTS_BACKEND)
+    return None
+
+
+########################################################################
+# Sentence chunking and the per-reply speech stream
+########################################################################
+
+# A sentence end (optionally followed by closing quotes/brackets) and whitespace, or a line break
+_SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*\s+|\n+")
+_SOFT_BREAK = re.compile(r"[,;:]\s+|\s+")
+
+
+class SentenceChunker:
+    """Turns a stream of text deltas into speakable chunks of at least `min_chars`."""
+
+    def __init__(self, min_chars: int = TTS_MIN_CHUNK_CHARS, max_chars: int = TTS_MAX_CHUNK_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> list[str]:
+        self._buffer += delta
+        chunks = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            if match.end() - start >= self.min_chars:
+                chunks.append(self._buffer[start:match.end()])
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        while len(self._buffer) > self.max_chars:
+            cut = None
+            for match in _SOFT_BREAK.finditer(self._buffer, 0, self.max_chars):
+                cut = match.end()
+            cut = cut or self.max_chars
+            chunks.append(self._buffer[:cut])
+            self._buffer = self._buffer[cut:]
+        return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+    def flush(self) -> list[str]:
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+class SpeechStream:
+    """
+    Speech for one reply: `feed` the writer's deltas as they arrive, then `finish` with the
+    full text. Sentences are synthesised in order by one background task and every audio
+    block goes to `sink`. A backend failure stops the audio but never the text reply.
+    """
+
+    def __init__(self, backend: TTSBackend, sink: AudioSink):
+        self.backend = backend
+        self.sink = sink
+        self._chunker = SentenceChunker()
+        self._queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self._fed = False
+        self._started_at: Optional[float] = None
+
+    def _put(self, sentences: list[str]) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._speak())
+        for sentence in sentences:
+            self._queue.put_nowait(sentence)
+
+    def feed(self, delta: str) -> None:
+        if not delta:
+            return
+        if self._started_at is None:
+            self._started_at = time.perf_counter()
+        self._fed = True
+        self._put(self._chunker.feed(delta))
+
+    async def finish(self, text: str = "") -> None:
+        """Speak what is left; `text` is spoken whole when no deltas were fed (cached or resumed writer output)."""
+        if not self._fed and text:
+            self.feed(text)
+        self._put(self._chunker.flush())
+        self._queue.put_nowait(None)
+        await self._worker
+
+    async def aclose(self) -> None:
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+
+    async def _speak(self) -> None:
+        index = 0
+        while (sentence := await self._queue.get()) is not None:
+            try:
+                async for data in self.backend.synthesize(sentence):
+                    if index == 0 and self._started_at is not None:
+                        tts_first_audio.observe(time.perf_counter() - self._started_at)
+                        self._started_at = None
+                    await self.sink(index, sentence, data, self.backend.media_type)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                tts_chunks.inc(backend=self.backend.name, outcome="error")
+                logger.error("Text-to-speech failed, the rest of the reply is text only: %s", e)
+                return
+            tts_chunks.inc(backend=self.backend.name, outcome="ok")
+            index += 1
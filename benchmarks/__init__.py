@@ -0,0 +1 @@
+# Make benchmarks a package so scripts can run with python -m benchmarks.<name>
\ No newline at end of file
@@ -0,0 +1,153 @@
+# bench_failover.py
+# Agent calls against a degraded Azure region, with and without the endpoint pool in
+# app/failover.py.
+#
+#   python -m benchmarks.bench_failover [--requests 100]
+#
+# Three fake Azure OpenAI endpoints run in-process behind httpx.MockTransport and answer real
+# chat-completion requests from the openai SDK (through OpenAIModel, as in production):
+#
+#   westeurope     the primary; degrades halfway through: 80% 503s and 0.5 s responses
+#   swedencentral  healthy, 60 ms
+#   francecentral  healthy, 120 ms, times out now and then
+#
+# "single" is the previous setup (only the primary, the SDK's default retries); "pool" is
+# FailoverModel over all three with SDK retries off. The table shows successful calls and
+# latency percentiles; the pool run also prints the final breaker state per endpoint.
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+from benchmarks.harness import print_table
+
+ENDPOINTS = {
+    "westeurope": {"latency": 0.08, "errors": 0.0},
+    "swedencentral": {"latency": 0.06, "errors": 0.0},
+    "francecentral": {"latency": 0.12, "errors": 0.05},
+}
+DEGRADED = {"latency": 0.5, "errors": 0.8}
+DEPLOYMENT = "gpt-4o"
+
+
+def _completion() -> dict:
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": DEPLOYMENT,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": "A considered interviewer reply."},
+        }],
+        "usage": {"prompt_tokens": 900, "completion_tokens": 40, "total_tokens": 940},
+    }
+
+
+class FakeRegion:
+    """One fake endpoint; `profile` can be swapped mid-run to inject a fault."""
+
+    def __init__(self, name: str, rng: random.Random):
+        self.name = name
+        self.profile = dict(ENDPOINTS[name])
+        self.rng = rng
+        self.calls = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        await asyncio.sleep(self.profile["latency"] * self.rng.uniform(0.8, 1.2))
+        if self.rng.random() < self.profile["errors"]:
+            if self.name == "francecentral":
+                raise httpx.ReadTimeout("fake timeout", request=request)
+            return httpx.Response(503, json={"error": {"code": "ServiceUnavailable", "message": "degraded"}})
+        return httpx.Response(200, json=_completion())
+
+
+def _transport(regions: dict[str, FakeRegion]) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return await regions[request.url.host.split(".")[0]].handle(request)
+    return httpx.MockTransport(handler)
+
+
+async def _run(mode: str, requests: int, seed: int) -> tuple[list, dict]:
+    from openai import AsyncAzureOpenAI
+    from pydantic_ai import Agent
+    from pydantic_ai.models.openai import OpenAIModel
+
+    from app import failover
+
+    rng = random.Random(seed)
+    regions = {name: FakeRegion(name, rng) for name in ENDPOINTS}
+    http = httpx.AsyncClient(transport=_transport(regions))
+
+    def client(name: str, **kwargs) -> AsyncAzureOpenAI:
+        return AsyncAzureOpenAI(
+            azure_endpoint=f"https://{name}.openai.azure.com", api_version="2024-10-21", api_key="fake",
+            http_client=http, **kwargs,
+        )
+
+    if mode == "single":
+        model = OpenAIModel(model_name=DEPLOYMENT, openai_client=client("westeurope"))
+    else:
+        failover._health.clear()
+        model = failover.FailoverModel([
+            failover.PoolMember(name, OpenAIModel(model_name=DEPLOYMENT, openai_client=client(name, max_retries=0)),
+                                failover.endpoint_health(name, DEPLOYMENT))
+            for name in ENDPOINTS
+        ])
+    agent = Agent(model=model)
+
+    results = []
+    for index in range(requests):
+        if index == requests // 2:
+            regions["westeurope"].profile = dict(DEGRADED)
+        start = time.perf_counter()
+        try:
+            await agent.run("Ask the next interview question.")
+            ok = True
+        except Exception:
+            ok = False
+        results.append((ok, time.perf_counter() - start))
+    await http.aclose()
+    breakers = {name: (h.state, h.latency, h.error_rate) for (name, _), h in failover._health.items()} if mode == "pool" else {}
+    return results, {"calls": {name: region.calls for name, region in regions.items()}, "breakers": breakers}
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Azure endpoint failover benchmark")
+    parser.add_argument("--requests", type=int, default=100, help="agent calls per mode")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    rows = []
+    for mode in ("single", "pool"):
+        results, info = asyncio.run(_run(mode, args.requests, args.seed))
+        latencies = [seconds * 1000 for ok, seconds in results if ok]
+        rows.append([
+            mode,
+            sum(ok for ok, _ in results),
+            len(results),
+            _percentile(latencies, 0.5),
+            _percentile(latencies, 0.95),
+            json.dumps(info["calls"]),
+        ])
+        for name, (state, latency, error_rate) in info["breakers"].items():
+            print(f"{mode}: {name} breaker={state} latency={(latency or 0) * 1000:.0f} ms error_rate={error_rate:.2f}")
+    print_table(
+        f"{args.requests} agent calls, primary region degraded after {args.requests // 2}",
+        ["mode", "ok", "calls", "p50 ms", "p95 ms", "HTTP requests per region"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
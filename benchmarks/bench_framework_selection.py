@@ -0,0 +1,66 @@
+# bench_framework_selection.py
+# Size of the Meta Agent's static system prompt with the full promptconfig texts versus the
+# phase/theme-filtered selection, plus the CPU cost of making the selection.
+#
+#   python -m benchmarks.bench_framework_selection
+#
+# Token counts use tiktoken's o200k_base encoding when it is installed and fall back to the
+# usual ~4 characters per token estimate otherwise. Prefill time on Azure scales roughly
+# linearly with input tokens, so the token reduction is the expected latency reduction for
+# this part of the prompt.
+from app.Meta_Agent.internal_logic_MA import system_prompt
+from app.framework_selector import THEMES, select_framework_context
+from benchmarks.harness import print_table, time_call
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text))
+    TOKENIZER = "tiktoken o200k_base"
+except ImportError:
+    def count_tokens(text: str) -> int:
+        return len(text) // 4
+    TOKENIZER = "chars / 4 estimate"
+
+ALL_THEMES = list(THEMES)
+
+SCENARIOS = [
+    ("unknown phase (full)", "", []),
+    ("introduction", "Current phase: Introduction", []),
+    ("theme identification", "Current phase: Theme Identification", []),
+    ("deep dive, 1 theme", "Current phase: Deep Dive", ALL_THEMES[1:2]),
+    ("deep dive, 3 themes", "Current phase: Deep Dive", ALL_THEMES[:3]),
+    ("summary, 2 themes", "Current phase: Summary", ALL_THEMES[2:4]),
+    ("recommendation, all", "Current phase: Recommendation", ALL_THEMES),
+]
+
+
+def main() -> None:
+    full_prompt = system_prompt()
+    full_tokens = count_tokens(full_prompt)
+
+    rows = []
+    for name, phase_indicator, themes in SCENARIOS:
+        selection = select_framework_context(phase_indicator, themes)
+        prompt = system_prompt(selection.topic_info, selection.framework_info_company, selection.framework_themes_company)
+        tokens = count_tokens(prompt)
+        timing = time_call(name, lambda: select_framework_context(phase_indicator, themes), number=2000)
+        rows.append([
+            name,
+            len(prompt),
+            tokens,
+            f"{100 * (1 - tokens / full_tokens):.1f}%",
+            timing.best_us,
+        ])
+
+    print_table(
+        f"Meta Agent static system prompt ({TOKENIZER})",
+        ["scenario", "chars", "tokens", "token reduction", "selection us"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
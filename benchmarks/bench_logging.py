@@ -0,0 +1,121 @@
+# bench_logging.py
+# Event-loop time spent in logging per chat turn, with the previous setup and with the queued
+# pipeline in app/logging_config.py.
+#
+#   python -m benchmarks.bench_logging [--turns 500] [--sink-latency-us 200]
+#
+# A simulated turn logs what one /chat call logs: a handful of INFO lines from the routes and
+# orchestration and the Update agent's DEBUG lines with a full agent result (~3 KB repr).
+#
+#   before  basicConfig(level=DEBUG) as the agent modules set it at import, f-string messages,
+#           a StreamHandler writing on the calling thread
+#   after   configure_logging(): INFO, %-style arguments, JSON written by the listener thread
+#
+# Each setup runs against a file and against a "slow" sink that takes --sink-latency-us per
+# write, standing in for a stderr pipe the log collector isn't draining fast enough. The table
+# shows the time the coroutine spends inside logging calls; the writer thread's time isn't on
+# the event loop and isn't counted.
+import argparse
+import asyncio
+import io
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.harness import print_table
+
+RESULT = {"data": "[Company topic Info] " + "The team runs weekly planning with a shared backlog. " * 60, "usage": {"requests": 1, "total_tokens": 2400}}
+
+
+class SlowSink(io.StringIO):
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+
+    def write(self, text: str) -> int:
+        end = time.perf_counter() + self.latency
+        while time.perf_counter() < end:
+            pass
+        return len(text)
+
+
+def _before(stream) -> None:
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    logging.basicConfig(level=logging.DEBUG, stream=stream, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+
+async def _turn_before(log: logging.Logger, index: int) -> None:
+    log.info(f"send_message called on thread: MainThread, current_loop: {asyncio.get_running_loop()}")
+    log.info(f"Calling multi-agent workflow for user_id=user-{index}, session_id=session-{index}")
+    for kind in ("company", "user"):
+        log.debug(f"Parsing result for {kind} info: {RESULT}")
+        log.debug(f"Appended CompanyInfoMessage: {RESULT['data']}")
+    log.info("Meta-agent framework selection: phase=%s themes=%s full=%s chars=%d", "deep dive", ["data"], False, 5200)
+    log.info("Reviewer approved the response. Routing to AudioNode.")
+    log.info(f"Processed message for user_id=user-{index}, session_id=session-{index}")
+    log.info(f"Returning error: False, message: {RESULT['data'][:600]}")
+
+
+async def _turn_after(log: logging.Logger, index: int) -> None:
+    log.debug("send_message called on thread: %s, current_loop: %s", "MainThread", asyncio.get_running_loop())
+    log.info("Calling multi-agent workflow for user_id=%s, session_id=%s", f"user-{index}", f"session-{index}")
+    for kind in ("company", "user"):
+        log.debug("Parsing result for %s info: %s", kind, RESULT)
+        log.debug("Appended CompanyInfoMessage: %s", RESULT["data"])
+    log.info("Meta-agent framework selection: phase=%s themes=%s full=%s chars=%d", "deep dive", ["data"], False, 5200)
+    log.info("Reviewer approved the response. Routing to AudioNode.")
+    log.info("Processed message for user_id=%s, session_id=%s", f"user-{index}", f"session-{index}")
+    log.info("Returning error: %s", False)
+    log.debug("Response for message_id=%s: %s", f"m-{index}", RESULT["data"][:600])
+
+
+async def _run(turn, turns: int) -> float:
+    log = logging.getLogger("app.bench")
+    spent = 0.0
+    for index in range(turns):
+        start = time.perf_counter()
+        await turn(log, index)
+        spent += time.perf_counter() - start
+        await asyncio.sleep(0)
+    return spent
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Event-loop time spent in logging")
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--sink-latency-us", type=float, default=200)
+    args = parser.parse_args()
+
+    from app import logging_config
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for sink_name in ("file", "slow sink"):
+            for setup in ("before", "after"):
+                if sink_name == "file":
+                    stream = open(os.path.join(directory, f"{setup}.log"), "w")
+                else:
+                    stream = SlowSink(args.sink_latency_us / 1e6)
+                if setup == "before":
+                    _before(stream)
+                    spent = asyncio.run(_run(_turn_before, args.turns))
+                else:
+                    logging_config.configure_logging(stream=stream, fmt="json", level="INFO", levels="")
+                    spent = asyncio.run(_run(_turn_after, args.turns))
+                    logging_config.stop_logging()
+                dropped = sum(float(line.rsplit(" ", 1)[1]) for line in logging_config.logs_dropped.samples() if not line.startswith("#"))
+                rows.append([sink_name, setup, spent * 1e6 / args.turns, spent * 1e3, int(dropped)])
+                stream.close()
+    logging.getLogger().handlers.clear()
+    print_table(
+        f"Logging on the event loop, {args.turns} simulated turns",
+        ["sink", "setup", "us per turn", "total ms", "dropped (cumulative)"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
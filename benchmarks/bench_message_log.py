@@ -0,0 +1,78 @@
+# bench_message_log.py
+# Memory and CPU comparison of the old dict-of-dataclasses session state against the
+# slotted messages + append-only MessageLog used by MultiAgentState.
+#
+#   python -m benchmarks.bench_message_log [--messages 5000]
+import argparse
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from app.classes import ChatMessage, MessageLog
+from benchmarks.harness import measure_memory, print_table, time_call
+
+
+@dataclass
+class LegacyChatMessage:
+    # Same fields as ChatMessage before it was slotted
+    message_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    role: str = ""
+    content: str = ""
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+def build_legacy(count: int, content: str) -> dict[str, LegacyChatMessage]:
+    start = datetime.now(timezone.utc)
+    history = {}
+    for i in range(count):
+        msg = LegacyChatMessage(role="user" if i % 2 else "writer", content=content, created_at=start + timedelta(seconds=i))
+        history[msg.message_id] = msg
+    return history
+
+
+def build_log(count: int, content: str) -> MessageLog[ChatMessage]:
+    start = datetime.now(timezone.utc)
+    history = MessageLog()
+    for i in range(count):
+        history.append(ChatMessage(role="user" if i % 2 else "writer", content=content, created_at=start + timedelta(seconds=i)))
+    return history
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="MessageLog memory and CPU benchmark")
+    parser.add_argument("--messages", type=int, default=5000, help="messages in the simulated long session")
+    args = parser.parse_args()
+
+    # Contents are shared so the comparison measures the containers, not the strings.
+    content = "x" * 200
+
+    legacy, legacy_bytes = measure_memory(lambda: build_legacy(args.messages, content))
+    log, log_bytes = measure_memory(lambda: build_log(args.messages, content))
+
+    print_table(
+        f"Memory for a {args.messages:,} message session",
+        ["layout", "total bytes", "bytes/message"],
+        [
+            ["dict + dataclass", legacy_bytes, legacy_bytes / args.messages],
+            ["MessageLog + slots", log_bytes, log_bytes / args.messages],
+        ],
+    )
+
+    number = max(1, 200_000 // args.messages)
+    timings = [
+        time_call("latest: max(created_at)", lambda: max(legacy.values(), key=lambda m: m.created_at), number=number),
+        time_call("latest: MessageLog.latest()", log.latest, number=number * 100),
+        time_call("ordered: sorted(created_at)", lambda: sorted(legacy.values(), key=lambda m: m.created_at), number=number),
+        time_call("ordered: MessageLog.ordered()", lambda: list(log.ordered()), number=number),
+        time_call("build: dict + dataclass", lambda: build_legacy(args.messages, content), number=1),
+        time_call("build: MessageLog + slots", lambda: build_log(args.messages, content), number=1),
+    ]
+    print_table(
+        "CPU per operation",
+        ["operation", "best us", "mean us", "calls"],
+        [[t.name, t.best_us, t.mean_us, t.calls] for t in timings],
+    )
+
+
+if __name__ == "__main__":
+    main()
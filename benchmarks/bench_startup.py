@@ -0,0 +1,163 @@
+# bench_startup.py
+# Cold-start cost of the API process: how long `import app.main` takes, which modules
+# dominate it, and how long the lifespan needs until every component is loaded.
+#
+#   python -m benchmarks.bench_startup
+#   python -m benchmarks.bench_startup --update-baseline startup_baseline.json
+#   python -m benchmarks.bench_startup --baseline startup_baseline.json
+#
+# Every measurement runs in a fresh interpreter so module caches don't hide import cost.
+# Environment variables the app needs at import are filled with dummies when they're missing;
+# nothing connects to Supabase or Azure (clients are constructed, no request is made).
+# With --baseline, modules whose cumulative import time grew by more than --threshold
+# (relative and at least 5 ms) are reported and the script exits with status 1.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.harness import print_table
+
+DUMMY_ENV = {
+    "FASTAPI_JWT_SECRET": "benchmark",
+    "FASTAPI_JWT_ISSUER": "benchmark",
+    "FASTAPI_JWT_AUDIENCE": "benchmark",
+    "SUPABASE_URL": "http://127.0.0.1:9",
+    # Supabase validates that the key looks like a JWT
+    "SUPABASE_SERVICE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark",
+    "AZURE_ENDPOINT": "http://127.0.0.1:9",
+    "AZURE_RESOURCE_API_VERSION": "2024-10-21",
+    "AZURE_RESOURCE_API_KEY": "benchmark",
+    "AZURE_MODEL_NAME_MA": "benchmark",
+    "AZURE_MODEL_NAME_UA": "benchmark",
+    "AZURE_MODEL_NAME_RA": "benchmark",
+    "AZURE_MODEL_NAME_WA": "benchmark",
+    "LOGFIRE_SEND_TO_LOGFIRE": "false",
+}
+
+# Modules whose presence on the import path of app.main counts as a regression on its own
+HEAVY_MODULES = ("pydantic_ai", "openai", "supabase", "numpy", "app.orchestration")
+
+READY_SCRIPT = """
+import asyncio, json, time
+start = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+
+async def run():
+    async with app.router.lifespan_context(app):
+        return time.perf_counter()
+
+ready = asyncio.run(run())
+print(json.dumps({"import_s": imported - start, "ready_s": ready - start}))
+"""
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    for key, value in DUMMY_ENV.items():
+        env.setdefault(key, value)
+    env["STARTUP_BACKGROUND_WARMUP"] = "0"
+    return env
+
+
+def import_profile() -> dict[str, float]:
+    """Cumulative import time per module in ms, from `python -X importtime -c "import app.main"`."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        env=_env(), capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        # A module can show up more than once; the outermost (largest) entry counts
+        name = module.strip()
+        cumulative[name] = max(cumulative.get(name, 0.0), int(cumulative_us) / 1000)
+    return cumulative
+
+
+def time_to_ready() -> dict[str, float]:
+    completed = subprocess.run(
+        [sys.executable, "-c", READY_SCRIPT],
+        env=_env(), capture_output=True, text=True, check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def regressions(current: dict, baseline: dict, threshold: float) -> list[list[object]]:
+    rows = []
+    for module, ms in current["modules"].items():
+        before = baseline["modules"].get(module)
+        if before is None:
+            if module in HEAVY_MODULES:
+                rows.append([module, "-", ms, "newly imported"])
+            continue
+        if ms - before >= 5 and ms > before * (1 + threshold):
+            rows.append([module, before, ms, f"+{(ms / before - 1) * 100:.0f}%"])
+    for key in ("import_ms", "ready_ms"):
+        before, now = baseline[key], current[key]
+        if now - before >= 5 and now > before * (1 + threshold):
+            rows.append([key, before, now, f"+{(now / before - 1) * 100:.0f}%"])
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=15, help="modules to list")
+    parser.add_argument("--baseline", help="compare against this JSON file")
+    parser.add_argument("--update-baseline", help="write the measurement to this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative growth reported as regression")
+    args = parser.parse_args()
+
+    profiles = [import_profile() for _ in range(args.runs)]
+    readies = [time_to_ready() for _ in range(args.runs)]
+
+    modules = {
+        module: statistics.median(profile.get(module, 0.0) for profile in profiles)
+        for module in profiles[0]
+    }
+    current = {
+        "modules": modules,
+        "import_ms": statistics.median(r["import_s"] for r in readies) * 1000,
+        "ready_ms": statistics.median(r["ready_s"] for r in readies) * 1000,
+    }
+
+    top = sorted(((m, ms) for m, ms in modules.items() if "." not in m or m.startswith("app.")), key=lambda item: -item[1])
+    print_table(
+        f"Cumulative import time of top-level packages under `import app.main` (median of {args.runs})",
+        ["module", "ms"],
+        [[module, ms] for module, ms in top[:args.top]],
+    )
+    print_table(
+        "Heavy modules on the import path of app.main",
+        ["module", "imported", "ms"],
+        [[module, "yes" if module in modules else "no", modules.get(module, 0.0)] for module in HEAVY_MODULES],
+    )
+    print_table(
+        f"Startup (median of {args.runs})",
+        ["stage", "ms"],
+        [["import app.main", current["import_ms"]], ["lifespan ready (time to first ready)", current["ready_ms"]]],
+    )
+
+    if args.update_baseline:
+        with open(args.update_baseline, "w") as f:
+            json.dump(current, f, indent=1, sort_keys=True)
+        print(f"\nBaseline written to {args.update_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = regressions(current, baseline, args.threshold)
+        if rows:
+            print_table("Import-time regressions", ["module", "baseline ms", "current ms", "change"], rows)
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline} (threshold {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# bench_telemetry.py
+# Per-request overhead of the logfire instrumentation settings in app/telemetry.py.
+#
+#   python -m benchmarks.bench_telemetry [--requests 40]
+#
+# A simulated request is one root span with 10 Supabase-sized HTTP calls (4 KB JSON
+# responses) and 5 agent runs (6 KB prompt, 3 KB answer), the shape of one /chat call.
+# HTTP goes through the real httpx transport with an in-memory connection pool and the agents
+# use pydantic-ai's FunctionModel, so only instrumentation cost is measured. Spans are exported
+# to an in-memory exporter that counts the serialised attribute bytes; nothing is sent anywhere.
+# Every setting runs in its own interpreter because instrumentation can't be undone in-process.
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.harness import print_table
+
+SETTINGS = [
+    ("uninstrumented", None),
+    ("none", {"TELEMETRY_CAPTURE": "none", "TELEMETRY_SAMPLE_RATE": "1"}),
+    ("capped", {"TELEMETRY_CAPTURE": "capped", "TELEMETRY_SAMPLE_RATE": "1"}),
+    ("capped, tail 10%", {"TELEMETRY_CAPTURE": "capped", "TELEMETRY_SAMPLE_RATE": "0.1"}),
+    ("capped, head 10%", {"TELEMETRY_CAPTURE": "capped", "TELEMETRY_SAMPLE_RATE": "1", "TELEMETRY_HEAD_SAMPLE_RATE": "0.1"}),
+    ("full (previous default)", {"TELEMETRY_CAPTURE": "full", "TELEMETRY_SAMPLE_RATE": "1"}),
+]
+
+HTTP_CALLS = 10
+AGENT_RUNS = 5
+RESPONSE_BODY = json.dumps([{"message_id": f"m{i}", "content": "x" * 180} for i in range(20)]).encode()
+PROMPT = "Interview context and history. " * 200
+ANSWER = "A considered interviewer reply. " * 100
+
+
+def _worker(instrumented: bool, requests: int) -> dict:
+    import httpcore
+    import httpx
+    from pydantic_ai import Agent
+    from pydantic_ai.messages import ModelResponse, TextPart
+    from pydantic_ai.models.function import FunctionModel
+
+    exported = {"spans": 0, "bytes": 0}
+    span = None
+    if instrumented:
+        import logfire
+        from opentelemetry.sdk.trace.export import SimpleSpanProcessor, SpanExporter, SpanExportResult
+        from app.telemetry import configure_telemetry, instrument_clients
+
+        class CountingExporter(SpanExporter):
+            def export(self, spans):
+                for s in spans:
+                    exported["spans"] += 1
+                    exported["bytes"] += len(json.dumps(dict(s.attributes or {}), default=str))
+                return SpanExportResult.SUCCESS
+
+        configure_telemetry(
+            token=None, send_to_logfire=False, console=False,
+            additional_span_processors=[SimpleSpanProcessor(CountingExporter())],
+        )
+        instrument_clients()
+        span = logfire.span
+
+    class InMemoryPool:
+        async def handle_async_request(self, request):
+            async for _ in request.stream:
+                pass
+            return httpcore.Response(200, headers=[(b"content-type", b"application/json")], content=RESPONSE_BODY)
+
+        async def aclose(self):
+            pass
+
+    def reply(messages, info):
+        return ModelResponse(parts=[TextPart(ANSWER)])
+
+    agent = Agent(FunctionModel(reply), name="bench")
+
+    async def one_request(client):
+        for i in range(HTTP_CALLS):
+            response = await client.post("https://supabase.local/rest/v1/chat_messages", json={"session_id": "s", "i": i})
+            response.json()
+        for _ in range(AGENT_RUNS):
+            await agent.run(PROMPT)
+
+    async def run():
+        transport = httpx.AsyncHTTPTransport()
+        transport._pool = InMemoryPool()
+        client = httpx.AsyncClient(transport=transport)
+        timings = []
+        for _ in range(requests + 3):
+            start = time.perf_counter()
+            if span is not None:
+                with span("POST /chat/send_message"):
+                    await one_request(client)
+            else:
+                await one_request(client)
+            timings.append(time.perf_counter() - start)
+        return sorted(timings[3:])  # first requests warm up caches
+
+    timings = asyncio.run(run())
+    return {
+        "median_ms": timings[len(timings) // 2] * 1000,
+        "p90_ms": timings[int(len(timings) * 0.9)] * 1000,
+        "spans_per_request": exported["spans"] / (requests + 3),
+        "kb_per_request": exported["bytes"] / (requests + 3) / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--worker", choices=["instrumented", "uninstrumented"])
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_worker(args.worker == "instrumented", args.requests)))
+        return
+
+    rows = []
+    baseline = None
+    for name, env in SETTINGS:
+        worker_env = dict(os.environ, LOGFIRE_SEND_TO_LOGFIRE="false", **(env or {}))
+        worker_env.pop("OTEL_ATTRIBUTE_VALUE_LENGTH_LIMIT", None)
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_telemetry", "--requests", str(args.requests),
+             "--worker", "instrumented" if env else "uninstrumented"],
+            env=worker_env, capture_output=True, text=True, check=True,
+        )
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        baseline = baseline or result["median_ms"]
+        rows.append([
+            name, result["median_ms"], result["p90_ms"],
+            f"{(result['median_ms'] / baseline - 1) * 100:+.0f}%",
+            result["spans_per_request"], result["kb_per_request"],
+        ])
+
+    print_table(
+        f"Simulated /chat request ({HTTP_CALLS} HTTP calls + {AGENT_RUNS} agent runs), {args.requests} requests per setting",
+        ["setting", "median ms", "p90 ms", "overhead", "spans exported / req", "attribute KB / req"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
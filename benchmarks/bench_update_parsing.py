@@ -0,0 +1,111 @@
+# bench_update_parsing.py
+# CPU cost of parsing Update Agent answers: the previous json + regex path against the
+# orjson fast path and repair in app/fact_parsing.py, on a bulk mix of answer shapes.
+#
+#   python -m benchmarks.bench_update_parsing [--answers 2000]
+#
+# The mix is what the parse task returns in practice: plain JSON, fenced JSON, JSON with
+# surrounding prose, trailing commas and truncated answers. "recovered" counts answers that
+# came back as a dict (previous path) or as validated facts (new path).
+import argparse
+import json
+import random
+import re
+
+from app.fact_parsing import parse_facts, parse_json_result
+from benchmarks.harness import print_table, time_call
+
+THEMES = ["Data literacy", "Infrastructure", "Governance", "Culture", "Skills", "Strategy"]
+
+
+def legacy_parse_json_result(text: str) -> dict:
+    # The Update Agent's parser before fact_parsing.py
+    text = text.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*", "", text)
+        if text.endswith("```"):
+            text = text[:-3].strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start = text.find('{')
+        end = text.rfind('}')
+        if start != -1 and end != -1:
+            try:
+                return json.loads(text[start:end + 1])
+            except json.JSONDecodeError as e:
+                raise ValueError("Failed to extract valid JSON from the result.") from e
+        raise ValueError("No JSON object found in the provided text.")
+
+
+def build_answers(count: int, seed: int = 7) -> list[str]:
+    rng = random.Random(seed)
+    answers = []
+    for i in range(count):
+        facts = {
+            "topic": f"topic {i % 50} " + "detail " * rng.randint(0, 6),
+            "score": round(rng.random(), 2),
+            "relevance": round(rng.random(), 2),
+            "themes": rng.sample(THEMES, rng.randint(1, 3)),
+        }
+        text = json.dumps(facts, indent=rng.choice([None, 2]))
+        shape = i % 5
+        if shape == 1:
+            text = f"```json\n{text}\n```"
+        elif shape == 2:
+            text = f"Here is the JSON:\n{text}\nLet me know if you need more."
+        elif shape == 3:
+            text = text.replace("]", ",]", 1)
+        elif shape == 4:
+            text = text[: int(len(text) * 0.8)]
+        answers.append(text)
+    return answers
+
+
+def _recovered(parse, answers: list[str]) -> int:
+    count = 0
+    for answer in answers:
+        try:
+            count += parse(answer) is not None
+        except ValueError:
+            pass
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Update Agent answer parsing benchmark")
+    parser.add_argument("--answers", type=int, default=2000, help="answers in the bulk batch")
+    args = parser.parse_args()
+
+    answers = build_answers(args.answers)
+    clean = [answer for i, answer in enumerate(answers) if i % 5 == 0]
+
+    def parse_all(parse, batch):
+        for answer in batch:
+            try:
+                parse(answer)
+            except ValueError:
+                pass
+
+    new_facts = lambda answer: parse_facts(answer, "user")[0]
+    timings = [
+        ("clean: json + regex", legacy_parse_json_result, clean),
+        ("clean: orjson", parse_json_result, clean),
+        ("clean: orjson + validation", new_facts, clean),
+        ("mixed: json + regex", legacy_parse_json_result, answers),
+        ("mixed: orjson + repair", parse_json_result, answers),
+        ("mixed: orjson + repair + validation", new_facts, answers),
+    ]
+    rows = []
+    for name, parse, batch in timings:
+        timing = time_call(name, lambda: parse_all(parse, batch), number=1, repeat=5)
+        rows.append([name, len(batch), timing.best_us / len(batch), _recovered(parse, batch)])
+    print_table(
+        f"Parsing {args.answers:,} Update Agent answers",
+        ["path", "answers", "best us/answer", "recovered"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# harness.py
+# Small shared helpers for the scripts in benchmarks/.
+# Run any benchmark from the repository root, e.g.:  python -m benchmarks.bench_message_log
+import gc
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass
+class Timing:
+    name: str
+    best_us: float
+    mean_us: float
+    calls: int
+
+
+def time_call(name: str, fn: Callable[[], object], *, number: int = 1000, repeat: int = 5) -> Timing:
+    """
+    Time `fn` `number` times per round for `repeat` rounds and return per-call timings in microseconds.
+    GC is disabled while timing so collections of earlier garbage don't skew a single round.
+    """
+    rounds = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            rounds.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return Timing(
+        name=name,
+        best_us=min(rounds) * 1e6,
+        mean_us=sum(rounds) / len(rounds) * 1e6,
+        calls=number * repeat,
+    )
+
+
+def measure_memory(fn: Callable[[], object]) -> tuple[object, int]:
+    """Run `fn` under tracemalloc and return (result, bytes still allocated by the result)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current
+
+
+def print_table(title: str, header: list[str], rows: list[list[object]]) -> None:
+    """Print a plain fixed-width table; good enough for terminals and CI logs."""
+    cells = [header] + [[_fmt(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+
+    print(f"\n{title}")
+    print("-" * (sum(widths) + 3 * (len(widths) - 1)))
+    for index, row in enumerate(cells):
+        print(" | ".join(value.ljust(widths[i]) for i, value in enumerate(row)))
+        if index == 0:
+            print("-" * (sum(widths) + 3 * (len(widths) - 1)))
+
+
+def _fmt(value: object) -> str:
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    if isinstance(value, int):
+        return f"{value:,}"
+    return str(value)
@@ -0,0 +1,7 @@
+# conftest.py
+# The tests run against local fakes only: no Supabase, Azure or logfire.
+
+
+def pytest_configure(config):
+    # pydantic-ai instruments the graph and agent runs with logfire, which isn't configured here
+    config.addinivalue_line("filterwarnings", "ignore:No logs or spans will be created")
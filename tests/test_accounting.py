@@ -0,0 +1,219 @@
+# test_accounting.py
+# TokenLedger budgets and batched persistence against a fake Supabase table, and AccountedModel
+# downgrading an agent's requests.
+import asyncio
+from types import SimpleNamespace
+
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from pydantic_ai.usage import Usage
+
+from app import accounting
+from app.accounting import AccountedModel, TokenLedger, UsageScope, budget_actions, usage_rows_dropped, usage_scope
+
+SCOPE = UsageScope(user_id="u1", session_id="s1", company_id="c1")
+
+
+class FakeQuery:
+    """The subset of the postgrest builder the ledger uses: insert, or select + eq + order + range."""
+
+    def __init__(self, table: "FakeTable"):
+        self.table = table
+        self.filters: dict = {}
+        self.rows: list[dict] | None = None
+
+    def insert(self, rows: list[dict]) -> "FakeQuery":
+        self.rows = rows
+        return self
+
+    def select(self, columns: str) -> "FakeQuery":
+        return self
+
+    def eq(self, column: str, value) -> "FakeQuery":
+        self.filters[column] = value
+        return self
+
+    def order(self, column: str) -> "FakeQuery":
+        return self
+
+    def range(self, start: int, end: int) -> "FakeQuery":
+        self.bounds = (start, end + 1)
+        return self
+
+    async def execute(self):
+        if self.table.fail:
+            raise RuntimeError("connection reset")
+        if self.rows is not None:
+            self.table.rows.extend(self.rows)
+            return SimpleNamespace(data=self.rows)
+        rows = [row for row in self.table.rows if all(row.get(k) == v for k, v in self.filters.items())]
+        return SimpleNamespace(data=rows[slice(*self.bounds)])
+
+
+class FakeTable:
+    def __init__(self):
+        self.rows: list[dict] = []
+        self.fail = False
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.token_usage = FakeTable()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self.token_usage)
+
+
+def tokens(total: int) -> Usage:
+    return Usage(requests=1, request_tokens=total - total // 4, response_tokens=total // 4, total_tokens=total)
+
+
+def test_budget_state_downgrades_then_exceeds():
+    ledger = TokenLedger(user_daily=100, downgrade_at=0.8)
+    assert ledger.state(SCOPE) == ("ok", None)
+    ledger.record(SCOPE, "writer", "gpt-4o", tokens(50))
+    assert ledger.state(SCOPE) == ("ok", None)
+    ledger.record(SCOPE, "writer", "gpt-4o", tokens(30))
+    assert ledger.state(SCOPE) == ("downgrade", "user")
+    ledger.record(SCOPE, "update", "gpt-4o", tokens(30))
+    assert ledger.state(SCOPE) == ("exceeded", "user")
+    assert ledger.usage(SCOPE) == {"user": 110, "session": 110, "company": 110}
+    # Another user of the same company is only held to the company budget, which is off
+    assert ledger.state(UsageScope(user_id="u2", session_id="s2", company_id="c1")) == ("ok", None)
+
+
+def test_no_budgets_means_ok():
+    ledger = TokenLedger()
+    ledger.record(SCOPE, "writer", "gpt-4o", tokens(10**9))
+    assert ledger.state(SCOPE) == ("ok", None)
+
+
+def test_stages_are_skipped_only_past_the_budget():
+    ledger = TokenLedger(session_total=100, skip_stages=frozenset({"update", "reviewer"}))
+    with usage_scope(SCOPE):
+        ledger.record(SCOPE, "writer", "gpt-4o", tokens(90))
+        assert not ledger.skip_stage("update")
+        skipped = budget_actions.value(action="skip_update", budget="session")
+        ledger.record(SCOPE, "writer", "gpt-4o", tokens(20))
+        assert ledger.skip_stage("update")
+        assert ledger.skip_stage("reviewer")
+        assert not ledger.skip_stage("writer")
+        assert budget_actions.value(action="skip_update", budget="session") == skipped + 1
+    # Outside a turn there is no scope to hold to a budget
+    assert not ledger.skip_stage("update")
+
+
+def test_day_change_drops_earlier_totals(monkeypatch):
+    day = {"today": "2025-03-04"}
+    monkeypatch.setattr(accounting, "_today", lambda: day["today"])
+    ledger = TokenLedger(user_daily=100, session_total=1000)
+    ledger.record(SCOPE, "writer", "gpt-4o", tokens(90))
+    assert ledger.usage(SCOPE) == {"user": 90, "session": 90, "company": 90}
+    day["today"] = "2025-03-05"
+    ledger.record(SCOPE, "writer", "gpt-4o", tokens(10))
+    # Without persistence the session's total starts over as well (see the module comment)
+    assert ledger.usage(SCOPE) == {"user": 10, "session": 10, "company": 10}
+    assert all(value[0] == "2025-03-05" for value in ledger._totals.values())
+
+
+def test_flush_writes_one_aggregate_per_key():
+    async def scenario():
+        supabase = FakeSupabase()
+        ledger = TokenLedger(supabase_client=supabase, flush_interval=60)
+        ledger.record(SCOPE, "writer", "gpt-4o", tokens(40))
+        ledger.record(SCOPE, "writer", "gpt-4o", tokens(40))
+        ledger.record(SCOPE, "update", "gpt-4o-mini", tokens(8))
+        await ledger.aclose()
+        rows = {row["agent"]: row for row in supabase.token_usage.rows}
+        assert len(supabase.token_usage.rows) == 2
+        assert rows["writer"]["requests"] == 2 and rows["writer"]["total_tokens"] == 80
+        assert rows["update"]["model"] == "gpt-4o-mini" and rows["update"]["company_id"] == "c1"
+        assert not ledger._pending
+
+    asyncio.run(scenario())
+
+
+def test_failed_flushes_keep_rows_then_drop_them():
+    async def scenario():
+        supabase = FakeSupabase()
+        supabase.token_usage.fail = True
+        ledger = TokenLedger(supabase_client=supabase, flush_interval=60, max_failures=2)
+        ledger.record(SCOPE, "writer", "gpt-4o", tokens(40))
+        dropped = usage_rows_dropped.value()
+        await ledger.flush()
+        assert len(ledger._pending) == 1
+        # Usage recorded meanwhile is merged into the kept rows
+        ledger.record(SCOPE, "writer", "gpt-4o", tokens(40))
+        assert ledger._pending[next(iter(ledger._pending))][0] == 2
+        await ledger.flush()
+        assert not ledger._pending
+        assert usage_rows_dropped.value() == dropped + 1
+        await ledger.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_pending_rows_are_capped_oldest_first():
+    async def scenario():
+        supabase = FakeSupabase()
+        supabase.token_usage.fail = True
+        ledger = TokenLedger(supabase_client=supabase, flush_interval=60, max_pending=2)
+        for agent in ("update", "meta", "writer"):
+            ledger.record(SCOPE, agent, "gpt-4o", tokens(10))
+        dropped = usage_rows_dropped.value()
+        await ledger.flush()
+        assert [key[4] for key in ledger._pending] == ["meta", "writer"]
+        assert usage_rows_dropped.value() == dropped + 1
+        supabase.token_usage.fail = False
+        await ledger.aclose()
+        assert [row["agent"] for row in supabase.token_usage.rows] == ["meta", "writer"]
+
+    asyncio.run(scenario())
+
+
+def test_prepare_loads_stored_totals_once():
+    async def scenario():
+        supabase = FakeSupabase()
+        today = accounting._today()
+        supabase.token_usage.rows = [
+            {"user_id": "u1", "session_id": "s0", "company_id": "c1", "day": today, "total_tokens": 70},
+            {"user_id": "u1", "session_id": "s0", "company_id": "c1", "day": "2000-01-01", "total_tokens": 500},
+        ]
+        ledger = TokenLedger(supabase_client=supabase, flush_interval=60, user_daily=100, downgrade_at=0.8)
+        await ledger.prepare(SCOPE)
+        assert ledger.usage(SCOPE)["user"] == 70
+        ledger.record(SCOPE, "writer", "gpt-4o", tokens(20))
+        assert ledger.state(SCOPE) == ("downgrade", "user")
+        # Already loaded today: the stored rows aren't added a second time
+        await ledger.prepare(SCOPE)
+        assert ledger.usage(SCOPE)["user"] == 90
+        await ledger.aclose()
+
+    asyncio.run(scenario())
+
+
+def _answering(text: str, calls: list[str]) -> FunctionModel:
+    def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        calls.append(text)
+        return ModelResponse(parts=[TextPart(text)])
+
+    return FunctionModel(respond, model_name=text)
+
+
+def test_accounted_model_records_usage_and_downgrades():
+    async def scenario():
+        calls: list[str] = []
+        ledger = TokenLedger(user_daily=1000, downgrade_at=0.5)
+        model = AccountedModel(_answering("large", calls), "writer", ledger, downgrade_model=_answering("small", calls))
+        agent = Agent(model)
+        with usage_scope(SCOPE):
+            assert (await agent.run("Ask the next question.")).data == "large"
+            assert 0 < ledger.usage(SCOPE)["user"] < 500
+            ledger.record(SCOPE, "update", "gpt-4o", tokens(600))
+            assert (await agent.run("Ask the next question.")).data == "small"
+        # No scope: nothing to budget, the agent's own model answers
+        assert (await agent.run("Ask the next question.")).data == "large"
+        assert calls == ["large", "small", "large"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,153 @@
+# test_checkpoints.py
+# Graph checkpoints: a run whose Writer fails resumes at the Writer on retry, and the state
+# survives the orjson round trip the stores keep it in.
+import asyncio
+from collections import Counter
+from dataclasses import fields
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from pydantic_ai import Agent
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelMessage, ModelResponse, SystemPromptPart, TextPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from app import orchestration
+from app.checkpoints import _LOG_TYPES, MemoryCheckpointStore, SQLiteCheckpointStore, dump_state, graph_checkpoint_resumes, load_state
+from app.classes import ChatMessage, MessageLog, MultiAgentState
+from app.history import ConversationHistoryView
+
+USER_FACT = '{"topic": "Shares AI news with the team", "score": 0.7, "relevance": 0.9, "themes": ["culture"]}'
+
+
+class FakeModels:
+    """One FunctionModel per agent; counts the calls and fails the Writer `writer_failures` times."""
+
+    def __init__(self, writer_failures: int = 1):
+        self.calls: Counter = Counter()
+        self.writer_failures = writer_failures
+
+    def model(self, agent: str) -> FunctionModel:
+        def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+            self.calls[agent] += 1
+            return ModelResponse(parts=[TextPart(self._answer(agent, messages))])
+
+        return FunctionModel(respond)
+
+    def _answer(self, agent: str, messages: list[ModelMessage]) -> str:
+        if agent == "update":
+            system = " ".join(part.content for message in messages for part in message.parts if isinstance(part, SystemPromptPart))
+            if "extracting topic insights" in system:
+                return "[User topic Info] Shares AI news with the team"
+            return USER_FACT
+        if agent == "writer" and self.writer_failures:
+            self.writer_failures -= 1
+            raise ModelHTTPError(status_code=500, model_name="writer", body={"error": {"code": "server_error"}})
+        return f"{agent} answer"
+
+
+def make_clients(models: FakeModels, store) -> SimpleNamespace:
+    return SimpleNamespace(
+        meta_agent=Agent(models.model("meta"), name="meta_agent"),
+        reviewer_agent=Agent(models.model("reviewer"), name="Reviewer"),
+        writer_agent=Agent(models.model("writer"), name="Writer"),
+        update_agent=Agent(models.model("update"), name="Updater"),
+        rag_engine=None,
+        model_router=None,
+        response_cache=None,
+        graph_checkpoints=store,
+    )
+
+
+async def make_context(clients):
+    history = MessageLog()
+    history.append(ChatMessage(role="writer", content="Welcome! What is your role?"))
+    user_message = history.append(ChatMessage(message_id="m1", role="user", content="I share AI news with my team."))
+    phase_prompt = MessageLog()
+    phase_prompt.append(ChatMessage(role="system", content="Phase: Introduction"))
+    return await orchestration.build_context(
+        clients, "u1", "s1",
+        user_profile={"TTS_flag": 0},
+        conversation_history=history,
+        latest_phase_prompt=phase_prompt,
+        latest_user_message=user_message,
+        info_rows=[],
+        history_view=ConversationHistoryView(history),
+    )
+
+
+@pytest.mark.parametrize("make_store", [MemoryCheckpointStore, lambda: SQLiteCheckpointStore(":memory:")])
+def test_retry_resumes_at_the_writer(make_store):
+    async def scenario():
+        models = FakeModels(writer_failures=1)
+        store = make_store()
+        clients = make_clients(models, store)
+
+        with pytest.raises(ModelHTTPError):
+            await orchestration.run_graph(clients, await make_context(clients), "m1")
+        first = dict(models.calls)
+        assert first["writer"] == 1 and first["meta"] == 1 and first["reviewer"] == 1
+        rows = await store.load(("u1", "s1", "m1"))
+        assert rows[-1]["node"] == "WriterAgentNode" and rows[-1]["status"] == "error"
+
+        resumes = graph_checkpoint_resumes.value(node="WriterAgentNode")
+        result = await orchestration.run_graph(clients, await make_context(clients), "m1")
+        assert graph_checkpoint_resumes.value(node="WriterAgentNode") == resumes + 1
+
+        # Only the Writer ran again; the other outputs come from the checkpoint
+        assert {agent: count - first.get(agent, 0) for agent, count in models.calls.items()} == {
+            "update": 0, "meta": 0, "reviewer": 0, "writer": 1,
+        }
+        assert result.state.writer_response.content == "writer answer"
+        assert [m.content for m in result.state.MA_response.values()] == ["meta answer"]
+        assert [m.content for m in result.state.reviewer_response.values()] == ["reviewer answer"]
+        assert [m.content_dict["topic"] for m in result.state.new_user_AIR_info.values()] == ["Shares AI news with the team"]
+        assert await store.load(("u1", "s1", "m1")) == []
+
+    asyncio.run(scenario())
+
+
+def test_run_without_failure_leaves_no_checkpoints():
+    async def scenario():
+        models = FakeModels(writer_failures=0)
+        store = MemoryCheckpointStore()
+        clients = make_clients(models, store)
+        result = await orchestration.run_graph(clients, await make_context(clients), "m1")
+        assert result.state.writer_response.content == "writer answer"
+        assert await store.load(("u1", "s1", "m1")) == []
+
+    asyncio.run(scenario())
+
+
+def _filled_state() -> MultiAgentState:
+    created_at = datetime(2025, 3, 4, 5, 6, 7, 890123, tzinfo=timezone.utc)
+    state = MultiAgentState(reviewer_approval=True, session_finished=True)
+    for name, cls in _LOG_TYPES.items():
+        log = getattr(state, name)
+        if cls is ChatMessage:
+            log.append(ChatMessage(role=name, content=f"{name} ✓ \"quoted\"\n", created_at=created_at))
+            log.append(ChatMessage(role=name, content="second"))
+        else:
+            log.append(cls(content_dict={"score": 0.5, "themes": ["data"]}, content_str=name, created_at=created_at))
+    state.writer_response = ChatMessage(role="writer", content="done", created_at=created_at)
+    return state
+
+
+def test_state_round_trip_covers_every_log():
+    state = _filled_state()
+    restored = load_state(dump_state(state))
+    assert restored == state
+    for name, cls in _LOG_TYPES.items():
+        log = getattr(restored, name)
+        assert type(log) is MessageLog
+        assert list(log) == list(getattr(state, name))
+        assert all(type(message) is cls for message in log.values())
+        assert all(message.created_at.tzinfo is not None for message in log.values())
+    assert isinstance(restored.writer_response.created_at, datetime)
+
+
+def test_log_types_cover_every_message_log_field():
+    state = MultiAgentState()
+    logs = {f.name for f in fields(state) if isinstance(getattr(state, f.name), MessageLog)}
+    assert logs == set(_LOG_TYPES)
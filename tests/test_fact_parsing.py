@@ -0,0 +1,90 @@
+# test_fact_parsing.py
+# Parsing, repair and validation of the Update Agent's fact answers, and the selective retry.
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.fact_parsing import fact_parse_results, parse_facts, parse_json_result, repair_json
+from app.Update_Agent.internal_logic_UA import parse_segment
+
+USER_FACTS = {"topic": "Shares AI news with the team", "score": 0.7, "relevance": 0.9, "themes": ["culture"]}
+
+
+def test_clean_and_fenced_answers():
+    text = '{"topic": "Shares AI news with the team", "score": 0.7, "relevance": 0.9, "themes": ["culture"]}'
+    assert parse_facts(text, "user") == (USER_FACTS, "ok", None)
+    assert parse_facts(f"```json\n{text}\n```", "user") == (USER_FACTS, "ok", None)
+
+
+@pytest.mark.parametrize("text", [
+    'Here you go: {"topic": "Shares AI news with the team", "score": 0.7, "relevance": 0.9, "themes": ["culture"]} Hope it helps!',
+    '{"topic": "Shares AI news with the team", "score": 0.7, "relevance": 0.9, "themes": ["culture",],}',
+    '{"topic": "Shares AI news with the team", "score": 0.7, "relevance": 0.9, "themes": ["culture"',
+])
+def test_repaired_answers(text):
+    assert parse_facts(text, "user") == (USER_FACTS, "repaired", None)
+
+
+def test_truncated_string_and_dangling_key():
+    assert parse_json_result('{"description": "Runs a data lake') == {"description": "Runs a data lake"}
+    assert parse_json_result('{"description": "x", "score"') == {"description": "x", "score": None}
+    assert repair_json("no object here") is None
+
+
+def test_schema_violations_are_reported():
+    facts, result, error = parse_facts('{"topic": "x", "score": 3, "relevance": 0.5}', "user")
+    assert facts is None and result == "invalid"
+    assert "score" in error
+    facts, result, error = parse_facts('{"topic": "x", "score": 0.5, "relevance": 0.5}', "company")
+    assert facts is None and "description" in error
+    assert parse_facts("[1, 2]", "user")[0] is None
+    assert parse_facts("", "user")[0] is None
+
+
+def test_single_theme_string_becomes_a_list():
+    facts, _, _ = parse_facts('{"description": "x", "score": 0.1, "relevance": 0.2, "themes": "data"}', "company")
+    assert facts["themes"] == ["data"]
+
+
+class FakeAgent:
+    """Answers each run() with the next canned text and records the tasks' prompts."""
+
+    def __init__(self, answers: list[str]):
+        self.answers = list(answers)
+        self.prompts: list[str] = []
+
+    async def run(self, user_prompt: str, message_history=None, deps=None, model=None):
+        self.prompts.append(user_prompt)
+        return SimpleNamespace(data=self.answers.pop(0))
+
+
+def _graph_ctx(agent: FakeAgent):
+    return SimpleNamespace(deps=SimpleNamespace(update_agent=agent, model_router=None))
+
+
+def test_invalid_answer_is_retried_with_the_error():
+    agent = FakeAgent([
+        '{"topic": "Shares AI news", "score": 7, "relevance": 0.9}',
+        '{"topic": "Shares AI news", "score": 0.7, "relevance": 0.9}',
+    ])
+    retried = fact_parse_results.value(kind="user", result="retried")
+    facts = asyncio.run(parse_segment(_graph_ctx(agent), "Shares AI news", "user", []))
+    assert facts == {"topic": "Shares AI news", "score": 0.7, "relevance": 0.9, "themes": []}
+    assert len(agent.prompts) == 2
+    assert "score" in agent.prompts[1] and '"topic"' in agent.prompts[1]
+    assert fact_parse_results.value(kind="user", result="retried") == retried + 1
+
+
+def test_valid_answer_makes_no_retry():
+    agent = FakeAgent(['{"description": "Has a data team", "score": 0.4, "relevance": 0.8}'])
+    facts = asyncio.run(parse_segment(_graph_ctx(agent), "Has a data team", "company", []))
+    assert facts["description"] == "Has a data team"
+    assert len(agent.prompts) == 1
+
+
+def test_failed_retries_keep_an_empty_fact():
+    agent = FakeAgent(["not json", "still not json"])
+    failed = fact_parse_results.value(kind="company", result="failed")
+    assert asyncio.run(parse_segment(_graph_ctx(agent), "segment", "company", [])) == {}
+    assert fact_parse_results.value(kind="company", result="failed") == failed + 1
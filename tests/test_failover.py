@@ -0,0 +1,214 @@
+# test_failover.py
+# FailoverModel over fake Azure endpoints behind httpx.MockTransport, driven through the openai SDK
+# and OpenAIModel as in production (see benchmarks/bench_failover.py).
+import asyncio
+import time
+
+import httpx
+import pytest
+from openai import AsyncAzureOpenAI
+from pydantic_ai import Agent
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.models.function import FunctionModel
+from pydantic_ai.models.openai import OpenAIModel
+
+from app import failover
+
+DEPLOYMENT = "gpt-4o"
+
+
+def _completion() -> dict:
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": DEPLOYMENT,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11},
+    }
+
+
+class FakeRegion:
+    """One fake endpoint answering with `status` after `delay` seconds; status None is a connect error."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.status: int | None = 200
+        self.delay = 0.0
+        self.calls = 0
+        self.arrived = asyncio.Event()
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        self.arrived.set()
+        status, delay = self.status, self.delay
+        await asyncio.sleep(delay)
+        if status is None:
+            raise httpx.ConnectError("connection refused", request=request)
+        if status != 200:
+            return httpx.Response(status, json={"error": {"code": str(status), "message": "fake error"}})
+        return httpx.Response(200, json=_completion())
+
+
+class Pool:
+    """A FailoverModel over one FakeRegion per name, with its own health records."""
+
+    def __init__(self, *names: str):
+        self.regions = {name: FakeRegion(name) for name in names}
+        self.http = httpx.AsyncClient(transport=httpx.MockTransport(self._handle))
+        self.model = failover.FailoverModel([
+            failover.PoolMember(name, OpenAIModel(model_name=DEPLOYMENT, openai_client=self._client(name)),
+                                failover.EndpointHealth(endpoint=name, deployment=DEPLOYMENT))
+            for name in names
+        ])
+        self.agent = Agent(model=self.model)
+
+    async def _handle(self, request: httpx.Request) -> httpx.Response:
+        return await self.regions[request.url.host.split(".")[0]].handle(request)
+
+    def _client(self, name: str) -> AsyncAzureOpenAI:
+        return AsyncAzureOpenAI(
+            azure_endpoint=f"https://{name}.openai.azure.com", api_version="2024-10-21", api_key="fake",
+            http_client=self.http, max_retries=0,
+        )
+
+    def health(self, name: str) -> failover.EndpointHealth:
+        return next(member.health for member in self.model.members if member.name == name)
+
+    def calls(self) -> dict[str, int]:
+        return {name: region.calls for name, region in self.regions.items()}
+
+    async def run(self) -> str:
+        return (await self.agent.run("Ask the next interview question.")).data
+
+
+@pytest.mark.parametrize("status", [503, 429, None])
+def test_fails_over_on_server_and_connection_errors(status):
+    async def scenario():
+        pool = Pool("westeurope", "swedencentral")
+        pool.regions["westeurope"].status = status
+        assert await pool.run() == "ok"
+        assert pool.calls() == {"westeurope": 1, "swedencentral": 1}
+        assert pool.health("westeurope").consecutive_failures == 1
+        assert pool.health("swedencentral").consecutive_failures == 0
+
+    asyncio.run(scenario())
+
+
+def test_request_errors_do_not_fail_over():
+    async def scenario():
+        pool = Pool("westeurope", "swedencentral")
+        pool.regions["westeurope"].status = 400
+        with pytest.raises(ModelHTTPError) as error:
+            await pool.run()
+        assert error.value.status_code == 400
+        assert pool.calls() == {"westeurope": 1, "swedencentral": 0}
+        # The endpoint answered; a rejected request says nothing about its health
+        assert pool.health("westeurope").consecutive_failures == 0
+
+    asyncio.run(scenario())
+
+
+def test_last_endpoint_error_is_raised():
+    async def scenario():
+        pool = Pool("westeurope", "swedencentral")
+        for region in pool.regions.values():
+            region.status = 503
+        with pytest.raises(ModelHTTPError):
+            await pool.run()
+        assert pool.calls() == {"westeurope": 1, "swedencentral": 1}
+
+    asyncio.run(scenario())
+
+
+def test_breaker_opens_then_probes_and_closes():
+    async def scenario():
+        pool = Pool("westeurope", "swedencentral")
+        westeurope = pool.health("westeurope")
+        # Fast enough to stay first despite its errors
+        westeurope.latency = 1e-6
+        pool.regions["westeurope"].status = 503
+        for _ in range(failover.AZURE_BREAKER_FAILURES):
+            assert await pool.run() == "ok"
+        assert westeurope.state == "open"
+
+        # Open: the healthy endpoint takes the traffic without a request to the tripped one
+        await pool.run()
+        assert pool.calls()["westeurope"] == failover.AZURE_BREAKER_FAILURES
+
+        # Cooled down: half open, and a failed probe opens it again
+        westeurope.opened_at -= failover.AZURE_BREAKER_COOLDOWN
+        pool.regions["swedencentral"].status = 503
+        with pytest.raises(ModelHTTPError):
+            await pool.run()
+        assert westeurope.state == "open" and not westeurope.probing
+
+        # A successful probe closes it
+        westeurope.opened_at -= failover.AZURE_BREAKER_COOLDOWN
+        pool.regions["westeurope"].status = 200
+        assert await pool.run() == "ok"
+        assert westeurope.state == "closed" and not westeurope.probing
+        assert westeurope.consecutive_failures == 0
+
+    asyncio.run(scenario())
+
+
+def test_one_probe_while_requests_run_concurrently(monkeypatch):
+    # No cooldown: an endpoint is half open again as soon as a failure opens it
+    monkeypatch.setattr(failover, "AZURE_BREAKER_COOLDOWN", 0.0)
+
+    async def scenario():
+        pool = Pool("westeurope", "swedencentral")
+        westeurope = pool.health("westeurope")
+        westeurope.state, westeurope.latency = "open", 0.001
+        claims = []
+        candidates = pool.model.candidates
+
+        def spy(now=None):
+            attempts = candidates(now)
+            claims.extend(member.name for member, probe in attempts if probe)
+            return attempts
+
+        pool.model.candidates = spy
+
+        # The probe is slow; meanwhile the other region fails and the tripped one fails fast, so the
+        # concurrent requests try westeurope as a last resort and re-open it while the probe runs
+        pool.regions["westeurope"].delay = 0.2
+        probe = asyncio.create_task(pool.run())
+        await pool.regions["westeurope"].arrived.wait()
+        pool.regions["westeurope"].status, pool.regions["westeurope"].delay = 503, 0.0
+        pool.regions["swedencentral"].status = 503
+        results = await asyncio.gather(*(pool.run() for _ in range(5)), return_exceptions=True)
+        assert all(isinstance(result, ModelHTTPError) for result in results)
+        assert westeurope.probing
+
+        assert await probe == "ok"
+        assert claims.count("westeurope") == 1
+        assert pool.calls()["westeurope"] == 6
+        assert westeurope.state == "closed" and not westeurope.probing
+
+    asyncio.run(scenario())
+
+
+def test_stream_failure_after_start_counts_against_the_endpoint():
+    async def broken_stream(messages, info):
+        yield "partial "
+        raise ConnectionError("connection reset")
+
+    async def healthy_stream(messages, info):
+        yield "ok"
+
+    async def scenario():
+        broken = failover.EndpointHealth(endpoint="westeurope", deployment=DEPLOYMENT)
+        healthy = failover.EndpointHealth(endpoint="swedencentral", deployment=DEPLOYMENT)
+        model = failover.FailoverModel([
+            failover.PoolMember("westeurope", FunctionModel(stream_function=broken_stream), broken),
+            failover.PoolMember("swedencentral", FunctionModel(stream_function=healthy_stream), healthy),
+        ])
+        with pytest.raises(ConnectionError):
+            async with Agent(model=model).run_stream("Ask the next interview question.") as result:
+                await result.get_data()
+        assert broken.consecutive_failures == 1 and broken.error_rate > 0
+        assert healthy.consecutive_failures == 0 and healthy.latency is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,95 @@
+# test_logging_config.py
+# JSON log lines, per-logger levels and the non-blocking queue handler.
+import io
+import logging
+import queue
+import sys
+
+import orjson
+import pytest
+
+from app.logging_config import JsonFormatter, NonBlockingQueueHandler, configure_logging, logs_dropped, parse_levels, stop_logging
+
+
+@pytest.fixture
+def restore_logging():
+    # configure_logging replaces the root handlers, pytest's log capture included
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    touched: list[str] = []
+    yield touched
+    stop_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    for name in touched:
+        logging.getLogger(name).setLevel(logging.NOTSET)
+
+
+def _record(**kwargs) -> logging.LogRecord:
+    return logging.makeLogRecord({"name": "app.test", "levelno": logging.INFO, "levelname": "INFO", **kwargs})
+
+
+def test_json_line_has_the_fields_and_extras():
+    record = _record(msg="Turn %s took %.1f s", args=("m1", 1.25), session_id="s1", _private="hidden")
+    entry = orjson.loads(JsonFormatter().format(record))
+    assert entry["message"] == "Turn m1 took 1.2 s"
+    assert entry["level"] == "INFO" and entry["logger"] == "app.test"
+    assert entry["session_id"] == "s1"
+    assert "_private" not in entry and "args" not in entry and "msg" not in entry
+    assert entry["time"].endswith("+00:00")
+
+
+def test_json_line_has_the_traceback():
+    try:
+        raise ValueError("bad fact")
+    except ValueError:
+        record = _record(msg="Parsing failed", exc_info=sys.exc_info(), payload=object())
+    entry = orjson.loads(JsonFormatter().format(record))
+    assert "ValueError: bad fact" in entry["exception"]
+    # Extras orjson can't encode are logged as their str()
+    assert entry["payload"].startswith("<object object")
+
+
+def test_parse_levels():
+    assert parse_levels("app.Update_Agent=debug, httpx=WARNING,,broken") == {"app.Update_Agent": "DEBUG", "httpx": "WARNING"}
+    assert parse_levels("") == {}
+
+
+def test_records_go_through_the_queue_with_per_logger_levels(restore_logging):
+    restore_logging.extend(["app.test", "app.noisy"])
+    stream = io.StringIO()
+    configure_logging(stream=stream, fmt="json", level="INFO", levels="app.test=DEBUG,app.noisy=ERROR")
+    facts = ["culture"]
+    logging.getLogger("app.test").debug("Facts %s", facts, extra={"user_id": "u1"})
+    # The message is merged when the call is made, not when the writer thread formats it
+    facts.append("data")
+    logging.getLogger("app.noisy").warning("dropped by level")
+    logging.getLogger("app.other").debug("dropped by the root level")
+    logging.getLogger("uvicorn.access").info("GET /health 200")
+    stop_logging()
+    entries = [orjson.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(entry["logger"], entry["message"]) for entry in entries] == [
+        ("app.test", "Facts ['culture']"),
+        ("uvicorn.access", "GET /health 200"),
+    ]
+    assert entries[0]["user_id"] == "u1"
+
+
+def test_text_format(restore_logging):
+    stream = io.StringIO()
+    configure_logging(stream=stream, fmt="text", level="INFO", levels="")
+    logging.getLogger("app.test").info("Hello %s", "there")
+    stop_logging()
+    assert stream.getvalue().rstrip().endswith(" - app.test - INFO - Hello there")
+
+
+def test_full_queue_drops_and_counts():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    dropped = logs_dropped.value()
+    handler.handle(_record(msg="first"))
+    handler.handle(_record(msg="second"))
+    assert handler.queue.qsize() == 1
+    assert logs_dropped.value() == dropped + 1
@@ -0,0 +1,94 @@
+# test_loop_monitor.py
+# LoopMonitor catching a blocking call on the event loop and attributing it to the request
+# endpoint and graph node that were running.
+import asyncio
+import logging
+import time
+
+from app.loop_monitor import LoopMonitor, LoopMonitorMiddleware, attribution, label_task, loop_block_seconds, loop_blocks
+
+
+async def send_message():
+    """Stands in for a route handler; attribution reads its __name__ from the ASGI scope."""
+
+
+def blocking_parse():
+    time.sleep(0.3)
+
+
+async def monitored(body, **labels):
+    monitor = LoopMonitor(interval=0.02, threshold=0.1, capture_stacks=True)
+    monitor.start()
+    try:
+        if labels:
+            label_task(**labels)
+        await body()
+        # Let the heartbeat after the block run and observe its length
+        await asyncio.sleep(0.05)
+    finally:
+        monitor.stop()
+
+
+def test_block_is_counted_against_endpoint_and_node(caplog):
+    async def body():
+        blocking_parse()
+
+    blocks = loop_blocks.value(endpoint="send_message", node="WriterAgentNode")
+    observed = loop_block_seconds.count(endpoint="send_message", node="WriterAgentNode")
+    with caplog.at_level(logging.WARNING, logger="app.loop_monitor"):
+        asyncio.run(monitored(body, scope={"type": "http", "endpoint": send_message}, node="WriterAgentNode"))
+    assert loop_blocks.value(endpoint="send_message", node="WriterAgentNode") == blocks + 1
+    assert loop_block_seconds.count(endpoint="send_message", node="WriterAgentNode") == observed + 1
+    # The loop thread's stack was captured while it was stuck, with the blocking call on top
+    stacks = [record.getMessage() for record in caplog.records if "loop thread stack" in record.getMessage()]
+    assert len(stacks) == 1 and "blocking_parse" in stacks[0]
+
+
+def test_tasks_created_from_a_labelled_task_inherit_its_labels():
+    async def child():
+        blocking_parse()
+
+    async def body():
+        await asyncio.gather(child())
+
+    blocks = loop_blocks.value(endpoint="none", node="MetaAgentNode")
+    asyncio.run(monitored(body, node="MetaAgentNode"))
+    assert loop_blocks.value(endpoint="none", node="MetaAgentNode") == blocks + 1
+
+
+def test_awaiting_does_not_count_as_a_block():
+    async def body():
+        await asyncio.sleep(0.3)
+
+    blocks = loop_blocks.value(endpoint="none", node="ReviewerAgentNode")
+    asyncio.run(monitored(body, node="ReviewerAgentNode"))
+    assert loop_blocks.value(endpoint="none", node="ReviewerAgentNode") == blocks
+
+
+def test_middleware_labels_the_request_task():
+    seen = []
+
+    async def app(scope, receive, send):
+        # Routing sets the endpoint after the middleware has labelled the task
+        scope["endpoint"] = send_message
+        seen.append(attribution(asyncio.current_task()))
+
+    async def scenario():
+        # One task per connection, as in the server
+        await asyncio.create_task(LoopMonitorMiddleware(app)({"type": "http"}, None, None))
+        await asyncio.create_task(LoopMonitorMiddleware(app)({"type": "lifespan"}, None, None))
+
+    asyncio.run(scenario())
+    assert seen == [("send_message", "none"), ("none", "none")]
+
+
+def test_stop_restores_the_task_factory():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        monitor = LoopMonitor(interval=0.02, threshold=0.1)
+        monitor.start()
+        assert loop.get_task_factory() == monitor._task_factory
+        monitor.stop()
+        assert loop.get_task_factory() is None
+
+    asyncio.run(scenario())
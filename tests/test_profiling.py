@@ -0,0 +1,106 @@
+# test_profiling.py
+# On-demand request profiling: stored sample and cProfile profiles, the one-at-a-time rule,
+# profile lookup and pruning. Profiles go to a temporary PROFILE_DIR.
+import asyncio
+import pstats
+import time
+
+import pytest
+
+from app import profiling
+from app.profiling import ProfilerBusy, list_profiles, profile_file, profiled_requests, run_profiled
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path / "profiles"))
+    return tmp_path / "profiles"
+
+
+def busy_turn(seconds: float = 0.1) -> int:
+    deadline, spins = time.perf_counter() + seconds, 0
+    while time.perf_counter() < deadline:
+        spins += 1
+    return spins
+
+
+async def turn(seconds: float = 0.1) -> str:
+    busy_turn(seconds)
+    await asyncio.sleep(0)
+    return "reply"
+
+
+def test_sample_profile_is_stored_as_collapsed_stacks():
+    result, profile_id = asyncio.run(run_profiled(turn(), "sample", label="send_message m1", user_id="u1"))
+    assert result == "reply"
+    path, info = profile_file(profile_id)
+    assert info.mode == "sample" and info.label == "send_message m1" and info.user_id == "u1"
+    assert info.samples > 0 and info.seconds >= 0.1
+    with open(path, encoding="utf-8") as handle:
+        lines = handle.read().splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == info.samples
+    assert any("busy_turn (test_profiling.py)" in line for line in lines)
+
+
+def test_cprofile_profile_is_a_pstats_file():
+    _, profile_id = asyncio.run(run_profiled(turn(0.01), " CProfile ", label="send_message m1", user_id="u1"))
+    path, info = profile_file(profile_id)
+    assert info.mode == "cprofile" and path.endswith(".pstats")
+    functions = {name for _, _, name in pstats.Stats(path).stats}
+    assert "busy_turn" in functions
+
+
+def test_unknown_mode_uses_the_default():
+    _, profile_id = asyncio.run(run_profiled(turn(0.01), "flamegraph", label="l", user_id="u1"))
+    assert profile_file(profile_id)[1].mode == profiling.PROFILE_DEFAULT_MODE
+
+
+def test_second_profile_while_one_runs_is_refused():
+    async def scenario():
+        first = asyncio.create_task(run_profiled(asyncio.sleep(0.05, "first"), "sample", label="a", user_id="u1"))
+        await asyncio.sleep(0.01)
+        second = turn(0.01)
+        busy = profiled_requests.value(mode="sample", outcome="busy")
+        with pytest.raises(ProfilerBusy):
+            await run_profiled(second, "sample", label="b", user_id="u1")
+        # Refused before awaiting anything: the caller still runs the request, unprofiled
+        assert await second == "reply"
+        assert profiled_requests.value(mode="sample", outcome="busy") == busy + 1
+        assert (await first)[0] == "first"
+        # ... and the next one is profiled again
+        assert (await run_profiled(turn(0.01), "sample", label="c", user_id="u1"))[1] is not None
+
+    asyncio.run(scenario())
+
+
+def test_failed_request_frees_the_profiler():
+    async def failing():
+        raise RuntimeError("writer failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run_profiled(failing(), "sample", label="a", user_id="u1"))
+    assert asyncio.run(run_profiled(turn(0.01), "sample", label="b", user_id="u1"))[1] is not None
+
+
+def test_profile_ids_are_validated():
+    _, profile_id = asyncio.run(run_profiled(turn(0.01), "sample", label="a", user_id="u1"))
+    assert profile_file(profile_id) is not None
+    assert profile_file("../" + profile_id) is None
+    assert profile_file(profile_id.upper()) is None
+    assert profile_file("0" * 32) is None
+
+
+def test_oldest_profiles_are_pruned(monkeypatch, profile_dir):
+    monkeypatch.setattr(profiling, "PROFILE_MAX_STORED", 2)
+    ids = [asyncio.run(run_profiled(turn(0.01), "sample", label=str(i), user_id="u1"))[1] for i in range(3)]
+    assert [info.profile_id for info in list_profiles()] == [ids[2], ids[1]]
+    assert sorted(path.name for path in profile_dir.iterdir()) == sorted(
+        f"{profile_id}.{suffix}" for profile_id in ids[1:] for suffix in ("collapsed.txt", "json")
+    )
+
+
+def test_unwritable_profile_dir_returns_the_result(monkeypatch, tmp_path):
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(blocker))
+    assert asyncio.run(run_profiled(turn(0.01), "sample", label="a", user_id="u1")) == ("reply", None)
@@ -0,0 +1,157 @@
+# test_result_cache.py
+# TurnResultCache against an in-memory fake of the Supabase PostgREST query builder.
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from app.result_cache import TurnResultCache
+
+RESPONSE = {"error": False, "response": "Welcome back!", "session_id": "s1"}
+
+
+class FakeQuery:
+    """The subset of the postgrest builder TurnResultCache uses: upsert, or select + eq + limit."""
+
+    def __init__(self, table: "FakeTable"):
+        self.table = table
+        self.filters: dict = {}
+        self.row: dict | None = None
+        self.count: int | None = None
+
+    def upsert(self, row: dict) -> "FakeQuery":
+        self.row = row
+        return self
+
+    def select(self, columns: str) -> "FakeQuery":
+        self.columns = [column.strip() for column in columns.split(",")]
+        return self
+
+    def eq(self, column: str, value) -> "FakeQuery":
+        self.filters[column] = value
+        return self
+
+    def limit(self, count: int) -> "FakeQuery":
+        self.count = count
+        return self
+
+    async def execute(self):
+        if self.table.fail:
+            raise RuntimeError("relation does not exist")
+        if self.row is not None:
+            self.table.rows[self.row["message_id"]] = dict(self.row)
+            return SimpleNamespace(data=[self.row])
+        self.table.selects += 1
+        rows = [
+            {column: row[column] for column in self.columns}
+            for row in self.table.rows.values()
+            if all(row.get(column) == value for column, value in self.filters.items())
+        ]
+        return SimpleNamespace(data=rows[:self.count])
+
+
+class FakeTable:
+    def __init__(self):
+        self.rows: dict[str, dict] = {}
+        self.selects = 0
+        self.fail = False
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.tables: dict[str, FakeTable] = {}
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self.tables.setdefault(name, FakeTable()))
+
+
+def make_cache(supabase: FakeSupabase, **kwargs) -> TurnResultCache:
+    return TurnResultCache(supabase_client=supabase, table="turn_results", persist=True, **kwargs)
+
+
+def test_memory_hit_skips_the_database():
+    async def scenario():
+        supabase = FakeSupabase()
+        cache = make_cache(supabase)
+        assert await cache.get("u1", "s1", "m1") is None
+        await cache.put("u1", "s1", "m1", RESPONSE)
+        selects = supabase.tables["turn_results"].selects
+        assert await cache.get("u1", "s1", "m1") == RESPONSE
+        assert supabase.tables["turn_results"].selects == selects
+
+    asyncio.run(scenario())
+
+
+def test_other_user_or_session_never_gets_the_response():
+    async def scenario():
+        supabase = FakeSupabase()
+        cache = make_cache(supabase)
+        await cache.put("u1", "s1", "m1", RESPONSE)
+        assert await cache.get("u2", "s1", "m1") is None
+        assert await cache.get("u1", "s2", "m1") is None
+        # A fresh process only has the table, which is filtered the same way
+        restarted = make_cache(supabase)
+        assert await restarted.get("u2", "s1", "m1") is None
+        assert await restarted.get("u1", "s2", "m1") is None
+        assert await cache.get("u1", "s1", "m1") == RESPONSE
+
+    asyncio.run(scenario())
+
+
+def test_database_hit_after_restart():
+    async def scenario():
+        supabase = FakeSupabase()
+        await make_cache(supabase).put("u1", "s1", "m1", RESPONSE)
+        restarted = make_cache(supabase)
+        assert await restarted.get("u1", "s1", "m1") == RESPONSE
+        # ... and it is kept in memory from then on
+        supabase.tables["turn_results"].fail = True
+        assert await restarted.get("u1", "s1", "m1") == RESPONSE
+
+    asyncio.run(scenario())
+
+
+def test_stored_rows_expire_by_created_at():
+    async def scenario():
+        supabase = FakeSupabase()
+        await make_cache(supabase, ttl=60).put("u1", "s1", "m1", RESPONSE)
+        row = supabase.tables["turn_results"].rows["m1"]
+        row["created_at"] = (datetime.now(timezone.utc) - timedelta(seconds=120)).isoformat()
+        assert await make_cache(supabase, ttl=60).get("u1", "s1", "m1") is None
+        assert await make_cache(supabase, ttl=600).get("u1", "s1", "m1") == RESPONSE
+
+    asyncio.run(scenario())
+
+
+def test_memory_entries_expire():
+    async def scenario():
+        cache = TurnResultCache(ttl=-1)
+        await cache.put("u1", "s1", "m1", RESPONSE)
+        assert await cache.get("u1", "s1", "m1") is None
+        assert len(cache._entries) == 0
+
+    asyncio.run(scenario())
+
+
+def test_errors_are_not_stored():
+    async def scenario():
+        supabase = FakeSupabase()
+        cache = make_cache(supabase)
+        await cache.put("u1", "s1", "m1", {**RESPONSE, "error": True})
+        assert await cache.get("u1", "s1", "m1") is None
+        assert not supabase.tables["turn_results"].rows
+
+    asyncio.run(scenario())
+
+
+def test_database_failures_fall_back_to_memory():
+    async def scenario():
+        supabase = FakeSupabase()
+        supabase.table("turn_results")
+        supabase.tables["turn_results"].fail = True
+        cache = make_cache(supabase)
+        await cache.put("u1", "s1", "m1", RESPONSE)
+        assert await cache.get("u1", "s1", "m1") == RESPONSE
+        assert await cache.get("u1", "s1", "m2") is None
+
+    asyncio.run(scenario())
+
@@ -0,0 +1,159 @@
+# test_tts.py
+# Sentence chunking of writer deltas, SpeechStream ordering and failure handling, and the Azure
+# Speech backend against an httpx.MockTransport endpoint.
+import asyncio
+import io
+import wave
+
+import httpx
+
+from app.tts import AzureSpeechBackend, SentenceChunker, SpeechStream, StubTTSBackend, tts_chunks
+
+REPLY = "Welcome back! Last time we talked about your data team. How many analysts work there now?"
+
+
+def test_sentences_are_cut_at_their_ends():
+    chunker = SentenceChunker(min_chars=10, max_chars=300)
+    chunks = []
+    for delta in ("Welcome ba", "ck! Last time we talked", " about your data team. How many", " analysts?"):
+        chunks += chunker.feed(delta)
+    assert chunks == ["Welcome back!", "Last time we talked about your data team."]
+    assert chunker.flush() == ["How many analysts?"]
+    assert chunker.flush() == []
+
+
+def test_short_sentences_are_merged():
+    chunker = SentenceChunker(min_chars=20, max_chars=300)
+    assert chunker.feed("Hi! Great. Tell me about your team. ") == ["Hi! Great. Tell me about your team."]
+
+
+def test_long_text_is_cut_at_a_soft_break():
+    chunker = SentenceChunker(min_chars=10, max_chars=40)
+    chunks = chunker.feed("We run pipelines, dashboards, forecasting models and a small data lake")
+    assert chunks == ["We run pipelines, dashboards,"]
+    # What is left fits, so it waits for a sentence end until it grows past the maximum again
+    assert chunker.feed(" that feeds them") == ["forecasting models and a small data"]
+    assert chunker.flush() == ["lake that feeds them"]
+
+
+def test_line_breaks_end_a_chunk():
+    chunker = SentenceChunker(min_chars=5, max_chars=300)
+    assert chunker.feed("First point here\nSecond point") == ["First point here"]
+
+
+class RecordingSink:
+    def __init__(self):
+        self.blocks: list[tuple[int, str, bytes, str]] = []
+
+    async def __call__(self, index: int, sentence: str, data: bytes, media_type: str) -> None:
+        self.blocks.append((index, sentence, data, media_type))
+
+
+def _duration(data: bytes) -> float:
+    with wave.open(io.BytesIO(data)) as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def test_speech_follows_the_deltas_in_order():
+    async def scenario():
+        sink = RecordingSink()
+        stream = SpeechStream(StubTTSBackend(delay=0.01), sink)
+        for word in REPLY.split(" "):
+            stream.feed(word + " ")
+        await stream.finish(REPLY)
+        # "Welcome back!" is shorter than TTS_MIN_CHUNK_CHARS and goes with the next sentence
+        assert [block[:2] for block in sink.blocks] == [
+            (0, "Welcome back! Last time we talked about your data team."),
+            (1, "How many analysts work there now?"),
+        ]
+        assert all(media_type == "audio/wav" for *_, media_type in sink.blocks)
+        assert _duration(sink.blocks[0][2]) > _duration(sink.blocks[1][2])
+
+    asyncio.run(scenario())
+
+
+def test_finish_speaks_the_text_when_nothing_was_fed():
+    async def scenario():
+        sink = RecordingSink()
+        stream = SpeechStream(StubTTSBackend(), sink)
+        await stream.finish(REPLY)
+        assert [sentence for _, sentence, _, _ in sink.blocks] == [
+            "Welcome back! Last time we talked about your data team.", "How many analysts work there now?",
+        ]
+
+    asyncio.run(scenario())
+
+
+def test_finish_without_text_is_silent():
+    async def scenario():
+        sink = RecordingSink()
+        await SpeechStream(StubTTSBackend(), sink).finish()
+        assert sink.blocks == []
+
+    asyncio.run(scenario())
+
+
+class FailingBackend(StubTTSBackend):
+    name = "failing"
+
+    def __init__(self, fail_at: int):
+        super().__init__()
+        self.fail_at = fail_at
+        self.calls = 0
+
+    async def synthesize(self, text: str):
+        self.calls += 1
+        if self.calls > self.fail_at:
+            raise httpx.ConnectError("speech endpoint unreachable")
+        async for data in super().synthesize(text):
+            yield data
+
+
+def test_backend_failure_stops_the_audio_only():
+    async def scenario():
+        sink = RecordingSink()
+        backend = FailingBackend(fail_at=1)
+        errors = tts_chunks.value(backend="failing", outcome="error")
+        stream = SpeechStream(backend, sink)
+        stream.feed(REPLY + " ")
+        await stream.finish(REPLY)
+        assert [sentence for _, sentence, _, _ in sink.blocks] == ["Welcome back! Last time we talked about your data team."]
+        assert backend.calls == 2
+        assert tts_chunks.value(backend="failing", outcome="error") == errors + 1
+
+    asyncio.run(scenario())
+
+
+def test_aclose_stops_a_running_stream():
+    async def scenario():
+        sink = RecordingSink()
+        stream = SpeechStream(StubTTSBackend(delay=10), sink)
+        stream.feed(REPLY + " ")
+        await asyncio.sleep(0)
+        await stream.aclose()
+        assert sink.blocks == []
+
+    asyncio.run(scenario())
+
+
+def test_azure_backend_streams_the_response_body():
+    requests: list[httpx.Request] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, content=b"mp3-frames")
+
+    async def scenario():
+        http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        backend = AzureSpeechBackend(key="fake", region="swedencentral", voice="en-US-AvaMultilingualNeural",
+                                     output_format="audio-24khz-48kbitrate-mono-mp3", http_client=http)
+        audio = b"".join([data async for data in backend.synthesize("Tom & Jerry's <team>")])
+        await http.aclose()
+        return backend, audio
+
+    backend, audio = asyncio.run(scenario())
+    assert audio == b"mp3-frames" and backend.media_type == "audio/mpeg"
+    request = requests[0]
+    assert request.url.host == "swedencentral.tts.speech.microsoft.com"
+    assert request.headers["X-Microsoft-OutputFormat"] == "audio-24khz-48kbitrate-mono-mp3"
+    assert "Tom &amp; Jerry's &lt;team&gt;" in request.content.decode()